@@ -0,0 +1,57 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from authentication.models import AuthToken
+from base.authentication import BaseTokenAuthentication
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measures BaseTokenAuthentication latency (token cache bypassed) while AuthToken grows to --tokens rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=1000000)
+        parser.add_argument('--steps', type=int, default=4)
+        parser.add_argument('--probes', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keep', action='store_true', help='Keep generated tokens')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(trashed=False).first()
+        if user is None:
+            self.stderr.write('Create at least one active user first.')
+            return
+
+        authentication = BaseTokenAuthentication()
+        step_size = options['tokens'] // options['steps']
+        last_id = AuthToken.all_objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        try:
+            for _ in range(options['steps']):
+                self._create_tokens(user, step_size, options['batch_size'])
+                keys = list(AuthToken.objects.order_by('?').values_list('key', flat=True)[:options['probes']])
+
+                started = time.perf_counter()
+                for key in keys:
+                    authentication.token_cache.invalidate(key)
+                    authentication.authenticate_credentials(key.hex)
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write('{count} tokens: {latency:.3f} ms/auth'.format(
+                    count=AuthToken.all_objects.count(),
+                    latency=elapsed * 1000 / max(len(keys), 1)
+                ))
+        finally:
+            if not options['keep']:
+                AuthToken.all_objects.filter(id__gt=last_id, user=user).delete(forced=True)
+
+    @staticmethod
+    def _create_tokens(user, count, batch_size):
+        for offset in range(0, count, batch_size):
+            with transaction.atomic():
+                AuthToken.all_objects.bulk_create([
+                    AuthToken(key=uuid.uuid4(), user=user) for _ in range(min(batch_size, count - offset))
+                ])
@@ -6,7 +6,7 @@ from utils import helpers
 
 
 class AuthToken(BaseModel):
-    key = models.CharField(max_length=100)
+    key = models.UUIDField(unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tokens')
 
     def save(self, *args, **kwargs):
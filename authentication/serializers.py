@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.db.models import ObjectDoesNotExist
 from rest_framework import serializers
 from authentication.models import AuthToken
@@ -9,12 +10,12 @@ from base.token_expire_handler import is_token_expired
 from rest_framework import exceptions
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
-from django.template import loader
-from base.tasks import send_email
+from base import notifications
 from utils import constants
 
 
 class AuthTokenSerializer(serializers.ModelSerializer):
+    key = serializers.UUIDField(format='hex', read_only=True)
     user = UserSerializer()
 
     class Meta:
@@ -52,14 +53,15 @@ class SignupSerializer(serializers.ModelSerializer):
             validated_data['last_name'] = validated_data.get('last_name', invite.last_name)
             validated_data['role'] = invite.role
             validated_data['organization'] = admin.organization
-            instance = super().create(validated_data)
-            invite.delete()
-            recipient_email = invite.email
-            context = {
-                'organization_name': admin.organization.name
-            }
-            html_message = loader.get_template('welcome.html').render(context)
-            send_email.delay(html_message=html_message, recipient_email=recipient_email, subject=constants.SUBJECT_WELCOME)
+            with transaction.atomic():
+                instance = super().create(validated_data)
+                invite.delete()
+                recipient_email = invite.email
+                context = {
+                    'organization_name': admin.organization.name
+                }
+                notifications.notify(recipient_email, 'welcome.html', context, constants.SUBJECT_WELCOME,
+                                     dedup_key='welcome:{id}'.format(id=instance.id))
             return instance
         except ObjectDoesNotExist:
             raise InvitationFailed
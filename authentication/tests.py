@@ -8,6 +8,7 @@ from ddf import G
 
 from user.models import User
 from authentication.models import AuthToken
+from base.token_cache import TokenCache, token_cache
 
 from utils.constants import ROLE
 
@@ -24,6 +25,7 @@ class LoginTests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(AuthToken.objects.count(), 1)
+        self.assertEqual(response.data['key'], AuthToken.objects.get().key.hex)
 
     def test_login_incorrect_credentials(self):
         url = reverse('authentication:authentication-login')
@@ -38,3 +40,46 @@ class LoginTests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(AuthToken.objects.count(), 0)
+
+
+class TokenCacheTests(APITestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                      role=ROLE.ADMIN, organization__name="JTG")
+        self.token = G(AuthToken, user=self.user)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token.key)}
+
+    def test_token_lookup_is_cached(self):
+        url = reverse('user-list')
+        self.client.get(url, **self.auth_headers)
+        self.client.get(url, **self.auth_headers)
+        self.assertEqual(token_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_logout_invalidates_cached_token(self):
+        url = reverse('authentication:authentication-logout')
+        response = self.client.post(url, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivating_user_invalidates_cached_token(self):
+        url = reverse('user-list')
+        self.client.get(url, **self.auth_headers)
+        self.user.trashed = True
+        self.user.save()
+        response = self.client.get(url, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalidation_reaches_other_processes(self):
+        # Another process: its own local tier, same invalidation cache
+        other = TokenCache()
+        other.set(self.token)
+        self.assertIsNotNone(other.get(self.token.key))
+        token_cache.invalidate_user(self.user.id)
+        self.assertIsNone(other.get(self.token.key))
+
+        other.set(AuthToken.objects.get(id=self.token.id))
+        token_cache.invalidate(self.token.key)
+        self.assertIsNone(other.get(self.token.key))
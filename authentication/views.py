@@ -4,6 +4,7 @@ from rest_framework.decorators import action, parser_classes
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from authentication.serializers import LoginSerializer, AuthTokenSerializer, SignupSerializer
+from base.token_cache import token_cache
 
 
 class AuthView(viewsets.ViewSet):
@@ -30,6 +31,7 @@ class AuthView(viewsets.ViewSet):
     @action(methods=['post'], detail=False)
     def logout(self, request):
         request.auth.delete()
+        token_cache.invalidate(request.auth.key)
         return Response()
 
     @action(methods=['post'], detail=True)
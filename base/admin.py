@@ -1,3 +1,8 @@
 from django.contrib import admin
+from base.model_admin import BaseModelAdmin
+from base.models import DigestEvent, JobLock, OutboxEmail
 
-# Register your models here.
+
+admin.site.register(JobLock, BaseModelAdmin)
+admin.site.register(OutboxEmail, BaseModelAdmin)
+admin.site.register(DigestEvent, BaseModelAdmin)
@@ -3,22 +3,35 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 
 from authentication.models import AuthToken
+from base.token_cache import token_cache
 from base.token_expire_handler import is_token_expired
+from utils import helpers
 
 
 class BaseTokenAuthentication(TokenAuthentication):
     model = AuthToken
+    token_cache = token_cache
 
     def authenticate_credentials(self, key):
-        try:
-            token = AuthToken.objects.select_related('user').get(key=key)
-        except ObjectDoesNotExist:
+        key = helpers.parse_key(key)
+        if key is None:
             raise AuthenticationFailed('Invalid token')
 
-        if not token.user.is_active:
+        token = self.token_cache.get(key)
+        cached = token is not None
+        if not cached:
+            try:
+                token = AuthToken.objects.select_related('user').get(key=key)
+            except ObjectDoesNotExist:
+                raise AuthenticationFailed('Invalid token')
+
+        if not token.user.is_active or token.user.trashed:
             raise AuthenticationFailed('User inactive or deleted.')
 
         is_expired = is_token_expired(token)
         if is_expired:
+            self.token_cache.invalidate(key)
             raise AuthenticationFailed('Authentication token expired')
+        if not cached:
+            self.token_cache.set(token)
         return token.user, token
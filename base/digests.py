@@ -0,0 +1,142 @@
+import json
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from base import outbox
+from base.models import DigestEvent
+from utils import constants
+
+DIGEST_TEMPLATE = 'digest.html'
+
+
+def window(organization, template_name):
+    """
+    Digest window of a notification, None when it is sent right away: the organization has no window
+    or the template has no digest line (NOTIFICATION_DIGEST_LINES)
+    """
+    if organization is None or not organization.digest_window_minutes:
+        return None
+    if template_name not in settings.NOTIFICATION_DIGEST_LINES:
+        return None
+    return timedelta(minutes=organization.digest_window_minutes)
+
+
+def _flush_at(recipient_email, delay, now):
+    # Events join the open window of their recipient, the first one opens it
+    open_window = DigestEvent.objects.filter(
+        recipient_email=recipient_email, flushed_at__isnull=True
+    ).order_by('flush_at').values_list('flush_at', flat=True).first()
+    return open_window or now + delay
+
+
+def buffer(organization, recipient_email, template_name, context, subject, dedup_key=None):
+    """
+    Buffers a notification (context as JSON) for the digest of its recipient
+    :return: DigestEvent or None if dedup_key was already buffered
+    """
+    delay = window(organization, template_name)
+    try:
+        with transaction.atomic():
+            return DigestEvent.objects.create(
+                dedup_key=dedup_key or uuid.uuid4().hex,
+                organization=organization,
+                recipient_email=recipient_email,
+                subject=subject,
+                template_name=template_name,
+                context=context,
+                flush_at=_flush_at(recipient_email, delay, timezone.now())
+            )
+    except IntegrityError:
+        return None
+
+
+def buffer_many(organization, notifications, delay):
+    """
+    :param notifications: list of (recipient_email, subject, template_name, context, dedup_key)
+    :return: number of events buffered
+    """
+    existing = set(DigestEvent.all_objects.filter(
+        dedup_key__in=[notification[-1] for notification in notifications]
+    ).values_list('dedup_key', flat=True))
+    now = timezone.now()
+    flush_at = {}
+    events = []
+    for recipient_email, subject, template_name, context, dedup_key in notifications:
+        if dedup_key in existing:
+            continue
+        if recipient_email not in flush_at:
+            flush_at[recipient_email] = _flush_at(recipient_email, delay, now)
+        events.append(DigestEvent(dedup_key=dedup_key, organization=organization, recipient_email=recipient_email,
+                                  subject=subject, template_name=template_name, context=context,
+                                  flush_at=flush_at[recipient_email]))
+    DigestEvent.objects.bulk_create(events)
+    return len(events)
+
+
+def digest_context(events):
+    """
+    Context of digest.html: the one line summary of every event grouped under its subject.
+    Events counting items (num_items) which are otherwise equal are summed up in one line.
+    """
+    merged = OrderedDict()
+    for event in events:
+        context = json.loads(event.context or '{}')
+        if 'num_items' in context:
+            rest = {key: value for key, value in context.items() if key != 'num_items'}
+            key = (event.subject, event.template_name, json.dumps(rest, sort_keys=True))
+            if key in merged:
+                merged[key][2]['num_items'] += context['num_items']
+                continue
+        else:
+            key = event.id
+        merged[key] = (event.subject, event.template_name, context)
+
+    sections = OrderedDict()
+    for subject, template_name, context in merged.values():
+        sections.setdefault(subject, []).append(settings.NOTIFICATION_DIGEST_LINES[template_name].format(**context))
+    return {
+        'num_events': len(events),
+        'sections': [{'subject': subject, 'lines': lines} for subject, lines in sections.items()]
+    }
+
+
+def flush_recipient(recipient_email, now=None):
+    """
+    Writes the pending events of a recipient to the outbox as one email once the earliest is due.
+    A single event is sent as its own notification.
+    :return: number of events flushed
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        events = list(DigestEvent.objects.select_for_update(skip_locked=True).filter(
+            recipient_email=recipient_email, flushed_at__isnull=True
+        ).order_by('id'))
+        if not events or min(event.flush_at for event in events) > now:
+            return 0
+        if len(events) == 1:
+            event = events[0]
+            outbox.enqueue(recipient_email, event.subject, template_name=event.template_name, context=event.context,
+                           dedup_key=event.dedup_key, priority=constants.EMAIL_PRIORITY.BULK)
+        else:
+            outbox.enqueue(recipient_email, constants.SUBJECT_DIGEST.format(num_events=len(events)),
+                           template_name=DIGEST_TEMPLATE, context=json.dumps(digest_context(events)),
+                           dedup_key='digest:{id}'.format(id=events[0].id), priority=constants.EMAIL_PRIORITY.BULK)
+        DigestEvent.objects.filter(id__in=[event.id for event in events]).update(flushed_at=now, updated_at=now)
+    return len(events)
+
+
+def flush(now=None):
+    """
+    Flushes the digest of every recipient with an event due
+    :return: number of events flushed
+    """
+    now = now or timezone.now()
+    recipients = DigestEvent.objects.filter(
+        flushed_at__isnull=True, flush_at__lte=now
+    ).order_by().values_list('recipient_email', flat=True).distinct()
+    return sum(flush_recipient(recipient_email, now) for recipient_email in list(recipients))
@@ -0,0 +1,152 @@
+import functools
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Q
+from django.db.models.functions import Now
+
+from base.models import JobLock
+
+_local = threading.local()
+
+
+class LockLost(Exception):
+    """
+    The lease expired or was taken over (fenced) while the job was running
+    """
+
+
+def expires_at(ttl):
+    # Leases are taken, renewed and checked against the database clock, never the clock of the host running the job
+    return ExpressionWrapper(Now() + timedelta(seconds=ttl), output_field=DateTimeField())
+
+
+def owner_id():
+    return '{host}:{pid}:{nonce}'.format(host=socket.gethostname(), pid=os.getpid(), nonce=uuid.uuid4().hex[:8])
+
+
+class JobLease(object):
+    """
+    Lease on a JobLock row. Used as a context manager it is renewed every ttl / 3 from a heartbeat thread and
+    released on exit. Work done under it can call check() at batch boundaries to stop once fenced.
+    """
+
+    def __init__(self, name, owner, token, ttl):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def renew(self):
+        renewed = JobLock.objects.filter(
+            name=self.name, token=self.token, expires_at__gte=Now()
+        ).update(expires_at=expires_at(self.ttl))
+        if not renewed:
+            self.lost = True
+        return bool(renewed)
+
+    def release(self):
+        JobLock.objects.filter(name=self.name, token=self.token).update(owner='', expires_at=None)
+
+    def is_valid(self):
+        return not self.lost and JobLock.objects.filter(
+            name=self.name, token=self.token, expires_at__gte=Now()
+        ).exists()
+
+    def check(self):
+        if not self.is_valid():
+            self.lost = True
+            raise LockLost(self.name)
+
+    def _beat(self):
+        try:
+            while not self._stop.wait(self.ttl / 3.0):
+                if not self.renew():
+                    return
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._beat, name='job-lock-' + self.name, daemon=True)
+        self._heartbeat.start()
+        _local.lease = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.lease = None
+        self._stop.set()
+        self._heartbeat.join()
+        self.release()
+        return False
+
+
+def acquire(name, ttl=None, owner=None):
+    """
+    Takes the lease of name if it is free or expired, bumping the fencing token
+    :return: JobLease or None if someone else holds it
+    """
+    ttl = ttl or settings.JOB_LOCK_TTL_SECONDS
+    owner = owner or owner_id()
+    try:
+        with transaction.atomic():
+            JobLock.objects.get_or_create(name=name)
+    except IntegrityError:
+        pass
+    # Conditional UPDATE, only one of concurrent acquirers matches the free/expired row
+    acquired = JobLock.objects.filter(name=name).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__lt=Now())
+    ).update(owner=owner, token=F('token') + 1, acquired_at=Now(), expires_at=expires_at(ttl))
+    if not acquired:
+        return None
+    token = JobLock.objects.filter(name=name, owner=owner).values_list('token', flat=True).first()
+    if token is None:
+        return None
+    return JobLease(name, owner, token, ttl)
+
+
+def force_release(name):
+    """
+    Frees a lock whatever its holder, the fencing token is bumped so the old holder's checks fail
+    """
+    return JobLock.objects.filter(name=name).update(owner='', expires_at=None, token=F('token') + 1)
+
+
+def current():
+    """
+    Lease held by the running single flight job of this thread, if any
+    """
+    return getattr(_local, 'lease', None)
+
+
+def check_current():
+    lease = current()
+    if lease is not None:
+        lease.check()
+
+
+def single_flight(name=None, ttl=None):
+    """
+    Runs the decorated function only if the lease of name (default: function name) can be taken,
+    skipped (returns None) while another process holds it
+    """
+
+    def decorator(func):
+        lock_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lease = acquire(lock_name, ttl)
+            if lease is None:
+                return None
+            with lease:
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,42 @@
+import time
+from functools import partial
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from base.smtp_sink import SMTPSink
+from base.transport import ConnectionPool, TokenBucket, Transport
+
+
+class Command(BaseCommand):
+    help = 'Sends emails through the transport to an in-process SMTP sink and reports the throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Number of emails (default 1000)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Emails per connection checkout')
+        parser.add_argument('--pool-size', type=int, default=None, help='Idle connections kept open')
+        parser.add_argument('--rate', type=float, default=0, help='Emails per second, 0 is unlimited (default)')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds the sink waits on every message')
+        parser.add_argument('--no-pool', action='store_true', help='Open a connection per email')
+
+    def handle(self, *args, **options):
+        with SMTPSink(latency=options['latency']) as sink:
+            factory = partial(get_connection, 'django.core.mail.backends.smtp.EmailBackend', host=sink.host,
+                              port=sink.port, username='', password='', use_tls=False, use_ssl=False)
+            pool = ConnectionPool(factory, size=0 if options['no_pool'] else options['pool_size'])
+            transport = Transport(pool, TokenBucket(options['rate']))
+            messages = [
+                EmailMessage('Benchmark {n}'.format(n=n), 'Benchmark', 'benchmark@localhost', ['sink@localhost'])
+                for n in range(options['count'])
+            ]
+
+            started = time.monotonic()
+            errors = transport.send(messages, batch_size=1 if options['no_pool'] else options['batch_size'])
+            elapsed = time.monotonic() - started
+            pool.close_all()
+
+        failed = sum(1 for error in errors if error is not None)
+        self.stdout.write('Sent {sent} emails ({failed} failed) in {elapsed:.2f}s, {rate:.0f}/s over {connections} '
+                          'connections.'.format(sent=len(messages) - failed, failed=failed, elapsed=elapsed,
+                                                rate=len(messages) / elapsed if elapsed else 0,
+                                                connections=sink.connections))
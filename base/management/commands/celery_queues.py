@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from hardwareManager.celery_settings import WORKERS, app
+
+
+class Command(BaseCommand):
+    help = 'Shows the number of messages waiting in each celery queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', action='store_true', help='Print the worker command of each queue instead')
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            for queue, worker in sorted(WORKERS.items()):
+                self.stdout.write('celery -A hardwareManager worker -Q {queue} -c {concurrency} '
+                                  '--prefetch-multiplier {prefetch_multiplier} -n {queue}@%h'.format(queue=queue,
+                                                                                                     **worker))
+            return
+
+        self.stdout.write('{:<20} {:>10} {:>10}'.format('QUEUE', 'MESSAGES', 'CONSUMERS'))
+        with app.connection_for_read() as connection:
+            for queue in sorted(WORKERS):
+                # Passive declare only reads the queue, it fails (and closes its channel) if it doesn't exist yet
+                channel = connection.channel()
+                try:
+                    _, messages, consumers = channel.queue_declare(queue=queue, passive=True)
+                except connection.channel_errors:
+                    messages, consumers = '-', '-'
+                finally:
+                    try:
+                        channel.close()
+                    except connection.channel_errors:
+                        pass
+                self.stdout.write('{:<20} {:>10} {:>10}'.format(queue, messages, consumers))
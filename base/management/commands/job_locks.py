@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base import job_lock
+from base.models import JobLock
+
+
+class Command(BaseCommand):
+    help = 'Shows the state of the periodic job locks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--release', metavar='NAME', help='Force release a lock (fences its current holder)')
+
+    def handle(self, *args, **options):
+        if options['release']:
+            released = job_lock.force_release(options['release'])
+            self.stdout.write('Released {name}.'.format(name=options['release']) if released else
+                              'No lock named {name}.'.format(name=options['release']))
+            return
+
+        now = timezone.now()
+        rows = JobLock.objects.order_by('name')
+        if not rows:
+            self.stdout.write('No job locks.')
+            return
+        self.stdout.write('{:<40} {:<8} {:>8} {:>12}  {}'.format('NAME', 'STATE', 'TOKEN', 'EXPIRES IN', 'OWNER'))
+        for lock in rows:
+            if lock.expires_at is None:
+                state, expires_in = 'free', '-'
+            elif lock.expires_at < now:
+                state, expires_in = 'expired', '-'
+            else:
+                state, expires_in = 'held', '{:.0f}s'.format((lock.expires_at - now).total_seconds())
+            self.stdout.write('{:<40} {:<8} {:>8} {:>12}  {}'.format(
+                lock.name, state, lock.token, expires_in, lock.owner or '-'
+            ))
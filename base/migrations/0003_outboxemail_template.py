@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxemail',
+            name='template_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='outboxemail',
+            name='context',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='html_message',
+            field=models.TextField(blank=True),
+        ),
+    ]
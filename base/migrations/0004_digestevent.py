@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0002_organization_digest_window_minutes'),
+        ('base', '0003_outboxemail_template'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('dedup_key', models.CharField(max_length=255, unique=True)),
+                ('recipient_email', models.EmailField(max_length=254)),
+                ('subject', models.CharField(max_length=255)),
+                ('template_name', models.CharField(max_length=100)),
+                ('context', models.TextField(blank=True)),
+                ('flush_at', models.DateTimeField()),
+                ('flushed_at', models.DateTimeField(blank=True, null=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='organization.Organization')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='digestevent',
+            index=models.Index(fields=['flushed_at', 'flush_at'], name='base_digest_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='digestevent',
+            index=models.Index(fields=['recipient_email', 'flushed_at'], name='base_digest_recipient_idx'),
+        ),
+    ]
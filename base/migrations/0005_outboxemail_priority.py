@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_digestevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxemail',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(26, 'Interactive'), (27, 'Bulk')], default=26),
+        ),
+        migrations.RemoveIndex(
+            model_name='outboxemail',
+            name='base_outbox_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['priority', 'sent_at', 'available_at'], name='base_outbox_queue_idx'),
+        ),
+    ]
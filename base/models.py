@@ -1,10 +1,15 @@
 from django.db import models
 from django.db.models.query import QuerySet
 
+from utils import constants
+
 
 class BaseQuerySet(QuerySet):
 
-    def delete(self):
+    def delete(self, **kwargs):
+        forced_delete = kwargs.pop('forced', False)
+        if forced_delete:
+            return super(BaseQuerySet, self).delete()
         super(BaseQuerySet, self).update(**{'trashed': True})
 
 
@@ -45,3 +50,68 @@ class BaseModel(models.Model):
             self.trashed = True
             self.save()
 
+
+class JobLock(BaseModel):
+    """
+    Lease of a single flight job (see base.job_lock). token is the fencing token, incremented on every acquisition.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=255, blank=True)
+    token = models.BigIntegerField(default=0)
+    acquired_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.name
+
+
+class OutboxEmail(BaseModel):
+    """
+    Email written in the transaction of the change it is about and delivered by the relay (base.outbox).
+    Notifications store a template name and its JSON context, rendered by the worker delivering them.
+    """
+    dedup_key = models.CharField(max_length=255, unique=True)
+    recipient_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    template_name = models.CharField(max_length=100, blank=True)
+    context = models.TextField(blank=True)
+    html_message = models.TextField(blank=True)
+    # Interactive and bulk emails are relayed separately, bulk runs never hold up interactive emails
+    priority = models.PositiveSmallIntegerField(choices=constants.EMAIL_PRIORITY_CHOICES,
+                                                default=constants.EMAIL_PRIORITY.INTERACTIVE)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField()
+    sent_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['priority', 'sent_at', 'available_at'], name='base_outbox_queue_idx'),
+        ]
+
+    def __str__(self):
+        return self.dedup_key
+
+
+class DigestEvent(BaseModel):
+    """
+    Notification buffered for its recipient until flush_at, then sent with the others of the window
+    as one digest email (base.digests)
+    """
+    dedup_key = models.CharField(max_length=255, unique=True)
+    organization = models.ForeignKey('organization.Organization', on_delete=models.CASCADE, related_name='+')
+    recipient_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    template_name = models.CharField(max_length=100)
+    context = models.TextField(blank=True)
+    flush_at = models.DateTimeField()
+    flushed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['flushed_at', 'flush_at'], name='base_digest_pending_idx'),
+            models.Index(fields=['recipient_email', 'flushed_at'], name='base_digest_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return self.dedup_key
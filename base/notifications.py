@@ -0,0 +1,124 @@
+import json
+import threading
+from collections import OrderedDict
+
+import html2text
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template import loader
+
+from base import digests, outbox
+from utils import constants
+
+
+def notify(recipient_email, template_name, context, subject, dedup_key=None, organization=None,
+           priority=constants.EMAIL_PRIORITY.INTERACTIVE):
+    """
+    Queues a templated email: only the template name and context (JSON serializable) are stored,
+    rendering and the plain text version are done by the worker delivering it.
+    Buffered for the recipient's digest instead when organization has a digest window (base.digests).
+    Jobs (as opposed to requests of a user waiting for the email) pass EMAIL_PRIORITY.BULK.
+    :return: OutboxEmail (DigestEvent) or None if dedup_key was already queued
+    """
+    context = json.dumps(context, cls=DjangoJSONEncoder)
+    if digests.window(organization, template_name) is not None:
+        return digests.buffer(organization, recipient_email, template_name, context, subject, dedup_key)
+    return outbox.enqueue(recipient_email, subject, template_name=template_name, context=context, dedup_key=dedup_key,
+                          priority=priority)
+
+
+def notify_many(notifications, organization=None, priority=constants.EMAIL_PRIORITY.BULK):
+    """
+    :param notifications: list of (recipient_email, template_name, context, subject, dedup_key)
+    :param organization: organization of all notifications, for its digest window
+    :return: number of emails (or digest events) queued
+    """
+    messages = [
+        (recipient_email, subject, template_name, json.dumps(context, cls=DjangoJSONEncoder), dedup_key)
+        for recipient_email, template_name, context, subject, dedup_key in notifications
+    ]
+    digested = [message for message in messages if digests.window(organization, message[2]) is not None]
+    sent = [message for message in messages if digests.window(organization, message[2]) is None]
+    queued = outbox.enqueue_many(sent, priority) if sent else 0
+    if digested:
+        queued += digests.buffer_many(organization, digested, digests.window(organization, digested[0][2]))
+    return queued
+
+
+class RenderCache(object):
+    """
+    Bounded LRU of rendered notifications keyed by template name and normalized context:
+    a reminder run renders each distinct body once whatever its number of recipients
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(template_name, context):
+        return template_name, json.dumps(context, sort_keys=True, cls=DjangoJSONEncoder)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+render_cache = RenderCache(settings.NOTIFICATION_RENDER_CACHE_SIZE)
+
+
+def _render(template_name, context):
+    html_message = loader.get_template(template_name).render(context)
+    h = html2text.HTML2Text()
+    h.ignore_links = False
+    return html_message, h.handle(html_message)
+
+
+def render(template_name, context):
+    """
+    :return: (html, plain text) of a notification, from render_cache when already rendered with an equal context
+    """
+    key = render_cache.key(template_name, context)
+    rendered = render_cache.get(key)
+    if rendered is None:
+        rendered = _render(template_name, context)
+        render_cache.set(key, rendered)
+    return rendered
+
+
+def render_email(email):
+    """
+    (html, plain text) of an OutboxEmail, emails queued before notifications carry their html
+    """
+    if email.template_name:
+        return render(email.template_name, json.loads(email.context or '{}'))
+    h = html2text.HTML2Text()
+    h.ignore_links = False
+    return email.html_message, h.handle(email.html_message)
+
+
+def warm(template_names=None):
+    """
+    Compiles the notification templates ahead of the first email, kept by the cached template loader
+    (used when DEBUG is off) for the life of the process
+    """
+    for template_name in template_names or settings.NOTIFICATION_TEMPLATES:
+        loader.get_template(template_name)
@@ -0,0 +1,160 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from base import notifications, transport
+from base.models import OutboxEmail
+from utils import constants
+from utils.helpers import html_email
+
+
+def enqueue(recipient_email, subject, template_name='', context='', html_message='', dedup_key=None,
+            priority=constants.EMAIL_PRIORITY.INTERACTIVE):
+    """
+    Writes an email to the outbox, call inside the transaction of the change it is about so it is only sent
+    if that commits. An email whose dedup_key is already in the outbox is dropped.
+    Notifications (base.notifications) store a template name and JSON context instead of the html.
+    :return: OutboxEmail or None if it was a duplicate
+    """
+    try:
+        with transaction.atomic():
+            return OutboxEmail.objects.create(
+                dedup_key=dedup_key or uuid.uuid4().hex,
+                recipient_email=recipient_email,
+                subject=subject,
+                template_name=template_name,
+                context=context,
+                html_message=html_message,
+                priority=priority,
+                available_at=timezone.now()
+            )
+    except IntegrityError:
+        return None
+
+
+def enqueue_many(messages, priority=constants.EMAIL_PRIORITY.BULK):
+    """
+    :param messages: list of (recipient_email, subject, template_name, context, dedup_key)
+    :return: number of emails written
+    """
+    existing = set(OutboxEmail.all_objects.filter(
+        dedup_key__in=[message[-1] for message in messages]
+    ).values_list('dedup_key', flat=True))
+    now = timezone.now()
+    emails = [
+        OutboxEmail(dedup_key=dedup_key, recipient_email=recipient_email, subject=subject,
+                    template_name=template_name, context=context, priority=priority, available_at=now)
+        for recipient_email, subject, template_name, context, dedup_key in messages if dedup_key not in existing
+    ]
+    OutboxEmail.objects.bulk_create(emails)
+    return len(emails)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_MAX_RETRY_SECONDS))
+
+
+def relay_batch(batch_size=None, priority=None):
+    """
+    Delivers the next batch of pending emails, straight to SMTP over one connection or handed to a celery
+    worker (OUTBOX_RELAY_MODE) which renders and sends them. Rows stay locked (skipped by concurrent relays) until
+    they are marked sent, a crash before that sends them again: delivery is at least once.
+    In celery mode rows are only leased for OUTBOX_HANDOFF_SECONDS, emails of a lost task are relayed again after it.
+    :param priority: only relay emails of this EMAIL_PRIORITY (default all)
+    :return: number of emails delivered (or handed off)
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        emails = pending()
+        if priority is not None:
+            emails = emails.filter(priority=priority)
+        emails = list(emails.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not emails:
+            return 0
+
+        if settings.OUTBOX_RELAY_MODE == 'celery':
+            from base.tasks import deliver_outbox
+            email_ids = [email.id for email in emails]
+            OutboxEmail.objects.filter(id__in=email_ids).update(
+                available_at=timezone.now() + timedelta(seconds=settings.OUTBOX_HANDOFF_SECONDS)
+            )
+            # The priority kwarg routes the task to the queue of its emails (hardwareManager.celery_settings)
+            transaction.on_commit(lambda: deliver_outbox.delay(email_ids=email_ids, priority=emails[0].priority))
+            return len(emails)
+        return send(emails)
+
+
+def pending(now=None):
+    return OutboxEmail.objects.filter(
+        sent_at__isnull=True,
+        available_at__lte=now or timezone.now(),
+        attempts__lt=settings.OUTBOX_MAX_ATTEMPTS
+    )
+
+
+def deliver(email_ids):
+    """
+    Renders and sends the emails handed off by a celery mode relay, the ones already sent are skipped
+    :return: number of emails delivered
+    """
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+            id__in=email_ids, sent_at__isnull=True
+        ).order_by('id'))
+        return send(emails) if emails else 0
+
+
+def send(emails):
+    """
+    Sends locked OutboxEmail rows, marks the delivered ones sent and backs off the failed ones
+    :return: number of emails delivered
+    """
+    now = timezone.now()
+    sent, failed = _deliver(emails)
+    OutboxEmail.objects.filter(id__in=[email.id for email in sent]).update(sent_at=timezone.now())
+    for email, error in failed:
+        email.attempts += 1
+        email.available_at = now + retry_delay(email.attempts)
+        email.last_error = error
+        email.save(update_fields=['attempts', 'available_at', 'last_error', 'updated_at'])
+    return len(sent)
+
+
+def relay(max_batches=None, priority=None):
+    """
+    Drains the outbox (emails of priority, default all) until it is empty (or max_batches were relayed)
+    :return: number of emails delivered
+    """
+    delivered = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = relay_batch(priority=priority)
+        if not count:
+            return delivered
+        delivered += count
+        batches += 1
+    return delivered
+
+
+def _deliver(emails):
+    sent = []
+    failed = []
+    rendered = []
+    for email in emails:
+        try:
+            html_message, text = notifications.render_email(email)
+        except Exception as e:
+            failed.append((email, str(e)))
+        else:
+            rendered.append((email, html_email(email.subject, text, html_message, settings.EMAIL_HOST_USER,
+                                               [email.recipient_email])))
+    errors = transport.send([message for _, message in rendered])
+    for (email, _), error in zip(rendered, errors):
+        if error is None:
+            sent.append(email)
+        else:
+            failed.append((email, str(error)))
+    return sent, failed
@@ -0,0 +1,128 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+ALL_COLUMNS = None
+
+
+class QueryPlan(object):
+    """
+    Derives select_related, prefetch_related and only() of a queryset from the field sources of a serializer.
+    - forward FK / one to one hops are joined with select_related
+    - reverse FK / many to many hops (nested many=True serializers) are prefetched
+    - columns are restricted to the ones the serializer reads, unless a level has a SerializerMethodField
+      (or source='*') or reads a non field attribute (property), then every column of that model is loaded
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.select = set()
+        self.prefetch = set()
+        self.columns = {}
+        self.models = {}
+
+    def apply(self, queryset):
+        self.select.clear()
+        self.prefetch.clear()
+        self.columns.clear()
+        self.models.clear()
+        self._walk(self.serializer_class().fields.values(), queryset.model, ())
+
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*sorted(self.prefetch))
+        return queryset.only(*self._only())
+
+    def _walk(self, fields, model, path):
+        self._need(model, path, model._meta.pk.name)
+        for field in fields:
+            if isinstance(field, serializers.HiddenField) or field.write_only:
+                continue
+            if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+                self._need(model, path, ALL_COLUMNS)
+                continue
+
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            current_model, current_path, prefetched = model, path, False
+            attrs = field.source_attrs
+            for index, attr in enumerate(attrs):
+                try:
+                    model_field = current_model._meta.get_field(attr)
+                except FieldDoesNotExist:
+                    self._need(current_model, current_path, ALL_COLUMNS)
+                    break
+
+                if not model_field.is_relation:
+                    self._need(current_model, current_path, model_field.name)
+                    break
+
+                is_last = index == len(attrs) - 1
+                if is_last and isinstance(field, serializers.RelatedField) and model_field.concrete \
+                        and not model_field.many_to_many:
+                    # Primary key style related fields only read the foreign key column
+                    self._need(current_model, current_path, model_field.name)
+                    break
+
+                relation_path = current_path + (attr,)
+                if model_field.many_to_many or model_field.one_to_many or prefetched:
+                    prefetched = True
+                    self.prefetch.add('__'.join(relation_path))
+                else:
+                    if model_field.concrete:
+                        self._need(current_model, current_path, model_field.name)
+                    self.select.add('__'.join(relation_path))
+                current_model, current_path = model_field.related_model, relation_path
+
+                if is_last:
+                    if isinstance(child, serializers.BaseSerializer):
+                        self._walk_nested(child, current_model, current_path, prefetched)
+                    else:
+                        self._need(current_model, current_path, ALL_COLUMNS)
+
+    def _walk_nested(self, serializer, model, path, prefetched):
+        if prefetched:
+            # Prefetched rows are loaded whole, only their own relations are followed
+            nested_plan = QueryPlan(serializer.__class__)
+            nested_plan._walk(serializer.fields.values(), model, ())
+            self.prefetch.update('__'.join(path) + '__' + relation for relation in nested_plan.select)
+            self.prefetch.update('__'.join(path) + '__' + relation for relation in nested_plan.prefetch)
+            return
+        self._walk(serializer.fields.values(), model, path)
+
+    def _need(self, model, path, column):
+        if any(self._is_prefetched(path[:i + 1]) for i in range(len(path))):
+            return
+        self.models[path] = model
+        if column is ALL_COLUMNS:
+            self.columns[path] = ALL_COLUMNS
+        elif self.columns.get(path, set()) is not ALL_COLUMNS:
+            self.columns.setdefault(path, set()).add(column)
+
+    def _is_prefetched(self, path):
+        return '__'.join(path) in self.prefetch
+
+    def _only(self):
+        only = []
+        for path, columns in self.columns.items():
+            if columns is ALL_COLUMNS:
+                columns = [field.name for field in self.models[path]._meta.concrete_fields]
+            only += ['__'.join(path + (column,)) for column in columns]
+        return sorted(only)
+
+
+def plan_queryset(queryset, serializer_class):
+    return QueryPlan(serializer_class).apply(queryset)
+
+
+class QueryPlanMixin(object):
+    """
+    GenericAPIView mixin which loads list/retrieve querysets with the QueryPlan of the serializer class
+    """
+    query_plan_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super(QueryPlanMixin, self).filter_queryset(queryset)
+        if getattr(self, 'action', None) in self.query_plan_actions:
+            queryset = plan_queryset(queryset, self.get_serializer_class())
+        return queryset
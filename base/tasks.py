@@ -1,98 +1,213 @@
-from django.db.models import F
-from django.db.models.aggregates import Count
-from django.core.mail import send_mail
+from django.db.models import Q
 from django.conf import settings
-from django.template import loader
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from celery import group
+from celery.signals import worker_process_init, worker_process_shutdown
 from hardwareManager.celery import app
-import html2text
-from item.models import ApprovedItem
-from utils.helpers import send_mass_html_mail
-from utils.constants import ACKNOWLEDGE_STATUS, ITEM_TYPE
-from datetime import datetime, timedelta
-from utils import constants
+import time
+from authentication.models import AuthToken
+from base import digests, notifications, outbox, transport
+from base.job_lock import check_current, single_flight
+from invite.models import Invite
+from item import history, ledger, partitions, reminders
+from organization.models import Organization
+from utils.constants import EMAIL_PRIORITY, REMINDER_KIND
+from datetime import timedelta
+
+
+@worker_process_init.connect
+def warm_notification_templates(**kwargs):
+    notifications.warm()
+
+
+@worker_process_shutdown.connect
+def close_email_connections(**kwargs):
+    transport.close()
+
+
+@app.task
+def deliver_outbox(email_ids, priority=None):
+    """
+    Renders and sends outbox emails handed off by the relay (OUTBOX_RELAY_MODE = 'celery'),
+    routed by priority to the interactive or bulk queue
+    :return: number of emails delivered
+    """
+    return outbox.deliver(email_ids)
+
+
+@app.task
+def relay_outbox(priority=None):
+    """
+    Drains the email outbox (emails of priority, default all), concurrent relays skip each other's locked rows.
+    Routed by priority to the interactive or bulk queue.
+    :return: number of emails delivered
+    """
+    return outbox.relay(priority=priority)
+
+
+@app.task
+@single_flight()
+def flush_notification_digests():
+    """
+    Sends the notification digests whose window is over
+    :return: number of events flushed
+    """
+    return digests.flush()
 
 
 @app.task
-def send_email(html_message, recipient_email, subject):
-    h = html2text.HTML2Text()
-    h.ignore_links = False
-    send_mail(
-        html_message=html_message,
-        subject=subject,
-        message=h.handle(html_message),
-        from_email=settings.EMAIL_HOST_USER,
-        recipient_list=[recipient_email]
-    )
+def write_item_history(rows):
+    """
+    Deferred ItemHistory writer, see item.history
+    :param rows: list of (approved_id, status)
+    """
+    history.write(rows)
+
+
+@app.task
+def send_scheduled_reminder(schedule_id, due_at):
+    """
+    Timer of a ReminderSchedule row, enqueued with eta=due_at by item.reminders
+    """
+    reminders.fire(schedule_id, parse_datetime(due_at))
+
+
+@app.task
+@single_flight()
+def dispatch_reminders():
+    """
+    Enqueues the reminder timers coming due and re-enqueues the missed ones, a due_at index range scan
+    :return: number of timers enqueued
+    """
+    return reminders.enqueue_pending()
+
+
+def fan_out_reminder_scan(kind):
+    """
+    Starts one send_organization_reminders subtask per organization for today's scan of kind
+    :return: number of subtasks
+    """
+    period = timezone.localdate().isoformat()
+    subtasks = [
+        send_organization_reminders.s(kind, organization_id, period)
+        for organization_id in Organization.objects.order_by('id').values_list('id', flat=True).iterator()
+    ]
+    group(subtasks).apply_async()
+    return len(subtasks)
 
 
 @app.task
+@single_flight()
 def check_for_pending_acknowledgement():
     """
-    Checks periodically, if there are any pending requests which user haven't approved yet.
-    :return: void
-    """
-    qs = ApprovedItem.objects.select_related(
-        'approved_item',
-        'approved_to'
-    ).filter(
-        status=ACKNOWLEDGE_STATUS.PENDING,
-        created_at__lt=datetime.now() - timedelta(days=1)
-    ).values(
-        'approved_to__email'
-    ).order_by().annotate(
-        num_of_items=Count('approved_to')
-    )
-
-    h = html2text.HTML2Text()
-    h.ignore_links = False
-    data_list = []
-    for item in qs:
-        recipient_email = item.get('approved_to__email')
-        context = {
-            'num_items': item.get('num_of_items')
-        }
-        html_message = loader.get_template('pending_acknowledge.html').render(context)
-        data_list.append(
-            (constants.SUBJECT_REMINDER_TO_ACKNOWLEDGE, h.handle(html_message), html_message, settings.EMAIL_HOST_USER, [recipient_email])
-        )
-    send_mass_html_mail(datatuple=tuple(data_list))
+    Daily scan for approvals users haven't acknowledged yet (REMINDER_SCHEDULER = 'scan'), sharded by organization.
+    :return: number of subtasks
+    """
+    return fan_out_reminder_scan(REMINDER_KIND.ACKNOWLEDGE)
 
 
 @app.task
+@single_flight()
 def check_for_pending_returns():
     """
-    Checks periodically whether there are some items whose return date has passed but user haven't returned yet.
-    :return: void
-    """
-    qs = ApprovedItem.objects.select_related(
-        'approved_item',
-        'approved_to'
-    ).filter(
-        approved_item__type__in=[ITEM_TYPE.RETURNABLE, ITEM_TYPE.SHAREABLE],
-        status=ACKNOWLEDGE_STATUS.ACKNOWLEDGED,
-        current_status_date__lt=datetime.now() - timedelta(days=1) * F('approved_duration')
-    ).values(
-        'approved_to__email'
-    ).order_by().annotate(
-        num_of_items=Count('approved_to')
-    )
-
-    h = html2text.HTML2Text()
-    h.ignore_links = False
-    data_list = []
-    for item in qs:
-        recipient_email = item.get('approved_to__email')
-        context = {
-            'num_items': item.get('num_of_items')
-        }
-        html_message = loader.get_template('pending_return.html').render(context)
-        data_list.append(
-            (constants.SUBJECT_REMINDER_TO_RETURN, h.handle(html_message), html_message, settings.EMAIL_HOST_USER, [recipient_email])
-        )
-    send_mass_html_mail(datatuple=tuple(data_list))
+    Daily scan for items whose return date has passed but user haven't returned yet (REMINDER_SCHEDULER = 'scan'),
+    sharded by organization.
+    :return: number of subtasks
+    """
+    return fan_out_reminder_scan(REMINDER_KIND.RETURN)
+
+
+@app.task(acks_late=True)
+def send_organization_reminders(kind, organization_id, period):
+    """
+    One organization's share of a reminder scan, acknowledged after it ran so a crashed worker's share is redelivered
+    and resumes from its ReminderRun checkpoint
+    :return: number of reminders sent
+    """
+    return reminders.run_organization_scan(kind, organization_id, parse_date(period))
+
+
+def hard_delete_in_batches(model, expires_after_seconds, batch_size, sleep_seconds):
+    """
+    Hard deletes trashed or expired rows of model walking the primary key (keyset pagination),
+    so every DELETE touches at most batch_size rows and no lock is held between batches.
+    :return: number of deleted rows
+    """
+    cutoff = timezone.now() - timedelta(seconds=expires_after_seconds)
+    last_id = 0
+    deleted = 0
+    while True:
+        # Stops (LockLost) if the reaper's lease was taken over while sleeping between batches
+        check_current()
+        ids = list(model.all_objects.filter(
+            Q(trashed=True) | Q(created_at__lt=cutoff),
+            id__gt=last_id
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        model.all_objects.filter(id__in=ids).delete(forced=True)
+        deleted += len(ids)
+        last_id = ids[-1]
+        time.sleep(sleep_seconds)
+
+
+@app.task
+@single_flight()
+def reap_expired_tokens():
+    """
+    Purges expired and trashed AuthTokens and Invites.
+    :return: dict of deleted rows per model
+    """
+    return {
+        'auth_tokens': hard_delete_in_batches(
+            AuthToken, settings.AUTH_TOKEN_EXPIRES_AFTER_SECONDS,
+            settings.REAPER_BATCH_SIZE, settings.REAPER_BATCH_SLEEP_SECONDS
+        ),
+        'invites': hard_delete_in_batches(
+            Invite, settings.INVITE_TOKEN_EXPIRES_AFTER_SECONDS,
+            settings.REAPER_BATCH_SIZE, settings.REAPER_BATCH_SLEEP_SECONDS
+        ),
+    }
+
+
+@app.task
+@single_flight()
+def take_stock_snapshot():
+    """
+    Snapshots every item's quantity so point in time stock queries only replay a short tail of StockMovements.
+    :return: number of snapshot rows
+    """
+    return ledger.take_snapshot(taken_at=timezone.now() - timedelta(seconds=settings.STOCK_SNAPSHOT_LAG_SECONDS))
+
+
+@app.task
+@single_flight()
+def ensure_history_partitions():
+    """
+    Creates the ItemHistory partitions ITEM_HISTORY_PARTITIONS_AHEAD months ahead, so new rows never land in the
+    default partition (PostgreSQL refuses to create the partition of a month with rows there)
+    :return: number of months covered, 0 on a plain table
+    """
+    if not partitions.is_partitioned():
+        return 0
+    return len(partitions.ensure_partitions())
 
 
 @app.on_after_finalize.connect
 def setup_periodic_task(sender, **kwargs):
-    sender.add_periodic_task(settings.NOTIFICATIONS_JOB_INTERVAL, check_for_pending_acknowledgement.s(), name='pending approved items reminder')
-    sender.add_periodic_task(settings.NOTIFICATIONS_JOB_INTERVAL, check_for_pending_returns.s(), name='pending return items reminder')
+    if settings.REMINDER_SCHEDULER == 'scan':
+        sender.add_periodic_task(settings.NOTIFICATIONS_JOB_INTERVAL, check_for_pending_acknowledgement.s(), name='pending approved items reminder')
+        sender.add_periodic_task(settings.NOTIFICATIONS_JOB_INTERVAL, check_for_pending_returns.s(), name='pending return items reminder')
+    else:
+        sender.add_periodic_task(settings.REMINDER_DISPATCH_INTERVAL, dispatch_reminders.s(), name='reminder dispatcher')
+    sender.add_periodic_task(settings.OUTBOX_RELAY_INTERVAL, relay_outbox.s(priority=EMAIL_PRIORITY.INTERACTIVE),
+                             name='interactive email outbox relay')
+    sender.add_periodic_task(settings.OUTBOX_RELAY_INTERVAL, relay_outbox.s(priority=EMAIL_PRIORITY.BULK),
+                             name='bulk email outbox relay')
+    sender.add_periodic_task(settings.NOTIFICATION_DIGEST_FLUSH_INTERVAL, flush_notification_digests.s(),
+                             name='notification digests')
+    sender.add_periodic_task(settings.REAPER_JOB_INTERVAL, reap_expired_tokens.s(), name='expired tokens reaper')
+    sender.add_periodic_task(settings.STOCK_SNAPSHOT_INTERVAL, take_stock_snapshot.s(), name='stock snapshot')
+    sender.add_periodic_task(settings.ITEM_HISTORY_PARTITION_INTERVAL, ensure_history_partitions.s(),
+                             name='item history partitions')
@@ -1,3 +1,167 @@
-from django.test import TestCase
+import json
+import smtplib
+from datetime import timedelta
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ddf import G
+
+from authentication.models import AuthToken
+from base import digests, job_lock, notifications
+from base.models import DigestEvent, JobLock, OutboxEmail
+from base.smtp_sink import SMTPSink
+from base.transport import ConnectionPool, TokenBucket, Transport
+from base.tasks import hard_delete_in_batches
+from hardwareManager.celery_settings import BULK_QUEUE, INTERACTIVE_QUEUE, MAINTENANCE_QUEUE, route_task
+from organization.models import Organization
+from utils.constants import EMAIL_PRIORITY
+
+
+class ReaperTests(TestCase):
+
+    def test_hard_delete_expired_and_trashed_tokens(self):
+        fresh = G(AuthToken)
+        trashed = G(AuthToken, trashed=True)
+        expired = G(AuthToken)
+        AuthToken.all_objects.filter(id=expired.id).update(
+            created_at=timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_EXPIRES_AFTER_SECONDS + 1)
+        )
+
+        deleted = hard_delete_in_batches(AuthToken, settings.AUTH_TOKEN_EXPIRES_AFTER_SECONDS, batch_size=1,
+                                         sleep_seconds=0)
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(list(AuthToken.all_objects.values_list('id', flat=True)), [fresh.id])
+        self.assertFalse(AuthToken.all_objects.filter(id__in=[trashed.id, expired.id]).exists())
+
+
+class JobLockTests(TestCase):
+
+    def test_single_holder_and_fencing(self):
+        lease = job_lock.acquire('job', ttl=60)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(job_lock.acquire('job', ttl=60))
+
+        # Leases run on the database clock, expire it relative to itself
+        JobLock.objects.filter(name='job').update(expires_at=F('expires_at') - timedelta(seconds=120))
+        successor = job_lock.acquire('job', ttl=60)
+        self.assertEqual(successor.token, lease.token + 1)
+        self.assertFalse(lease.renew())
+        with self.assertRaises(job_lock.LockLost):
+            lease.check()
+        successor.check()
+
+        lease.release()
+        self.assertIsNone(job_lock.acquire('job', ttl=60))
+        successor.release()
+        self.assertIsNotNone(job_lock.acquire('job', ttl=60))
+
+    def test_single_flight_skips_while_held(self):
+        calls = []
+
+        @job_lock.single_flight(name='flight', ttl=60)
+        def job():
+            calls.append(job_lock.current().token)
+            return 'done'
+
+        self.assertEqual(job(), 'done')
+        held = job_lock.acquire('flight', ttl=60)
+        self.assertIsNone(job())
+        self.assertEqual(calls, [held.token - 1])
+
+
+class TransportTests(TestCase):
+
+    def message(self):
+        return EmailMessage('Subject', 'Body', 'from@example.com', ['to@example.com'])
+
+    def test_batches_reuse_pooled_connection(self):
+        with SMTPSink() as sink:
+            pool = ConnectionPool(partial(get_connection, 'django.core.mail.backends.smtp.EmailBackend',
+                                          host=sink.host, port=sink.port, username='', password='', use_tls=False))
+            errors = Transport(pool, TokenBucket(0)).send([self.message() for _ in range(5)], batch_size=2)
+            pool.close_all()
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual((sink.messages, sink.connections, pool.opened), (5, 1, 1))
+
+    @override_settings(EMAIL_RETRY_BACKOFF_SECONDS=0)
+    def test_permanent_error_is_not_retried(self):
+        pool = ConnectionPool()
+        refused = smtplib.SMTPRecipientsRefused({'to@example.com': (550, b'No such user')})
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=[refused, 1]) as send_messages:
+            errors = Transport(pool, TokenBucket(0)).send([self.message(), self.message()])
+        self.assertEqual(errors, [refused, None])
+        self.assertEqual(send_messages.call_count, 2)
+
+    @override_settings(EMAIL_SEND_RETRIES=1, EMAIL_RETRY_BACKOFF_SECONDS=0)
+    def test_unreachable_server_fails_each_message(self):
+        connection = mock.Mock()
+        connection.open.side_effect = ConnectionRefusedError
+        pool = ConnectionPool(lambda fail_silently: connection)
+        errors = Transport(pool, TokenBucket(0)).send([self.message(), self.message()])
+        self.assertEqual([type(error) for error in errors], [ConnectionRefusedError] * 2)
+        self.assertEqual((connection.open.call_count, pool.opened), (4, 0))
+        connection.send_messages.assert_not_called()
+
+
+class DigestTests(TestCase):
+
+    def approved_context(self, quantity):
+        return {'first_name': 'Ada', 'full_name': 'Ada Admin', 'email': 'ada@example.com', 'role': 'Admin',
+                'organization_name': 'Org', 'item_group_name': 'Mouse', 'quantity': quantity}
+
+    def test_events_are_flushed_as_one_digest(self):
+        organization = G(Organization, digest_window_minutes=10)
+        notifications.notify('u@example.com', 'approved.html', self.approved_context(2), 'Request approved',
+                             organization=organization)
+        notifications.notify_many([
+            ('u@example.com', 'pending_return.html', {'num_items': 1}, 'Reminder', 'reminder:1'),
+            ('u@example.com', 'pending_return.html', {'num_items': 1}, 'Reminder', 'reminder:2'),
+        ], organization=organization)
+        self.assertEqual(DigestEvent.objects.count(), 3)
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(digests.flush(), 0)
+
+        self.assertEqual(digests.flush(now=timezone.now() + timedelta(minutes=11)), 3)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.template_name, digests.DIGEST_TEMPLATE)
+        self.assertEqual(json.loads(email.context)['sections'], [
+            {'subject': 'Request approved', 'lines': ['Ada Admin approved your request for 2 Mouse']},
+            {'subject': 'Reminder', 'lines': ['2 items are past their return date']},
+        ])
+        self.assertFalse(DigestEvent.objects.filter(flushed_at__isnull=True).exists())
+
+    def test_single_event_is_sent_as_itself(self):
+        organization = G(Organization, digest_window_minutes=10)
+        notifications.notify('u@example.com', 'pending_return.html', {'num_items': 3}, 'Reminder',
+                             organization=organization)
+        digests.flush(now=timezone.now() + timedelta(minutes=11))
+        self.assertEqual(OutboxEmail.objects.get().template_name, 'pending_return.html')
+
+    def test_without_window_notifications_are_sent_right_away(self):
+        organization = G(Organization, digest_window_minutes=0)
+        notifications.notify('u@example.com', 'pending_return.html', {'num_items': 1}, 'Reminder',
+                             organization=organization)
+        notifications.notify('u@example.com', 'welcome.html', {'organization_name': 'Org'}, 'Welcome')
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        self.assertFalse(DigestEvent.objects.exists())
+
+
+class CeleryRoutingTests(TestCase):
+
+    def queue(self, name, **kwargs):
+        return (route_task(name, (), kwargs, {}) or {}).get('queue')
+
+    def test_email_tasks_are_routed_by_priority(self):
+        self.assertEqual(self.queue('base.tasks.relay_outbox', priority=EMAIL_PRIORITY.INTERACTIVE), INTERACTIVE_QUEUE)
+        self.assertEqual(self.queue('base.tasks.deliver_outbox', email_ids=[1], priority=EMAIL_PRIORITY.BULK),
+                         BULK_QUEUE)
+        self.assertEqual(self.queue('base.tasks.send_organization_reminders'), BULK_QUEUE)
+        self.assertEqual(self.queue('base.tasks.take_stock_snapshot'), MAINTENANCE_QUEUE)
@@ -0,0 +1,205 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from authentication.models import AuthToken
+from base.token_expire_handler import expires_in
+from utils import helpers
+
+
+class LocalTokenCache(object):
+    """
+    In-process LRU of authenticated tokens (with the user version they were cached at).
+    Every entry expires after min(TTL_SECONDS, token's remaining lifetime).
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, version, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return token, version
+
+    def set(self, key, token, ttl, version=0):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (token, version, time.monotonic() + min(ttl, self.ttl))
+            self._user_keys.setdefault(token.user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0].user_id
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+class TokenCache(object):
+    """
+    Two tier cache for AuthToken lookups used by BaseTokenAuthentication.
+    Tier 1: LocalTokenCache (per process)
+    Tier 2: Django cache backend named by AUTH_TOKEN_CACHE['BACKEND'] (optional, shared between processes)
+    Invalidations are published to the cache named by AUTH_TOKEN_CACHE['INVALIDATION_BACKEND'] (a revoked marker
+    per token, a version per user) and checked on every hit, so logout and user changes apply to every process.
+    That cache must be shared between processes (memcached, redis...), with a per process cache other workers
+    keep accepting an invalidated token for up to TTL_SECONDS.
+    """
+    key_prefix = 'auth_token:'
+    revoked_prefix = 'auth_token_revoked:'
+    user_version_prefix = 'auth_user_version:'
+
+    def __init__(self, max_size=None, ttl=None, backend=None, invalidation_backend=None):
+        config = getattr(settings, 'AUTH_TOKEN_CACHE', {})
+        self.ttl = ttl if ttl is not None else config.get('TTL_SECONDS', 300)
+        self.local = LocalTokenCache(
+            max_size=max_size if max_size is not None else config.get('MAX_SIZE', 10000),
+            ttl=self.ttl
+        )
+        self.backend_alias = backend if backend is not None else config.get('BACKEND')
+        self.invalidation_alias = (invalidation_backend if invalidation_backend is not None
+                                   else config.get('INVALIDATION_BACKEND', 'default'))
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if not self.backend_alias:
+            return None
+        return caches[self.backend_alias]
+
+    @property
+    def invalidation(self):
+        if not self.invalidation_alias:
+            return None
+        return caches[self.invalidation_alias]
+
+    def get(self, key):
+        """
+        :return: a copy of the cached token (and of its user), None on a miss or if it was invalidated
+        """
+        key = self._normalize(key)
+        entry = self.local.get(key)
+        if entry is None and self.backend is not None:
+            entry = self.backend.get(self.key_prefix + key)
+            if entry is not None:
+                self.local.set(key, entry[0], self._time_left(entry[0]), entry[1])
+        if entry is not None and not self._is_current(key, *entry):
+            self.local.delete(key)
+            entry = None
+        self._count(entry is not None)
+        if entry is None:
+            return None
+        token = copy.copy(entry[0])
+        token.user = copy.copy(entry[0].user)
+        return token
+
+    def version(self, user_id):
+        """
+        Current version of user_id, bumped by invalidate_user
+        """
+        if self.invalidation is None:
+            return 0
+        return self.invalidation.get(self.user_version_prefix + str(user_id), 0)
+
+    def set(self, token, version=None):
+        ttl = min(self._time_left(token), self.ttl)
+        if ttl <= 0:
+            return
+        version = self.version(token.user_id) if version is None else version
+        key = self._normalize(token.key)
+        self.local.set(key, token, ttl, version)
+        if self.backend is not None:
+            self.backend.set(self.key_prefix + key, (token, version), ttl)
+
+    def invalidate(self, key):
+        key = self._normalize(key)
+        self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete(self.key_prefix + key)
+        if self.invalidation is not None:
+            # Cached copies live at most ttl, so does the marker
+            self.invalidation.set(self.revoked_prefix + key, True, self.ttl)
+
+    def invalidate_user(self, user_id):
+        self.local.delete_user(user_id)
+        if self.invalidation is not None:
+            version_key = self.user_version_prefix + str(user_id)
+            try:
+                self.invalidation.incr(version_key)
+            except ValueError:
+                if not self.invalidation.add(version_key, 1, None):
+                    self.invalidation.incr(version_key)
+        if self.backend is not None:
+            keys = AuthToken.all_objects.filter(user_id=user_id).values_list('key', flat=True)
+            self.backend.delete_many([self.key_prefix + self._normalize(key) for key in keys])
+
+    def _is_current(self, key, token, version):
+        if self.invalidation is None:
+            return True
+        version_key = self.user_version_prefix + str(token.user_id)
+        values = self.invalidation.get_many([self.revoked_prefix + key, version_key])
+        return not values.get(self.revoked_prefix + key) and values.get(version_key, 0) == version
+
+    def clear(self):
+        self.local.clear()
+        with self._counter_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _normalize(key):
+        return helpers.parse_key(key).hex
+
+    @staticmethod
+    def _time_left(token):
+        return expires_in(token).total_seconds()
+
+
+token_cache = TokenCache()
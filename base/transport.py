@@ -0,0 +1,186 @@
+import smtplib
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+
+def is_transient(error):
+    """
+    Errors worth retrying: dropped connections, network errors and 4xx SMTP replies
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+class TokenBucket(object):
+    """
+    Allows rate sends per second on average with bursts of capacity, a rate of 0 doesn't limit
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Takes a token, sleeping until one is available
+        :return: seconds waited
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            # The token is reserved before sleeping, concurrent takers queue behind it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class ConnectionPool(object):
+    """
+    Open email backend connections kept between sends by the process, at most size idle ones.
+    Connections idle for more than idle_seconds are closed instead of reused (servers drop them).
+    """
+
+    def __init__(self, factory=None, size=None, idle_seconds=None):
+        self.factory = factory or get_connection
+        self.size = settings.EMAIL_POOL_SIZE if size is None else size
+        self.idle_seconds = settings.EMAIL_POOL_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self.opened = 0
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        stale = []
+        connection = None
+        with self._lock:
+            while self._idle:
+                candidate, released_at = self._idle.pop()
+                if now - released_at <= self.idle_seconds:
+                    connection = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self.discard(candidate)
+        if connection is None:
+            connection = self.factory(fail_silently=False)
+            try:
+                connection.open()
+            except Exception:
+                self.discard(connection)
+                raise
+            self.opened += 1
+        return connection
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self.discard(connection)
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self.discard(connection)
+
+
+class Transport(object):
+    """
+    Sends email messages in batches over pooled connections, throttled by a token bucket.
+    A message failing with a transient error is retried EMAIL_SEND_RETRIES times on a fresh connection
+    with exponential backoff from EMAIL_RETRY_BACKOFF_SECONDS, a failing message never fails its batch.
+    """
+
+    def __init__(self, pool=None, bucket=None):
+        self.pool = pool or ConnectionPool()
+        self.bucket = bucket or TokenBucket(settings.EMAIL_RATE_PER_SECOND, settings.EMAIL_RATE_BURST)
+
+    def send(self, messages, batch_size=None):
+        """
+        :param messages: list of EmailMessage
+        :return: list of the error of each message, None for the ones sent
+        """
+        batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        errors = []
+        for start in range(0, len(messages), batch_size):
+            # Acquired by _send within its retries, a server which can't be reached fails each message, not the call
+            connection = None
+            try:
+                for message in messages[start:start + batch_size]:
+                    connection, error = self._send(connection, message)
+                    errors.append(error)
+            finally:
+                if connection is not None:
+                    self.pool.release(connection)
+        return errors
+
+    def _send(self, connection, message):
+        attempt = 0
+        while True:
+            try:
+                if connection is None:
+                    connection = self.pool.acquire()
+                self.bucket.take()
+                connection.send_messages([message])
+                return connection, None
+            except Exception as e:
+                if connection is not None and not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    # The session state is unknown after an error, don't send the next message over it
+                    self.pool.discard(connection)
+                    connection = None
+                if attempt >= settings.EMAIL_SEND_RETRIES or not is_transient(e):
+                    return connection, e
+                time.sleep(settings.EMAIL_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                attempt += 1
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Transport of the process (its pool is per worker process)
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+def send(messages, batch_size=None):
+    return get_transport().send(messages, batch_size)
+
+
+def close():
+    if _transport is not None:
+        _transport.pool.close_all()
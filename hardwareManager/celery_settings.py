@@ -1,8 +1,66 @@
 import os
 from celery import Celery
+from kombu import Exchange, Queue
+
+from utils.constants import EMAIL_PRIORITY
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hardwareManager.settings.local')
 
+INTERACTIVE_QUEUE = 'interactive'
+BULK_QUEUE = 'bulk'
+MAINTENANCE_QUEUE = 'maintenance'
+
+# Options of the worker consuming each queue, every queue has its own workers so a reminder run never takes the
+# slots of interactive emails (python manage.py celery_queues --workers prints the commands):
+#   celery -A hardwareManager worker -Q interactive -c 4 --prefetch-multiplier 1 -n interactive@%h
+WORKERS = {
+    INTERACTIVE_QUEUE: {'concurrency': 4, 'prefetch_multiplier': 1},
+    BULK_QUEUE: {'concurrency': 2, 'prefetch_multiplier': 4},
+    MAINTENANCE_QUEUE: {'concurrency': 1, 'prefetch_multiplier': 1},
+}
+
+MAX_PRIORITY = 9
+
+# Task name: (queue, priority), higher priorities are delivered first within a queue
+ROUTES = {
+    'base.tasks.send_scheduled_reminder': (BULK_QUEUE, 5),
+    'base.tasks.send_organization_reminders': (BULK_QUEUE, 3),
+    'base.tasks.flush_notification_digests': (BULK_QUEUE, 5),
+    'base.tasks.write_item_history': (BULK_QUEUE, 7),
+    'base.tasks.dispatch_reminders': (MAINTENANCE_QUEUE, 5),
+    'base.tasks.check_for_pending_acknowledgement': (MAINTENANCE_QUEUE, 5),
+    'base.tasks.check_for_pending_returns': (MAINTENANCE_QUEUE, 5),
+    'base.tasks.reap_expired_tokens': (MAINTENANCE_QUEUE, 3),
+    'base.tasks.take_stock_snapshot': (MAINTENANCE_QUEUE, 3),
+    'base.tasks.ensure_history_partitions': (MAINTENANCE_QUEUE, 3),
+}
+
+# Tasks routed by the EMAIL_PRIORITY of their priority kwarg
+EMAIL_TASKS = ('base.tasks.relay_outbox', 'base.tasks.deliver_outbox')
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    if name in EMAIL_TASKS:
+        if (kwargs or {}).get('priority') == EMAIL_PRIORITY.BULK:
+            return {'queue': BULK_QUEUE, 'priority': 7}
+        return {'queue': INTERACTIVE_QUEUE, 'priority': MAX_PRIORITY}
+    if name in ROUTES:
+        queue, priority = ROUTES[name]
+        return {'queue': queue, 'priority': priority}
+    return None
+
+
 app = Celery('hardwareManager')
 app.config_from_object('django.conf:settings', namespace='CELERY')
+app.conf.update(
+    task_queues=[
+        Queue(name, Exchange(name), routing_key=name, max_priority=MAX_PRIORITY) for name in WORKERS
+    ],
+    task_default_queue=BULK_QUEUE,
+    task_default_exchange=BULK_QUEUE,
+    task_default_routing_key=BULK_QUEUE,
+    task_default_priority=5,
+    task_routes=(route_task,),
+    worker_prefetch_multiplier=1,
+)
 app.autodiscover_tasks()
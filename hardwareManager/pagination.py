@@ -1,5 +1,119 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import b64decode, b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination, BasePagination
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the (created_at, id) tuple every model has, newest first: a page is
+    WHERE (created_at, id) < (last created_at, last id), no COUNT(*) and no OFFSET scan even when rows share created_at.
+    (DRF's CursorPagination positions on the first ordering field only and falls back to offsets on ties.)
+    The cursor carries the (created_at, id) of the row the page starts after and the direction.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        position, reverse = self.decode_cursor(request)
+
+        if position is not None:
+            created_at, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        queryset = queryset.order_by(*(('created_at', 'id') if reverse else self.ordering))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        first = self.page[0] if self.page else None
+        last = self.page[-1] if self.page else None
+        # Going back always leaves a page after, going forward from a cursor always leaves a page before
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = has_more if reverse else position is not None
+        self.next_position = (last.created_at, last.pk) if last is not None else position
+        self.previous_position = (first.created_at, first.pk) if first is not None else position
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or self.next_position is None:
+            return None
+        return self.encode_position(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.previous_position is None:
+            return None
+        return self.encode_position(self.previous_position, reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            created_at = parse_datetime(data['c'])
+            if created_at is None:
+                raise ValueError
+            return (created_at, int(data['i'])), bool(data['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, position, reverse):
+        created_at, pk = position
+        data = json.dumps({'c': created_at.isoformat(), 'i': pk, 'r': int(reverse)})
+        return replace_query_param(self.base_url, self.cursor_query_param, b64encode(data.encode('ascii')).decode('ascii'))
+
+
+class SelectablePagination(BasePagination):
+    """
+    Page number pagination by default, cursor pagination when
+    the view sets pagination_mode = 'cursor' or the client asks for it with ?pagination=cursor (or sends a ?cursor=).
+    Cursor pages have no count, so no view switches to them by default: clients walking large lists
+    (history, organization requests) opt in with ?pagination=cursor.
+    """
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.page_number_pagination = CustomPageNumberPagination()
+        self.cursor_pagination = CustomCursorPagination()
+        self.pagination = self.page_number_pagination
+
+    def use_cursor(self, request, view):
+        mode = request.query_params.get(self.mode_query_param) or getattr(view, 'pagination_mode', None)
+        return mode == 'cursor' or self.cursor_pagination.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.pagination = self.cursor_pagination if self.use_cursor(request, view) else self.page_number_pagination
+        return self.pagination.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.pagination.get_paginated_response(data)
+
+    def get_results(self, data):
+        return self.pagination.get_results(data)
+
+    def to_html(self):
+        return self.pagination.to_html()
+
+    def get_schema_fields(self, view):
+        return self.page_number_pagination.get_schema_fields(view) + self.cursor_pagination.get_schema_fields(view)
@@ -34,12 +34,104 @@ AUTH_USER_MODEL = 'user.User'
 # 3 days expiry
 AUTH_TOKEN_EXPIRES_AFTER_SECONDS = 259200
 
+# Cache for authenticated tokens, BACKEND is an optional alias from CACHES shared between processes.
+# Logout and user changes are published to INVALIDATION_BACKEND, it must be shared between processes
+# (memcached, redis...) or other processes keep accepting invalidated tokens for up to TTL_SECONDS
+AUTH_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL_SECONDS': 300,
+    'BACKEND': None,
+    'INVALIDATION_BACKEND': 'default',
+}
+
 # 1 day expiry
 INVITE_TOKEN_EXPIRES_AFTER_SECONDS = 86400
 
 # 1 day interval
 NOTIFICATIONS_JOB_INTERVAL = 86400
 
+# Reminders are per approval timers (item.reminders): the acknowledge reminder is due REMINDER_ACKNOWLEDGE_AFTER_SECONDS
+# after approval, the return reminder at ApprovedItem.due_at, both repeat every NOTIFICATIONS_JOB_INTERVAL.
+# Timers due within REMINDER_ETA_HORIZON_SECONDS are handed to celery with an eta by the dispatcher, which runs every
+# REMINDER_DISPATCH_INTERVAL (requests only write the schedules, a timer due sooner than that may fire up to one
+# interval late) and re-enqueues timers REMINDER_GRACE_SECONDS late
+REMINDER_ACKNOWLEDGE_AFTER_SECONDS = 86400
+REMINDER_ETA_HORIZON_SECONDS = 86400
+REMINDER_DISPATCH_INTERVAL = 900
+REMINDER_GRACE_SECONDS = 900
+# 'timers' runs the dispatcher above, 'scan' the daily scans instead (organization sharded, REMINDER_SCAN_BATCH_SIZE
+# recipients per email batch and checkpoint) for brokers which can't hold eta tasks
+REMINDER_SCHEDULER = 'timers'
+REMINDER_SCAN_BATCH_SIZE = 500
+
+# Emails are written to the outbox (base.outbox) and relayed every OUTBOX_RELAY_INTERVAL seconds, OUTBOX_BATCH_SIZE per
+# batch, straight to SMTP ('smtp') or handed to celery ('celery', rendered and sent by the worker, relayed again if
+# not sent within OUTBOX_HANDOFF_SECONDS). Failed emails are retried with exponential backoff
+# from OUTBOX_RETRY_SECONDS up to OUTBOX_MAX_RETRY_SECONDS, OUTBOX_MAX_ATTEMPTS times
+OUTBOX_RELAY_INTERVAL = 10
+OUTBOX_RELAY_MODE = 'smtp'
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_RETRY_SECONDS = 60
+OUTBOX_MAX_RETRY_SECONDS = 3600
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_HANDOFF_SECONDS = 600
+
+# Notification templates compiled when a worker process starts, and the number of rendered (template, context)
+# bodies kept per process (base.notifications.render_cache)
+NOTIFICATION_TEMPLATES = (
+    'approved.html', 'invite.html', 'welcome.html', 'pending_acknowledge.html', 'pending_return.html', 'digest.html'
+)
+NOTIFICATION_RENDER_CACHE_SIZE = 256
+
+# Notifications of organizations with a digest window (Organization.digest_window_minutes) are buffered per recipient
+# and flushed every NOTIFICATION_DIGEST_FLUSH_INTERVAL seconds as one email (base.digests). Only templates with a
+# summary line below are digested, the line is formatted with the notification context.
+NOTIFICATION_DIGEST_FLUSH_INTERVAL = 60
+NOTIFICATION_DIGEST_LINES = {
+    'approved.html': '{full_name} approved your request for {quantity} {item_group_name}',
+    'pending_acknowledge.html': '{num_items} items are waiting for your acknowledgement',
+    'pending_return.html': '{num_items} items are past their return date',
+}
+
+# Emails are sent (base.transport) EMAIL_BATCH_SIZE per connection checkout over SMTP connections kept open per process,
+# at most EMAIL_POOL_SIZE idle ones, closed after EMAIL_POOL_IDLE_SECONDS idle. Transient failures of a message are
+# retried EMAIL_SEND_RETRIES times with backoff from EMAIL_RETRY_BACKOFF_SECONDS. Sends are limited to
+# EMAIL_RATE_PER_SECOND per process (0 is unlimited) with bursts of EMAIL_RATE_BURST
+EMAIL_POOL_SIZE = 4
+EMAIL_POOL_IDLE_SECONDS = 60
+EMAIL_BATCH_SIZE = 50
+EMAIL_SEND_RETRIES = 2
+EMAIL_RETRY_BACKOFF_SECONDS = 1
+EMAIL_RATE_PER_SECOND = 0
+EMAIL_RATE_BURST = 10
+
+# Periodic tasks run under a JobLock lease of JOB_LOCK_TTL_SECONDS renewed every third of it (base.job_lock)
+JOB_LOCK_TTL_SECONDS = 300
+
+# Hard deletes expired/trashed AuthToken and Invite rows every hour, REAPER_BATCH_SIZE rows per DELETE
+REAPER_JOB_INTERVAL = 3600
+REAPER_BATCH_SIZE = 1000
+REAPER_BATCH_SLEEP_SECONDS = 0.5
+
+# Daily StockSnapshot of every item, taken STOCK_SNAPSHOT_LAG_SECONDS in the past so in-flight movements are committed
+STOCK_SNAPSHOT_INTERVAL = 86400
+STOCK_SNAPSHOT_LAG_SECONDS = 300
+STOCK_SNAPSHOT_BATCH_SIZE = 1000
+
+# ItemHistory rows are written in the transaction logging them, True hands them to a celery worker at commit instead
+ITEM_HISTORY_DEFERRED = False
+
+# ItemHistory is partitioned by month on PostgreSQL, a daily task (and manage_history_partitions) creates
+# ITEM_HISTORY_PARTITIONS_AHEAD months ahead and --archive moves months older than ITEM_HISTORY_RETENTION_MONTHS to
+# gzipped files
+ITEM_HISTORY_PARTITION_INTERVAL = 86400
+ITEM_HISTORY_PARTITIONS_AHEAD = 3
+ITEM_HISTORY_RETENTION_MONTHS = 12
+ITEM_HISTORY_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive', 'item_history')
+
+# Items written per transaction by item.importers.ItemImporter
+ITEM_IMPORT_BATCH_SIZE = 500
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -121,7 +213,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'base.authentication.BaseTokenAuthentication',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'hardwareManager.pagination.CustomPageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'hardwareManager.pagination.SelectablePagination',
 }
 
 
@@ -29,6 +29,8 @@ urlpatterns = [
     url(r'^my_requests/', include('item.urls_my_requests')),
     url(r'^my_approved/', include('item.urls_my_approved')),
     url(r'^my_organization_requests/', include('item.urls_my_organization_requests')),
+    url(r'^stats/', include('item.urls_stats')),
+    url(r'^export/', include('item.urls_export')),
     url(r'^admin/', admin.site.urls),
 ]
 
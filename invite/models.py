@@ -15,7 +15,7 @@ class Invite(BaseModel):
 
     def save(self, *args, **kwargs):
         if not self.key:
-            self.key = helpers.generate_key()
+            self.key = helpers.generate_key().hex
         return super().save(*args, **kwargs)
 
     def __str__(self):
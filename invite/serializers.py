@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from invite.models import Invite
-from django.template import loader
-from base.tasks import send_email
+from django.db import transaction
+from base import notifications
 from utils import constants
 
 
@@ -14,12 +14,13 @@ class InviteSerializer(serializers.ModelSerializer):
         admin = self.context['request'].user
         recipient_email = self.validated_data['email']
         validated_data['admin'] = admin
-        invite = super().create(validated_data)
-        context = {
-            'admin_name': admin.first_name,
-            'organization_name': admin.organization.name,
-            'invite_id': invite.key
-        }
-        html_message = loader.get_template('invite.html').render(context)
-        send_email.delay(html_message=html_message, recipient_email=recipient_email, subject=constants.SUBJECT_INVITATION)
+        with transaction.atomic():
+            invite = super().create(validated_data)
+            context = {
+                'admin_name': admin.first_name,
+                'organization_name': admin.organization.name,
+                'invite_id': invite.key
+            }
+            notifications.notify(recipient_email, 'invite.html', context, constants.SUBJECT_INVITATION,
+                                 dedup_key='invite:{key}'.format(key=invite.key))
         return invite
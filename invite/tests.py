@@ -22,7 +22,7 @@ class InviteTests(APITestCase):
     def test_invite_with_http_header(self):
         self.setup()
         url = reverse("invite:invite-list")
-        auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + AuthToken.objects.get().key}
+        auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(AuthToken.objects.get().key)}
         data = {"email": "kashish25798@gmail.com", "first_name": "Kashish", "last_name": "Sharma", "role": ROLE.ADMIN}
         response = self.client.post(path=url, data=data, **auth_headers)
         self.assertEquals(response.status_code, status.HTTP_201_CREATED)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from base.model_admin import BaseModelAdmin
-from item.models import ItemGroup, Item, ItemAttribute, RequestedItem, ApprovedItem, ItemHistory
+from item.models import ItemGroup, Item, ItemAttribute, RequestedItem, ApprovedItem, ItemHistory, OrganizationStatusCount, \
+    StockMovement, StockSnapshot, StockSnapshotRun, ReminderSchedule, ReminderRun
 
 
 class ItemAdmin(BaseModelAdmin):
@@ -13,3 +14,9 @@ admin.site.register(ItemAttribute, ItemAdmin)
 admin.site.register(RequestedItem, ItemAdmin)
 admin.site.register(ApprovedItem, ItemAdmin)
 admin.site.register(ItemHistory, ItemAdmin)
+admin.site.register(OrganizationStatusCount, ItemAdmin)
+admin.site.register(StockMovement, ItemAdmin)
+admin.site.register(StockSnapshot, ItemAdmin)
+admin.site.register(StockSnapshotRun, ItemAdmin)
+admin.site.register(ReminderSchedule, ItemAdmin)
+admin.site.register(ReminderRun, ItemAdmin)
@@ -0,0 +1,119 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F, Count
+from django.utils import timezone
+
+from item.models import OrganizationStatusCount, RequestedItem, ApprovedItem
+from organization.models import Organization
+
+
+def _add(organization_id, status, delta):
+    counters = OrganizationStatusCount.all_objects.filter(organization_id=organization_id, status=status)
+    if counters.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            OrganizationStatusCount.all_objects.create(organization_id=organization_id, status=status, count=delta)
+    except IntegrityError:
+        counters.update(count=F('count') + delta)
+
+
+def record_transition(organization_id, old_status, new_status):
+    """
+    Moves one row of an organization from old_status to new_status.
+    Call inside the transaction which changes the status, old_status=None for newly created rows.
+    """
+    if old_status == new_status:
+        return
+    if old_status is not None:
+        _add(organization_id, old_status, -1)
+    if new_status is not None:
+        _add(organization_id, new_status, 1)
+
+
+def transition(instance, organization_id, old_status, new_status, **fields):
+    """
+    Moves a RequestedItem/ApprovedItem from old_status to new_status (and sets fields) with one conditional UPDATE,
+    recording the counter delta only when it matched: of concurrent or repeated transitions only one applies.
+    Call inside a transaction. A queryset update sends no post_save, ApprovedItem history is the caller's.
+    :return: True if instance was moved (and updated in memory)
+    """
+    fields.update(status=new_status, updated_at=timezone.now())
+    updated = type(instance).objects.filter(id=instance.id, status=old_status).update(**fields)
+    if not updated:
+        return False
+    for name, value in fields.items():
+        setattr(instance, name, value)
+    record_transition(organization_id, old_status, new_status)
+    return True
+
+
+def apply_deltas(organization_id, deltas):
+    """
+    Batched form of record_transition, deltas: {status: delta}
+    """
+    for status, delta in deltas.items():
+        if delta:
+            _add(organization_id, status, delta)
+
+
+def get_counts(organization_id):
+    """
+    :return: {status: count} of an organization, one single-table read
+    """
+    return dict(OrganizationStatusCount.all_objects.filter(
+        organization_id=organization_id
+    ).values_list('status', 'count'))
+
+
+def _set(organization_id, status, count):
+    counters = OrganizationStatusCount.all_objects.filter(organization_id=organization_id, status=status)
+    if counters.update(count=count):
+        return
+    try:
+        with transaction.atomic():
+            OrganizationStatusCount.all_objects.create(organization_id=organization_id, status=status, count=count)
+    except IntegrityError:
+        # Created by a transition which committed after the count was read, its delta isn't in count
+        counters.update(count=F('count') + count)
+
+
+def count_rows(organization_id):
+    """
+    {status: number of RequestedItem/ApprovedItem rows} of an organization
+    """
+    counts = {}
+    for row in RequestedItem.objects.filter(item_group__organization=organization_id).values(
+            'status').order_by().annotate(count=Count('id')):
+        counts[row['status']] = row['count']
+    for row in ApprovedItem.objects.filter(approved_item__item_group__organization=organization_id).values(
+            'status').order_by().annotate(count=Count('id')):
+        counts[row['status']] = row['count']
+    return counts
+
+
+def rebuild_organization(organization_id):
+    """
+    Recomputes the counters of an organization from its rows, safe against concurrent transitions:
+    its counter rows are locked before counting, so transitions already holding them commit first (and are counted)
+    and later ones wait and apply their delta on top of the rebuilt value.
+    :return: number of counter rows written
+    """
+    with transaction.atomic():
+        existing = set(OrganizationStatusCount.all_objects.select_for_update().filter(
+            organization_id=organization_id
+        ).order_by('id').values_list('status', flat=True))
+        counts = count_rows(organization_id)
+        for status in existing | set(counts):
+            _set(organization_id, status, counts.get(status, 0))
+    return len(existing | set(counts))
+
+
+def rebuild(organization_id=None):
+    """
+    Recomputes counters from RequestedItem/ApprovedItem rows (all organizations if organization_id is None)
+    :return: number of counter rows written
+    """
+    if organization_id is not None:
+        return rebuild_organization(organization_id)
+    return sum(rebuild_organization(organization_id)
+               for organization_id in Organization.objects.values_list('id', flat=True))
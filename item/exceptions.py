@@ -144,3 +144,15 @@ class ItemPendingReminder(APIException):
     status_code = status.HTTP_400_BAD_REQUEST
     default_detail = "Cannot send reminder, approved item should be atleast 24hrs old."
     default_code = 'invalid'
+
+
+class InvalidStatsFamily(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Unknown stats family, expected my_requests, my_approved, organization_requests or organization_approved."
+    default_code = 'invalid'
+
+
+class InvalidBatchSize(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "batch_size must be a positive integer."
+    default_code = 'invalid'
@@ -0,0 +1,103 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from item.models import Item, ItemAttribute, ItemHistory
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FILE_TYPES = (CSV, JSONL)
+CONTENT_TYPES = {CSV: 'text/csv', JSONL: 'application/x-ndjson'}
+
+INVENTORY_FIELDS = (
+    'item_group_id', 'item_group_name', 'is_accessory', 'item_id', 'quantity', 'type', 'is_assigned', 'created_at',
+    'attributes',
+)
+
+HISTORY_FIELDS = (
+    'id', 'created_at', 'status', 'approved_id', 'item_id', 'item_group_name', 'quantity', 'approved_duration',
+    'approved_by', 'approved_to',
+)
+
+
+class Echo(object):
+    """
+    File-like object for csv.writer which hands back the written line instead of buffering it
+    """
+
+    def write(self, value):
+        return value
+
+
+def inventory_rows(organization):
+    """
+    Items of an organization with their attributes, one dict per item.
+    Items and attributes are two server side cursors ordered by item id and merged,
+    so memory doesn't grow with the organization.
+    """
+    items = Item.objects.filter(item_group__organization=organization).order_by('id').values_list(
+        'id', 'item_group__id', 'item_group__item_name', 'item_group__is_accessory',
+        'quantity', 'type', 'is_assigned', 'created_at',
+    ).iterator()
+    attributes = ItemAttribute.objects.filter(item__item_group__organization=organization).order_by('item_id').values_list(
+        'item_id', 'attribute_name', 'attribute_value'
+    ).iterator()
+
+    attribute = next(attributes, None)
+    for item_id, item_group_id, item_group_name, is_accessory, quantity, item_type, is_assigned, created_at in items:
+        item_attributes = []
+        while attribute is not None and attribute[0] <= item_id:
+            if attribute[0] == item_id:
+                item_attributes.append({'attribute_name': attribute[1], 'attribute_value': attribute[2]})
+            attribute = next(attributes, None)
+        yield {
+            'item_group_id': item_group_id,
+            'item_group_name': item_group_name,
+            'is_accessory': is_accessory,
+            'item_id': item_id,
+            'quantity': quantity,
+            'type': item_type,
+            'is_assigned': is_assigned,
+            'created_at': created_at,
+            'attributes': item_attributes,
+        }
+
+
+def history_rows(qs):
+    """
+    ItemHistory rows of qs (snapshot columns, no joins), streamed from a server side cursor
+    """
+    rows = qs.order_by('id').values_list(
+        'id', 'created_at', 'status', 'approved_id', 'item_id', 'item_group_name', 'approved_quantity',
+        'approved_duration', 'approved_by_email', 'approved_to_email',
+    ).iterator()
+    for row in rows:
+        yield dict(zip(HISTORY_FIELDS, row))
+
+
+def history_queryset(organization):
+    return ItemHistory.all_objects.filter(organization=organization)
+
+
+def iter_lines(rows, fields, file_type):
+    if file_type == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([
+                json.dumps(row[field], cls=DjangoJSONEncoder) if isinstance(row[field], list) else row[field]
+                for field in fields
+            ])
+    else:
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def streaming_response(rows, fields, file_type, filename):
+    response = StreamingHttpResponse(iter_lines(rows, fields, file_type), content_type=CONTENT_TYPES[file_type])
+    response['Content-Disposition'] = 'attachment; filename="{filename}.{extension}"'.format(
+        filename=filename, extension=file_type
+    )
+    return response
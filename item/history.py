@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from item.models import ApprovedItem, ItemHistory
+
+
+@contextmanager
+def atomic():
+    """
+    transaction.atomic() buffering the history rows logged inside it. The rows of the outermost block are written
+    with one bulk_create just before it exits (or, with ITEM_HISTORY_DEFERRED on, handed to a celery worker by a
+    single on_commit hook). A nested block which raises drops its rows with its savepoint, one which exits hands
+    them to the enclosing block.
+    Rows logged in a plain transaction.atomic savepoint inside the block are not dropped if it rolls back.
+    """
+    buffers = _buffers()
+    buffers.append([])
+    try:
+        with transaction.atomic():
+            yield
+            if len(buffers) == 1:
+                _flush(buffers[-1])
+    finally:
+        rows = buffers.pop()
+    if buffers:
+        buffers[-1].extend(rows)
+
+
+def _buffers():
+    # Per connection like the transaction the rows belong to, one list per open history.atomic block
+    if not hasattr(connection, 'item_history_buffers'):
+        connection.item_history_buffers = []
+    return connection.item_history_buffers
+
+
+def _flush(rows):
+    rows = list(rows)
+    if not rows:
+        return
+    if settings.ITEM_HISTORY_DEFERRED:
+        from base.tasks import write_item_history
+        transaction.on_commit(lambda: write_item_history.delay(rows=rows))
+    else:
+        write(rows)
+
+
+def record(approved_id, status):
+    """
+    Logs a status transition of an ApprovedItem
+    """
+    record_many([(approved_id, status)])
+
+
+def record_many(transitions):
+    """
+    Logs status transitions: buffered inside history.atomic, written right away (in the current transaction, if any)
+    outside of it
+    :param transitions: iterable of (approved_id, status)
+    """
+    buffers = _buffers()
+    if buffers:
+        buffers[-1].extend(transitions)
+    else:
+        _flush(transitions)
+
+
+def snapshot(approved, status):
+    """
+    ItemHistory row carrying what history listing shows, copied from the approval and its relations
+    """
+    item = approved.approved_item
+    request = approved.request
+    return ItemHistory(
+        approved=approved,
+        status=status,
+        organization_id=item.item_group.organization_id,
+        item=item,
+        item_group_name=item.item_group.item_name,
+        item_type=item.type,
+        item_quantity=item.quantity,
+        approved_quantity=request.quantity,
+        requested_duration=request.requested_duration,
+        approved_duration=approved.approved_duration,
+        requested_at=request.created_at,
+        approved_at=approved.created_at,
+        approved_by_id=approved.approved_by.id,
+        approved_by_name=approved.approved_by.full_name,
+        approved_by_email=approved.approved_by.email,
+        approved_by_picture=approved.approved_by.profile_picture,
+        approved_by_role=approved.approved_by.role,
+        approved_to_id=approved.approved_to.id,
+        approved_to_name=approved.approved_to.full_name,
+        approved_to_email=approved.approved_to.email,
+        approved_to_picture=approved.approved_to.profile_picture,
+        approved_to_role=approved.approved_to.role,
+    )
+
+
+def write(rows):
+    approvals = ApprovedItem.all_objects.select_related(
+        'request', 'approved_by', 'approved_to', 'approved_item__item_group'
+    ).in_bulk([approved_id for approved_id, _ in rows])
+    ItemHistory.objects.bulk_create([
+        snapshot(approvals[approved_id], status) for approved_id, status in rows if approved_id in approvals
+    ])
@@ -0,0 +1,127 @@
+import csv
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import exceptions
+
+from item import ledger
+from item.models import Item, ItemAttribute
+from item.serializers import ItemSerializer, validate_item_for_group
+from utils import constants
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FILE_TYPES = (CSV, JSONL)
+
+# CSV columns which are item fields, every other non empty column becomes an ItemAttribute
+ITEM_COLUMNS = ('quantity', 'type')
+
+
+def iter_lines(stream):
+    """
+    Decodes a binary stream (uploaded file, request body, open file) line by line without reading it whole
+    """
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig')
+        yield line
+
+
+def iter_csv_rows(lines):
+    for row in csv.DictReader(lines):
+        attributes = [
+            {'attribute_name': name, 'attribute_value': value}
+            for name, value in row.items() if name not in ITEM_COLUMNS and name and value
+        ]
+        data = {key: row[key] for key in ITEM_COLUMNS if row.get(key)}
+        data['attributes'] = attributes
+        yield data
+
+
+def iter_jsonl_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield e
+
+
+class ItemImporter(object):
+    """
+    Imports items (with attributes) of one ItemGroup from CSV or JSON Lines.
+    Rows are validated and written in chunks of batch_size, invalid rows are reported and skipped.
+    CSV: header row with quantity,type and one column per attribute name
+    JSONL: {"quantity": 1, "type": 14, "attributes": [{"attribute_name": "...", "attribute_value": "..."}]}
+    """
+
+    def __init__(self, item_group, batch_size=None):
+        self.item_group = item_group
+        self.batch_size = batch_size or settings.ITEM_IMPORT_BATCH_SIZE
+        self.created = 0
+        self.errors = []
+
+    def run(self, stream, file_type):
+        if file_type not in FILE_TYPES:
+            raise exceptions.ValidationError('file_type should be one of {types}'.format(types=', '.join(FILE_TYPES)))
+        lines = iter_lines(stream)
+        rows = iter_csv_rows(lines) if file_type == CSV else iter_jsonl_rows(lines)
+
+        chunk = []
+        for row_number, row in enumerate(rows, start=1):
+            validated_data = self._validate(row_number, row)
+            if validated_data is not None:
+                chunk.append(validated_data)
+            if len(chunk) >= self.batch_size:
+                self._write(chunk)
+                chunk = []
+        if chunk:
+            self._write(chunk)
+        return {'created': self.created, 'errors': self.errors}
+
+    def _validate(self, row_number, row):
+        if isinstance(row, Exception):
+            self.errors.append({'row': row_number, 'errors': str(row)})
+            return None
+        if not isinstance(row, dict):
+            self.errors.append({'row': row_number, 'errors': 'Expected an object.'})
+            return None
+        row.setdefault('type', constants.ITEM_TYPE.RETURNABLE)
+
+        item_serializer = ItemSerializer(data=row)
+        if not item_serializer.is_valid():
+            self.errors.append({'row': row_number, 'errors': item_serializer.errors})
+            return None
+        validated_data = item_serializer.validated_data
+        try:
+            validate_item_for_group(self.item_group, validated_data)
+        except exceptions.APIException as e:
+            self.errors.append({'row': row_number, 'errors': e.detail})
+            return None
+        return validated_data
+
+    def _write(self, chunk):
+        with transaction.atomic():
+            items = [
+                Item(
+                    item_group=self.item_group,
+                    quantity=validated_data.get('quantity') or 1,
+                    type=validated_data['type'],
+                    is_assigned=validated_data.get('is_assigned', False)
+                ) for validated_data in chunk
+            ]
+            if connection.features.can_return_ids_from_bulk_insert:
+                Item.objects.bulk_create(items)
+            else:
+                # Primary keys are needed for the attributes
+                for item in items:
+                    item.save()
+            ledger.record_many([(item, item.quantity) for item in items], constants.STOCK_MOVEMENT_REASON.ADDED)
+            ItemAttribute.objects.bulk_create([
+                ItemAttribute(item=item, **attribute)
+                for item, validated_data in zip(items, chunk)
+                for attribute in validated_data.get('attributes') or []
+            ])
+        self.created += len(items)
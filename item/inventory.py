@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from django.db.models import F, Case, When, Value, BooleanField
+from django.utils import timezone
+
+from item import exceptions as item_exception
+from item import counters, history, ledger
+from item.models import Item
+from utils import constants
+
+
+def take(item, quantity):
+    """
+    Takes quantity out of an item's stock with one conditional UPDATE (no read-modify-write, no row lock held
+    across statements). Marks the item assigned when the stock reaches 0.
+    Raises InvalidQuantityApproveException if less than quantity is available.
+    Call inside a transaction, the StockMovement is appended in the same one.
+    """
+    updated = Item.objects.filter(id=item.id, quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity,
+        is_assigned=Case(
+            When(quantity=quantity, then=Value(True)),
+            default=F('is_assigned'),
+            output_field=BooleanField()
+        )
+    )
+    if not updated:
+        raise item_exception.InvalidQuantityApproveException
+    ledger.record(item, -quantity, constants.STOCK_MOVEMENT_REASON.APPROVED)
+
+
+def put_back(item, quantity):
+    """
+    Returns quantity to an item's stock and marks it unassigned
+    """
+    Item.objects.filter(id=item.id).update(quantity=F('quantity') + quantity, is_assigned=False)
+    ledger.record(item, quantity, constants.STOCK_MOVEMENT_REASON.RETURNED)
+
+
+def adjust(item, quantity):
+    """
+    Sets an item's stock to quantity and appends the difference as an ADJUSTED StockMovement. The difference is
+    taken against the row locked here and applied with an F() update, a take or put_back committed since the item
+    was read is neither overwritten nor counted twice.
+    Call inside a transaction.
+    """
+    current = Item.objects.select_for_update().filter(id=item.id).values_list('quantity', flat=True).get()
+    delta = quantity - current
+    if delta:
+        Item.objects.filter(id=item.id).update(quantity=F('quantity') + delta, updated_at=timezone.now())
+        ledger.record(item, delta, constants.STOCK_MOVEMENT_REASON.ADJUSTED)
+
+
+def give_back(approved):
+    """
+    Moves an ACKNOWLEDGED ApprovedItem to RETURNED with one conditional UPDATE and puts its quantity back.
+    Of concurrent returns of the same approval only the one whose UPDATE matched the row credits the stock.
+    Call inside a transaction.
+    :return: True if approved was returned, False if it was not ACKNOWLEDGED anymore
+    """
+    if not counters.transition(approved, approved.approved_item.item_group.organization_id,
+                               constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED, constants.ACKNOWLEDGE_STATUS.RETURNED,
+                               current_status_date=datetime.now(), due_at=None):
+        return False
+    # A queryset update sends no post_save, the transition is logged here
+    history.record(approved.id, approved.status)
+    approved._history_status = approved.status
+    put_back(approved.approved_item, approved.request.quantity)
+    return True
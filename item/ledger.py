@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Max
+from django.utils import timezone
+
+from base import job_lock
+from item.models import Item, StockMovement, StockSnapshot, StockSnapshotRun
+
+
+def record(item, delta, reason):
+    """
+    Appends a StockMovement, call inside the transaction changing Item.quantity
+    """
+    if delta:
+        StockMovement.objects.create(item_id=item.id, item_group_id=item.item_group_id, delta=delta, reason=reason)
+
+
+def record_many(items_and_deltas, reason):
+    StockMovement.objects.bulk_create([
+        StockMovement(item_id=item.id, item_group_id=item.item_group_id, delta=delta, reason=reason)
+        for item, delta in items_and_deltas if delta
+    ])
+
+
+def last_snapshot_at(before=None):
+    """
+    taken_at of the latest finished snapshot run, the rows of a run which was interrupted are never read
+    """
+    runs = StockSnapshotRun.objects.filter(finished_at__isnull=False)
+    if before is not None:
+        runs = runs.filter(taken_at__lte=before)
+    return runs.aggregate(taken_at=Max('taken_at'))['taken_at']
+
+
+def take_snapshot(taken_at=None, batch_size=None):
+    """
+    Writes one StockSnapshot per item: quantity at the previous snapshot + movements since then.
+    Items are processed in primary key batches so memory doesn't grow with the inventory, a run taken at the same
+    taken_at resumes after the last item written. The run is marked finished once every item has its row.
+    :return: number of snapshot rows written
+    """
+    taken_at = taken_at or timezone.now()
+    batch_size = batch_size or settings.STOCK_SNAPSHOT_BATCH_SIZE
+    run, _ = StockSnapshotRun.objects.get_or_create(taken_at=taken_at)
+    if run.finished_at is not None:
+        return 0
+    # Rows of older interrupted runs are never read, drop them
+    stale = StockSnapshotRun.objects.filter(finished_at__isnull=True).exclude(id=run.id)
+    StockSnapshot.objects.filter(taken_at__in=stale.values('taken_at')).delete(forced=True)
+    stale.delete(forced=True)
+
+    previous_at = last_snapshot_at(before=taken_at)
+    written = 0
+    last_id = StockSnapshot.objects.filter(taken_at=taken_at).aggregate(last_id=Max('item_id'))['last_id'] or 0
+    while True:
+        job_lock.check_current()
+        items = list(Item.all_objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'item_group_id'
+        )[:batch_size])
+        if not items:
+            StockSnapshotRun.objects.filter(id=run.id).update(finished_at=timezone.now(), updated_at=timezone.now())
+            return written
+        item_ids = [item_id for item_id, _ in items]
+
+        movements = StockMovement.objects.filter(item_id__in=item_ids, created_at__lte=taken_at)
+        previous = {}
+        if previous_at is not None:
+            movements = movements.filter(created_at__gt=previous_at)
+            previous = dict(StockSnapshot.objects.filter(
+                item_id__in=item_ids, taken_at=previous_at
+            ).values_list('item_id', 'quantity'))
+        deltas = dict(movements.values('item_id').order_by().annotate(
+            delta=Sum('delta')
+        ).values_list('item_id', 'delta'))
+
+        with transaction.atomic():
+            StockSnapshot.objects.bulk_create([
+                StockSnapshot(item_id=item_id, item_group_id=item_group_id, taken_at=taken_at,
+                              quantity=previous.get(item_id, 0) + deltas.get(item_id, 0))
+                for item_id, item_group_id in items
+            ])
+        written += len(items)
+        last_id = item_ids[-1]
+
+
+def quantity_at(when, item_group_id=None, item_id=None):
+    """
+    Stock of an item group (or a single item) at when: one snapshot read + the movements after it
+    """
+    snapshot_at = last_snapshot_at(before=when)
+    snapshots = StockSnapshot.objects.filter(taken_at=snapshot_at)
+    movements = StockMovement.objects.filter(created_at__lte=when)
+    if item_group_id is not None:
+        snapshots = snapshots.filter(item_group_id=item_group_id)
+        movements = movements.filter(item_group_id=item_group_id)
+    if item_id is not None:
+        snapshots = snapshots.filter(item_id=item_id)
+        movements = movements.filter(item_id=item_id)
+
+    quantity = 0
+    if snapshot_at is not None:
+        quantity = snapshots.aggregate(quantity=Sum('quantity'))['quantity'] or 0
+        movements = movements.filter(created_at__gt=snapshot_at)
+    return quantity + (movements.aggregate(delta=Sum('delta'))['delta'] or 0)
+
+
+def movements_between(start, end, item_group_id=None, item_id=None):
+    movements = StockMovement.objects.filter(created_at__gt=start, created_at__lte=end)
+    if item_group_id is not None:
+        movements = movements.filter(item_group_id=item_group_id)
+    if item_id is not None:
+        movements = movements.filter(item_id=item_id)
+    return movements
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from item import importers
+from item.models import ItemGroup
+
+
+class Command(BaseCommand):
+    help = 'Imports items of an ItemGroup from a CSV or JSON Lines file, see item.importers.ItemImporter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_group_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--file-type', choices=importers.FILE_TYPES,
+                            help='Defaults to csv for *.csv files, jsonl otherwise')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            item_group = ItemGroup.objects.get(id=options['item_group_id'])
+        except ItemGroup.DoesNotExist:
+            raise CommandError('ItemGroup {id} does not exist'.format(id=options['item_group_id']))
+
+        path = options['path']
+        file_type = options['file_type'] or (importers.CSV if path.endswith('.csv') else importers.JSONL)
+        item_importer = importers.ItemImporter(item_group, batch_size=options['batch_size'])
+        with open(path, 'rb') as stream:
+            result = item_importer.run(stream, file_type)
+
+        for error in result['errors']:
+            self.stderr.write('Row {row}: {errors}'.format(**error))
+        self.stdout.write('Created {created} items, {failed} rows failed.'.format(
+            created=result['created'], failed=len(result['errors'])
+        ))
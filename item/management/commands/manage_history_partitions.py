@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from item import partitions
+
+
+class Command(BaseCommand):
+    help = 'Creates upcoming monthly ItemHistory partitions and archives months past the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.ITEM_HISTORY_PARTITIONS_AHEAD,
+                            help='Months ahead of the current one to create partitions for')
+        parser.add_argument('--archive', action='store_true', help='Archive months older than --retain months')
+        parser.add_argument('--retain', type=int, default=settings.ITEM_HISTORY_RETENTION_MONTHS,
+                            help='Months of history kept in the database')
+        parser.add_argument('--archive-dir', default=settings.ITEM_HISTORY_ARCHIVE_DIR)
+        parser.add_argument('--keep-detached', action='store_true',
+                            help='Leave archived partitions as detached tables instead of dropping them')
+
+    def handle(self, *args, **options):
+        if partitions.is_partitioned():
+            months = partitions.ensure_partitions(ahead=options['ahead'])
+            self.stdout.write('Partitions present up to {month:%Y-%m}.'.format(month=months[-1]))
+        else:
+            self.stdout.write('ItemHistory is not partitioned on this database, skipping partition creation.')
+
+        if not options['archive']:
+            return
+        before = partitions.add_months(partitions.month_start(timezone.now()), -options['retain'])
+        for month in partitions.archivable_months(before):
+            path, written = partitions.archive_month(month, archive_dir=options['archive_dir'],
+                                                     keep_detached=options['keep_detached'])
+            self.stdout.write('Archived {count} rows of {month:%Y-%m} to {path}.'.format(
+                count=written, month=month, path=path
+            ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from item import counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes OrganizationStatusCount rows from RequestedItem/ApprovedItem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', type=int, help='Rebuild a single organization')
+
+    def handle(self, *args, **options):
+        written = counters.rebuild(organization_id=options['organization'])
+        self.stdout.write('Wrote {count} counter rows.'.format(count=written))
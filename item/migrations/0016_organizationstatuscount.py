@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_counts(apps, schema_editor):
+    RequestedItem = apps.get_model('item', 'RequestedItem')
+    ApprovedItem = apps.get_model('item', 'ApprovedItem')
+    OrganizationStatusCount = apps.get_model('item', 'OrganizationStatusCount')
+    # Historical managers don't hide trashed rows
+    rows = [
+        OrganizationStatusCount(organization_id=row['item_group__organization'], status=row['status'],
+                                count=row['count'])
+        for row in RequestedItem.objects.filter(trashed=False).values(
+            'item_group__organization', 'status').order_by().annotate(count=models.Count('id'))
+    ] + [
+        OrganizationStatusCount(organization_id=row['approved_item__item_group__organization'],
+                                status=row['status'], count=row['count'])
+        for row in ApprovedItem.objects.filter(trashed=False).values(
+            'approved_item__item_group__organization', 'status').order_by().annotate(count=models.Count('id'))
+    ]
+    OrganizationStatusCount.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0001_initial'),
+        ('item', '0015_auto_20200327_1103'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationStatusCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_counts', to='organization.Organization')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='organizationstatuscount',
+            unique_together=set([('organization', 'status')]),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0016_organizationstatuscount'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemgroup',
+            index=models.Index(fields=['created_at', 'id'], name='item_group_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['created_at', 'id'], name='item_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requesteditem',
+            index=models.Index(fields=['created_at', 'id'], name='item_request_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='approveditem',
+            index=models.Index(fields=['created_at', 'id'], name='item_approved_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemhistory',
+            index=models.Index(fields=['created_at', 'id'], name='item_history_created_id_idx'),
+        ),
+    ]
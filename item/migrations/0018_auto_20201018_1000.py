@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0017_created_at_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
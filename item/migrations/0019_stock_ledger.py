@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+STOCK_MOVEMENT_REASON_ADDED = 19
+
+
+def seed_ledger(apps, schema_editor):
+    """
+    Existing stock enters the ledger as one ADDED movement per item, stock before the migration is not known
+    """
+    Item = apps.get_model('item', 'Item')
+    StockMovement = apps.get_model('item', 'StockMovement')
+    last_id = 0
+    while True:
+        items = list(Item.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'item_group_id', 'quantity'
+        )[:1000])
+        if not items:
+            return
+        StockMovement.objects.bulk_create([
+            StockMovement(item_id=item_id, item_group_id=item_group_id, delta=quantity,
+                          reason=STOCK_MOVEMENT_REASON_ADDED)
+            for item_id, item_group_id, quantity in items if quantity
+        ])
+        last_id = items[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0018_auto_20201018_1000'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('delta', models.IntegerField()),
+                ('reason', models.PositiveSmallIntegerField(choices=[(19, 'Added'), (20, 'Approved'), (21, 'Returned'), (22, 'Adjusted'), (23, 'Removed')])),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='item.Item')),
+                ('item_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='item.ItemGroup')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('quantity', models.IntegerField()),
+                ('taken_at', models.DateTimeField(db_index=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='item.Item')),
+                ('item_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='item.ItemGroup')),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item', 'created_at'], name='item_movement_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item_group', 'created_at'], name='item_movement_group_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshot',
+            unique_together=set([('item', 'taken_at')]),
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['item_group', 'taken_at'], name='item_snapshot_group_idx'),
+        ),
+        migrations.RunPython(seed_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def full_name(user):
+    return "{first_name} {last_name}".format(first_name=user.first_name, last_name=user.last_name)
+
+
+def backfill_snapshots(apps, schema_editor):
+    """
+    Copies the approval of every existing history row into its snapshot columns
+    """
+    ItemHistory = apps.get_model('item', 'ItemHistory')
+    last_id = 0
+    while True:
+        rows = list(ItemHistory.objects.filter(id__gt=last_id, approved__isnull=False).select_related(
+            'approved__request', 'approved__approved_by', 'approved__approved_to',
+            'approved__approved_item__item_group'
+        ).order_by('id')[:1000])
+        if not rows:
+            return
+        for row in rows:
+            approved = row.approved
+            item = approved.approved_item
+            ItemHistory.objects.filter(id=row.id).update(
+                organization_id=item.item_group.organization_id,
+                item_id=item.id,
+                item_group_name=item.item_group.item_name,
+                item_type=item.type,
+                item_quantity=item.quantity,
+                approved_quantity=approved.request.quantity,
+                requested_duration=approved.request.requested_duration,
+                approved_duration=approved.approved_duration,
+                requested_at=approved.request.created_at,
+                approved_at=approved.created_at,
+                approved_by_id=approved.approved_by.id,
+                approved_by_name=full_name(approved.approved_by),
+                approved_by_picture=approved.approved_by.profile_picture,
+                approved_by_role=approved.approved_by.role,
+                approved_to_id=approved.approved_to.id,
+                approved_to_name=full_name(approved.approved_to),
+                approved_to_picture=approved.approved_to.profile_picture,
+                approved_to_role=approved.approved_to.role,
+            )
+        last_id = rows[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0001_initial'),
+        ('item', '0019_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemhistory',
+            name='organization',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='organization.Organization'),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='item',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='item.Item'),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='item_group_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='item_type',
+            field=models.PositiveSmallIntegerField(choices=[(13, 'Shareable'), (14, 'Returnable'), (15, 'Permanent')], null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='item_quantity',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_quantity',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='requested_duration',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_duration',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='requested_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_by_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_by_name',
+            field=models.CharField(blank=True, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_by_picture',
+            field=models.ImageField(blank=True, null=True, upload_to='images/'),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_by_role',
+            field=models.PositiveSmallIntegerField(choices=[(4, 'Admin'), (5, 'Manager'), (6, 'User')], null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_to_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_to_name',
+            field=models.CharField(blank=True, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_to_picture',
+            field=models.ImageField(blank=True, null=True, upload_to='images/'),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_to_role',
+            field=models.PositiveSmallIntegerField(choices=[(4, 'Admin'), (5, 'Manager'), (6, 'User')], null=True),
+        ),
+        migrations.AddIndex(
+            model_name='itemhistory',
+            index=models.Index(fields=['organization', 'item', '-created_at'], name='item_history_org_item_idx'),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+import re
+from datetime import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'item_itemhistory'
+OLD_TABLE = 'item_itemhistory_unpartitioned'
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def indexes_and_foreign_keys(cursor, table):
+    """
+    Definitions of the indexes (except the primary key) and foreign keys of table
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+        [table, table]
+    )
+    index_definitions = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    return index_definitions, cursor.fetchall()
+
+
+def recreate_indexes_and_foreign_keys(cursor, index_definitions, foreign_keys):
+    # Same index and constraint names as before, created on a partitioned parent they cascade to every partition
+    for definition in index_definitions:
+        cursor.execute(re.sub(r' ON (ONLY )?(\S+\.)?{table} '.format(table=TABLE), ' ON {table} '.format(table=TABLE),
+                              definition))
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE {table} ADD CONSTRAINT {name} {definition}'.format(
+            table=TABLE, name=name, definition=definition
+        ))
+
+
+def partition_itemhistory(apps, schema_editor):
+    """
+    PostgreSQL (11+): rebuilds item_itemhistory as a table range partitioned by month on created_at,
+    one partition per month holding rows plus PARTITIONS_AHEAD months ahead and a default partition.
+    The primary key becomes (id, created_at) as PostgreSQL requires the partition key in it, ids still
+    come from the same sequence. Other databases keep the plain table.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    cursor = schema_editor.connection.cursor()
+    index_definitions, foreign_keys = indexes_and_foreign_keys(cursor, TABLE)
+
+    cursor.execute('ALTER TABLE {table} RENAME TO {old}'.format(table=TABLE, old=OLD_TABLE))
+    cursor.execute(
+        'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'.format(
+            table=TABLE, old=OLD_TABLE
+        )
+    )
+    cursor.execute('ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)'.format(table=TABLE))
+    cursor.execute('CREATE TABLE {table}_default PARTITION OF {table} DEFAULT'.format(table=TABLE))
+
+    cursor.execute('SELECT min(created_at) FROM {old}'.format(old=OLD_TABLE))
+    oldest = cursor.fetchone()[0] or timezone.now()
+    oldest = oldest.astimezone(timezone.utc)
+    month = datetime(oldest.year, oldest.month, 1, tzinfo=timezone.utc)
+    now = timezone.now()
+    last = add_months(datetime(now.year, now.month, 1, tzinfo=timezone.utc), PARTITIONS_AHEAD)
+    while month <= last:
+        cursor.execute(
+            'CREATE TABLE {table}_p{year}_{month:02d} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)'.format(
+                table=TABLE, year=month.year, month=month.month
+            ),
+            [month, add_months(month, 1)]
+        )
+        month = add_months(month, 1)
+
+    cursor.execute('INSERT INTO {table} SELECT * FROM {old}'.format(table=TABLE, old=OLD_TABLE))
+    cursor.execute("ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id".format(table=TABLE))
+    cursor.execute('DROP TABLE {old}'.format(old=OLD_TABLE))
+    recreate_indexes_and_foreign_keys(cursor, index_definitions, foreign_keys)
+
+
+def unpartition_itemhistory(apps, schema_editor):
+    """
+    Reverse of partition_itemhistory: copies every partition (archived months are gone) back into a plain
+    item_itemhistory with id as primary key
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    cursor = schema_editor.connection.cursor()
+    index_definitions, foreign_keys = indexes_and_foreign_keys(cursor, TABLE)
+
+    cursor.execute('ALTER TABLE {table} RENAME TO {old}'.format(table=TABLE, old=OLD_TABLE))
+    cursor.execute('CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)'.format(table=TABLE, old=OLD_TABLE))
+    cursor.execute('INSERT INTO {table} SELECT * FROM {old}'.format(table=TABLE, old=OLD_TABLE))
+    cursor.execute("ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id".format(table=TABLE))
+    # Drops every partition with it, the primary key is added once its name is free again
+    cursor.execute('DROP TABLE {old}'.format(old=OLD_TABLE))
+    cursor.execute('ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)'.format(table=TABLE))
+    recreate_indexes_and_foreign_keys(cursor, index_definitions, foreign_keys)
+
+
+class Migration(migrations.Migration):
+
+    atomic = True
+
+    dependencies = [
+        ('item', '0020_itemhistory_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_itemhistory, unpartition_itemhistory),
+    ]
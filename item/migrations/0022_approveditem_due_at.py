@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+ACKNOWLEDGED = 11
+PERMANENT = 15
+INDEX_NAME = 'item_approved_due_at_ack_idx'
+
+
+def backfill_due_at(apps, schema_editor):
+    ApprovedItem = apps.get_model('item', 'ApprovedItem')
+    last_id = 0
+    while True:
+        rows = list(ApprovedItem.objects.filter(
+            id__gt=last_id, status=ACKNOWLEDGED, approved_duration__isnull=False
+        ).exclude(approved_item__type=PERMANENT).order_by('id').values_list(
+            'id', 'current_status_date', 'approved_duration'
+        )[:1000])
+        if not rows:
+            return
+        for approved_id, current_status_date, approved_duration in rows:
+            ApprovedItem.objects.filter(id=approved_id).update(
+                due_at=current_status_date + timedelta(days=approved_duration)
+            )
+        last_id = rows[-1][0]
+
+
+def create_due_at_index(apps, schema_editor):
+    """
+    Partial index on acknowledged, not trashed rows (the only ones with a due_at that matters),
+    a plain due_at index where partial indexes aren't supported
+    """
+    condition = ''
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        condition = ' WHERE status = {status} AND NOT trashed'.format(status=ACKNOWLEDGED)
+    schema_editor.execute('CREATE INDEX {name} ON item_approveditem (due_at){condition}'.format(
+        name=INDEX_NAME, condition=condition
+    ))
+
+
+def drop_due_at_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX {name} ON item_approveditem'.format(name=INDEX_NAME))
+    else:
+        schema_editor.execute('DROP INDEX {name}'.format(name=INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0021_partition_itemhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='approveditem',
+            name='due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+        migrations.RunPython(create_due_at_index, drop_due_at_index),
+    ]
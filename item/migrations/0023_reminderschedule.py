@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+PENDING = 10
+ACKNOWLEDGED = 11
+REMINDER_ACKNOWLEDGE = 24
+REMINDER_RETURN = 25
+
+
+def seed_schedules(apps, schema_editor):
+    """
+    One schedule per approval which is still waiting for acknowledgement or return
+    """
+    ApprovedItem = apps.get_model('item', 'ApprovedItem')
+    ReminderSchedule = apps.get_model('item', 'ReminderSchedule')
+    acknowledge_after = timedelta(seconds=settings.REMINDER_ACKNOWLEDGE_AFTER_SECONDS)
+    last_id = 0
+    while True:
+        rows = list(ApprovedItem.objects.filter(id__gt=last_id, trashed=False).filter(
+            models.Q(status=PENDING) | models.Q(status=ACKNOWLEDGED, due_at__isnull=False)
+        ).order_by('id').values_list('id', 'status', 'created_at', 'due_at')[:1000])
+        if not rows:
+            return
+        ReminderSchedule.objects.bulk_create([
+            ReminderSchedule(approved_id=approved_id, kind=REMINDER_ACKNOWLEDGE, due_at=created_at + acknowledge_after)
+            if status == PENDING else
+            ReminderSchedule(approved_id=approved_id, kind=REMINDER_RETURN, due_at=due_at)
+            for approved_id, status, created_at, due_at in rows
+        ])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0022_approveditem_due_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(24, 'Acknowledge'), (25, 'Return')])),
+                ('due_at', models.DateTimeField()),
+                ('enqueued_at', models.DateTimeField(blank=True, null=True)),
+                ('approved', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='item.ApprovedItem')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='reminderschedule',
+            unique_together=set([('approved', 'kind')]),
+        ),
+        migrations.AddIndex(
+            model_name='reminderschedule',
+            index=models.Index(fields=['due_at'], name='item_reminder_due_at_idx'),
+        ),
+        migrations.RunPython(seed_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0001_initial'),
+        ('item', '0023_reminderschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(24, 'Acknowledge'), (25, 'Return')])),
+                ('period', models.DateField()),
+                ('last_user_id', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_runs', to='organization.Organization')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='reminderrun',
+            unique_together=set([('kind', 'organization', 'period')]),
+        ),
+    ]
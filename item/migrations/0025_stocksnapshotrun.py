@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-19 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_existing_runs(apps, schema_editor):
+    # Snapshots taken before the marker existed can't be told apart from a partial run, keep reading them
+    StockSnapshot = apps.get_model('item', 'StockSnapshot')
+    StockSnapshotRun = apps.get_model('item', 'StockSnapshotRun')
+    taken_ats = StockSnapshot.objects.filter(trashed=False).order_by().values_list('taken_at', flat=True).distinct()
+    StockSnapshotRun.objects.bulk_create([
+        StockSnapshotRun(taken_at=taken_at, finished_at=taken_at) for taken_at in taken_ats
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0024_reminderrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshotRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trashed', models.BooleanField(db_index=True, default=False)),
+                ('taken_at', models.DateTimeField(unique=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(mark_existing_runs, migrations.RunPython.noop),
+    ]
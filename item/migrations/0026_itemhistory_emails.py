@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2020-10-19 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_emails(apps, schema_editor):
+    """
+    Copies the email of every user found in existing history rows, one update per user and side
+    """
+    ItemHistory = apps.get_model('item', 'ItemHistory')
+    User = apps.get_model('user', 'User')
+    for side in ('approved_by', 'approved_to'):
+        user_ids = ItemHistory.objects.filter(**{side + '_id__isnull': False}).order_by().values_list(
+            side + '_id', flat=True
+        ).distinct()
+        for user_id, email in User.objects.filter(id__in=list(user_ids)).values_list('id', 'email'):
+            ItemHistory.objects.filter(**{side + '_id': user_id}).update(**{side + '_email': email})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_auto_20200307_0349'),
+        ('item', '0025_stocksnapshotrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_by_email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='itemhistory',
+            name='approved_to_email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.RunPython(backfill_emails, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.db import models
 from base.models import BaseModel
 from user.models import User
@@ -13,19 +15,26 @@ class ItemGroup(BaseModel):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_group_created_id_idx'),
+        ]
 
     def __str__(self):
         return "{id} {name}".format(id=self.id, name=self.item_name)
 
 
 class Item(BaseModel):
-    quantity = models.IntegerField(default=1)
+    # Positive field: the database rejects negative stock (CHECK quantity >= 0), see item.inventory
+    quantity = models.PositiveIntegerField(default=1)
     item_group = models.ForeignKey(ItemGroup, on_delete=models.CASCADE, related_name='items')
     type = models.PositiveSmallIntegerField(choices=constants.ITEM_TYPE_CHOICES, default=constants.ITEM_TYPE.RETURNABLE)
     is_assigned = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_created_id_idx'),
+        ]
 
     def __str__(self):
         return "{id} {name} {type}".format(id=str(self.id),
@@ -59,6 +68,9 @@ class RequestedItem(BaseModel):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_request_created_id_idx'),
+        ]
 
     def __str__(self):
         return "{id} {name} {type} {status}".format(id=str(self.id),
@@ -86,9 +98,24 @@ class ApprovedItem(BaseModel):
     status = models.PositiveSmallIntegerField(choices=constants.ACKNOWLEDGE_STATUS_CHOICES, default=constants.ACKNOWLEDGE_STATUS.PENDING)
 
     current_status_date = models.DateTimeField(auto_now_add=True)
+    # Return date of acknowledged non permanent items, partial index on acknowledged rows (migration 0022)
+    due_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_approved_created_id_idx'),
+        ]
+
+    def update_due_at(self):
+        """
+        Recomputes due_at from status, current_status_date and approved_duration, call before save
+        """
+        if self.status == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED and self.approved_duration \
+                and self.approved_item.type != constants.ITEM_TYPE.PERMANENT:
+            self.due_at = self.current_status_date + timedelta(days=self.approved_duration)
+        else:
+            self.due_at = None
 
     def __str__(self):
         return "{id} {name} {request_status} {status}".format(id=str(self.id),
@@ -108,8 +135,131 @@ class ApprovedItem(BaseModel):
 
 
 class ItemHistory(BaseModel):
+    """
+    Status transition of an ApprovedItem with a snapshot of the approval taken when the row is written
+    (see item.history.snapshot), so history is listed from this table alone
+    """
     approved = models.ForeignKey(ApprovedItem, on_delete=models.DO_NOTHING, null=True)
     status = models.PositiveSmallIntegerField(choices=constants.ACKNOWLEDGE_STATUS_CHOICES, default=constants.ACKNOWLEDGE_STATUS.PENDING)
 
+    organization = models.ForeignKey(Organization, on_delete=models.DO_NOTHING, null=True, db_constraint=False,
+                                     db_index=False, related_name='+')
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, null=True, db_constraint=False, db_index=False,
+                             related_name='+')
+    item_group_name = models.CharField(max_length=100, blank=True)
+    item_type = models.PositiveSmallIntegerField(choices=constants.ITEM_TYPE_CHOICES, null=True)
+    item_quantity = models.IntegerField(null=True)
+
+    approved_quantity = models.IntegerField(null=True)
+    requested_duration = models.IntegerField(null=True)
+    approved_duration = models.IntegerField(null=True)
+    requested_at = models.DateTimeField(null=True)
+    approved_at = models.DateTimeField(null=True)
+
+    approved_by_id = models.IntegerField(null=True)
+    approved_by_name = models.CharField(max_length=201, blank=True)
+    approved_by_email = models.EmailField(blank=True)
+    approved_by_picture = models.ImageField(upload_to='images/', blank=True, null=True)
+    approved_by_role = models.PositiveSmallIntegerField(choices=constants.ROLE_CHOICES, null=True)
+    approved_to_id = models.IntegerField(null=True)
+    approved_to_name = models.CharField(max_length=201, blank=True)
+    approved_to_email = models.EmailField(blank=True)
+    approved_to_picture = models.ImageField(upload_to='images/', blank=True, null=True)
+    approved_to_role = models.PositiveSmallIntegerField(choices=constants.ROLE_CHOICES, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='item_history_created_id_idx'),
+            models.Index(fields=['organization', 'item', '-created_at'], name='item_history_org_item_idx'),
+        ]
+
+
+class OrganizationStatusCount(BaseModel):
+    """
+    Denormalized number of RequestedItem/ApprovedItem rows per organization and status
+    (REQUEST_STATUS and ACKNOWLEDGE_STATUS values don't overlap). Maintained by item.counters.
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='status_counts')
+    status = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('organization', 'status')
+
+
+class StockMovement(BaseModel):
+    """
+    Append-only ledger of Item.quantity changes, see item.ledger
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='stock_movements')
+    item_group = models.ForeignKey(ItemGroup, on_delete=models.CASCADE, related_name='stock_movements')
+    delta = models.IntegerField()
+    reason = models.PositiveSmallIntegerField(choices=constants.STOCK_MOVEMENT_REASON_CHOICES)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['item', 'created_at'], name='item_movement_item_idx'),
+            models.Index(fields=['item_group', 'created_at'], name='item_movement_group_idx'),
+        ]
+
+
+class StockSnapshot(BaseModel):
+    """
+    Quantity of every item at taken_at, computed from the previous snapshot and the StockMovements in between
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='stock_snapshots')
+    item_group = models.ForeignKey(ItemGroup, on_delete=models.CASCADE, related_name='stock_snapshots')
+    quantity = models.IntegerField()
+    taken_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['-taken_at']
+        unique_together = ('item', 'taken_at')
+        indexes = [
+            models.Index(fields=['item_group', 'taken_at'], name='item_snapshot_group_idx'),
+        ]
+
+
+class StockSnapshotRun(BaseModel):
+    """
+    Completion marker of the StockSnapshot rows taken at taken_at, only snapshots of a finished run are read
+    """
+    taken_at = models.DateTimeField(unique=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+
+class ReminderSchedule(BaseModel):
+    """
+    Pending reminder of an ApprovedItem, at most one per kind. Maintained by item.reminders,
+    a row exists only while the approval is in the state the reminder is about.
+    """
+    approved = models.ForeignKey(ApprovedItem, on_delete=models.CASCADE, related_name='reminders')
+    kind = models.PositiveSmallIntegerField(choices=constants.REMINDER_KIND_CHOICES)
+    due_at = models.DateTimeField()
+    # When the timer (celery task with an eta) was handed to the broker, null until then
+    enqueued_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('approved', 'kind')
+        indexes = [
+            models.Index(fields=['due_at'], name='item_reminder_due_at_idx'),
+        ]
+
+
+class ReminderRun(BaseModel):
+    """
+    Checkpoint of one organization's share of a reminder scan (item.reminders.run_organization_scan),
+    one row per kind, organization and period so a redelivered or restarted scan resumes instead of re-sending
+    """
+    kind = models.PositiveSmallIntegerField(choices=constants.REMINDER_KIND_CHOICES)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='reminder_runs')
+    period = models.DateField()
+    # Recipients are walked in approved_to id order, every one up to last_user_id has been sent
+    last_user_id = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('kind', 'organization', 'period')
@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from item.models import ItemHistory
+
+TABLE = ItemHistory._meta.db_table
+
+
+def month_start(value):
+    if timezone.is_aware(value):
+        value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return '{table}_p{year}_{month:02d}'.format(table=TABLE, year=month.year, month=month.month)
+
+
+def month_of(name):
+    """
+    Month of a partition named by partition_name, None for any other table
+    """
+    prefix = TABLE + '_p'
+    if not name.startswith(prefix):
+        return None
+    try:
+        year, month = name[len(prefix):].split('_')
+        return datetime(int(year), int(month), 1, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def is_partitioned():
+    """
+    ItemHistory is range partitioned by month on PostgreSQL (migration 0021), a plain table elsewhere
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s',
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_months():
+    """
+    Months which currently have their own partition, oldest first
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s',
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(month for month in map(month_of, names) if month is not None)
+
+
+def create_partition(month):
+    """
+    Creates the partition of month if it doesn't exist. Rows of that month already in the default partition
+    make PostgreSQL refuse, partitions should be created ahead of time (see manage_history_partitions).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)'.format(
+                name=partition_name(month), table=TABLE
+            ),
+            [month, add_months(month, 1)]
+        )
+
+
+def ensure_partitions(ahead=None, now=None):
+    """
+    Creates partitions from the current month up to ahead months later
+    :return: months created (or already present)
+    """
+    ahead = settings.ITEM_HISTORY_PARTITIONS_AHEAD if ahead is None else ahead
+    current = month_start(now or timezone.now())
+    months = [add_months(current, offset) for offset in range(ahead + 1)]
+    for month in months:
+        create_partition(month)
+    return months
+
+
+def month_queryset(month):
+    # A created_at range on the partition key, PostgreSQL only scans the partition of month
+    return ItemHistory.all_objects.filter(created_at__gte=month, created_at__lt=add_months(month, 1))
+
+
+def archive_path(month, archive_dir=None):
+    archive_dir = archive_dir or settings.ITEM_HISTORY_ARCHIVE_DIR
+    return os.path.join(archive_dir, partition_name(month) + '.jsonl.gz')
+
+
+def write_archive(month, archive_dir=None):
+    """
+    Dumps every ItemHistory row of month (all columns) to a gzipped JSON Lines file
+    :return: (path, number of rows)
+    """
+    path = archive_path(month, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with gzip.open(path, 'wt') as archive:
+        for row in month_queryset(month).order_by('id').values().iterator():
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            written += 1
+    return path, written
+
+
+def archive_month(month, archive_dir=None, keep_detached=False, batch_size=None):
+    """
+    Writes the archive of month then removes its rows from ItemHistory.
+    Partitioned: the partition is detached (and dropped unless keep_detached).
+    Plain table: rows are hard deleted in primary key batches.
+    :return: (path, number of rows)
+    """
+    path, written = write_archive(month, archive_dir)
+    if is_partitioned():
+        if month in partition_months():
+            with connection.cursor() as cursor:
+                cursor.execute('ALTER TABLE {table} DETACH PARTITION {name}'.format(
+                    table=TABLE, name=partition_name(month)
+                ))
+                if not keep_detached:
+                    cursor.execute('DROP TABLE {name}'.format(name=partition_name(month)))
+        else:
+            # Rows of months without their own partition live in the default partition
+            _delete_in_batches(month_queryset(month), batch_size)
+    else:
+        _delete_in_batches(month_queryset(month), batch_size)
+    return path, written
+
+
+def archivable_months(before):
+    """
+    Months entirely before the month of before which still have history rows, oldest first
+    """
+    cutoff = month_start(before)
+    if is_partitioned():
+        months = set(month for month in partition_months() if month < cutoff)
+    else:
+        months = set()
+    oldest = ItemHistory.all_objects.filter(created_at__lt=cutoff).order_by('created_at').values_list(
+        'created_at', flat=True
+    ).first()
+    if oldest is not None:
+        month = month_start(oldest)
+        while month < cutoff:
+            if month_queryset(month).exists():
+                months.add(month)
+            month = add_months(month, 1)
+    return sorted(months)
+
+
+def _delete_in_batches(queryset, batch_size=None):
+    batch_size = batch_size or settings.REAPER_BATCH_SIZE
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic():
+            ItemHistory.all_objects.filter(id__in=ids).delete(forced=True)
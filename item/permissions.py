@@ -7,7 +7,7 @@ from utils.constants import ROLE
 class IsAdminOrManagerActions(BasePermission):
 
     def has_permission(self, request, view):
-        actions = ['create', 'update', 'destroy', 'send_reminder']
+        actions = ['create', 'update', 'destroy', 'send_reminder', 'bulk_import']
         if view.action in actions:
             return request.user.is_authenticated and (request.user.role in (ROLE.ADMIN, ROLE.MANAGER,))
         elif view.action == 'user':
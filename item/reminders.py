@@ -0,0 +1,198 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from base import notifications
+from item.models import ApprovedItem, ReminderRun, ReminderSchedule
+from organization.models import Organization
+from utils import constants
+
+TEMPLATES = {
+    constants.REMINDER_KIND.ACKNOWLEDGE: ('pending_acknowledge.html', constants.SUBJECT_REMINDER_TO_ACKNOWLEDGE),
+    constants.REMINDER_KIND.RETURN: ('pending_return.html', constants.SUBJECT_REMINDER_TO_RETURN),
+}
+
+
+def _aware(value):
+    # current_status_date (and so due_at) is set from datetime.now() by the views
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def timers_enabled():
+    """
+    Timers are only handed to celery with REMINDER_SCHEDULER 'timers', with 'scan' the daily scans send reminders
+    and schedules are merely kept up to date (for switching back)
+    """
+    return settings.REMINDER_SCHEDULER != 'scan'
+
+
+def desired(approved):
+    """
+    {kind: due_at} of the reminders an ApprovedItem should have in its current state
+    """
+    if approved.status == constants.ACKNOWLEDGE_STATUS.PENDING:
+        return {
+            constants.REMINDER_KIND.ACKNOWLEDGE:
+                _aware(approved.created_at) + timedelta(seconds=settings.REMINDER_ACKNOWLEDGE_AFTER_SECONDS)
+        }
+    if approved.status == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED and approved.due_at is not None:
+        return {constants.REMINDER_KIND.RETURN: _aware(approved.due_at)}
+    return {}
+
+
+def sync(approved):
+    sync_many([approved])
+
+
+def sync_many(approvals):
+    """
+    Creates, moves or deletes the ReminderSchedule rows of approvals to match their state.
+    Call inside the transaction saving them. Only rows are written, requests never talk to the broker:
+    dispatch_reminders hands the timers to celery every REMINDER_DISPATCH_INTERVAL.
+    """
+    approvals = list(approvals)
+    approved_ids = [approved.id for approved in approvals]
+    existing = {
+        (schedule.approved_id, schedule.kind): schedule
+        for schedule in ReminderSchedule.objects.filter(approved_id__in=approved_ids)
+    }
+    to_create = []
+    to_delete = []
+    for approved in approvals:
+        wanted = desired(approved)
+        for kind in constants.REMINDER_KIND:
+            schedule = existing.get((approved.id, kind))
+            due_at = wanted.get(kind)
+            if due_at is None:
+                if schedule is not None:
+                    to_delete.append(schedule.id)
+            elif schedule is None:
+                to_create.append(ReminderSchedule(approved_id=approved.id, kind=kind, due_at=due_at))
+            elif schedule.due_at != due_at:
+                # Moving due_at also fences off the timer already enqueued for the old one
+                schedule.due_at = due_at
+                schedule.enqueued_at = None
+                schedule.save(update_fields=['due_at', 'enqueued_at', 'updated_at'])
+
+    if to_delete:
+        ReminderSchedule.all_objects.filter(id__in=to_delete).delete(forced=True)
+    ReminderSchedule.objects.bulk_create(to_create)
+
+
+def enqueue_pending(schedules=None, now=None):
+    """
+    Hands the timers of schedules due within REMINDER_ETA_HORIZON_SECONDS to celery (eta = due_at):
+    the ones never enqueued and the ones enqueued but still not fired REMINDER_GRACE_SECONDS after they were due
+    (lost with a broker or worker restart).
+    :return: number of timers enqueued
+    """
+    from base.tasks import send_scheduled_reminder
+    schedules = ReminderSchedule.objects.all() if schedules is None else schedules
+    now = now or timezone.now()
+    late = now - timedelta(seconds=settings.REMINDER_GRACE_SECONDS)
+    pending = list(schedules.filter(
+        due_at__lte=now + timedelta(seconds=settings.REMINDER_ETA_HORIZON_SECONDS)
+    ).filter(
+        Q(enqueued_at__isnull=True) | Q(due_at__lt=late, enqueued_at__lt=late)
+    ).values_list('id', 'due_at'))
+    for schedule_id, due_at in pending:
+        send_scheduled_reminder.apply_async(kwargs={'schedule_id': schedule_id, 'due_at': due_at.isoformat()},
+                                            eta=max(due_at, now))
+    ReminderSchedule.objects.filter(id__in=[schedule_id for schedule_id, _ in pending]).update(enqueued_at=now)
+    return len(pending)
+
+
+def fire(schedule_id, due_at):
+    """
+    Writes the reminder of a timer to the outbox and schedules its repetition NOTIFICATIONS_JOB_INTERVAL later.
+    Timers whose schedule was deleted or moved since they were enqueued are stale and dropped,
+    so duplicated and recovered timers never send twice. Timers still queued after switching to the scan scheduler
+    are dropped too, the scans send those reminders.
+    :return: True if the reminder was sent
+    """
+    if not timers_enabled():
+        return False
+    with transaction.atomic():
+        schedule = ReminderSchedule.objects.select_for_update().filter(id=schedule_id, due_at=due_at).first()
+        if schedule is None:
+            return False
+        approved = ApprovedItem.objects.select_related('approved_to', 'approved_item__item_group__organization').filter(
+            id=schedule.approved_id
+        ).first()
+        if approved is None or schedule.kind not in desired(approved):
+            schedule.delete(forced=True)
+            return False
+
+        schedule.due_at = max(due_at, timezone.now()) + timedelta(seconds=settings.NOTIFICATIONS_JOB_INTERVAL)
+        schedule.enqueued_at = None
+        schedule.save(update_fields=['due_at', 'enqueued_at', 'updated_at'])
+        # Written while the row is locked, a concurrent duplicate waits and then finds the timer stale
+        template_name, subject = TEMPLATES[schedule.kind]
+        notifications.notify(approved.approved_to.email, template_name, {'num_items': 1}, subject,
+                             dedup_key='reminder:{id}:{due_at}'.format(id=schedule_id, due_at=due_at.isoformat()),
+                             organization=approved.approved_item.item_group.organization,
+                             priority=constants.EMAIL_PRIORITY.BULK)
+    enqueue_pending(ReminderSchedule.objects.filter(id=schedule_id))
+    return True
+
+
+def scan_queryset(kind, organization_id, now=None):
+    """
+    Approvals of an organization a reminder scan of kind is about
+    """
+    now = now or timezone.now()
+    approvals = ApprovedItem.objects.filter(approved_item__item_group__organization_id=organization_id)
+    if kind == constants.REMINDER_KIND.ACKNOWLEDGE:
+        return approvals.filter(
+            status=constants.ACKNOWLEDGE_STATUS.PENDING,
+            created_at__lt=now - timedelta(seconds=settings.REMINDER_ACKNOWLEDGE_AFTER_SECONDS)
+        )
+    return approvals.filter(status=constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED, due_at__lt=now)
+
+
+def pending_recipients(kind, organization_id, after, limit):
+    """
+    Next limit recipients (approved_to id > after) with their number of items, keyset pagination on approved_to
+    """
+    return list(scan_queryset(kind, organization_id).filter(approved_to_id__gt=after).values(
+        'approved_to_id', 'approved_to__email'
+    ).annotate(num_items=Count('id')).order_by('approved_to_id')[:limit])
+
+
+def run_organization_scan(kind, organization_id, period, batch_size=None):
+    """
+    Writes the reminders of kind for one organization and period to the outbox, batch_size recipients at a time.
+    The ReminderRun row is locked for every batch and moved past it in the same transaction, so a duplicated task
+    waits and continues after it and a crashed one resumes from the last batch written. Finished runs do nothing.
+    :return: number of reminders sent
+    """
+    batch_size = batch_size or settings.REMINDER_SCAN_BATCH_SIZE
+    ReminderRun.objects.get_or_create(kind=kind, organization_id=organization_id, period=period)
+    template_name, subject = TEMPLATES[kind]
+    organization = Organization.objects.get(id=organization_id)
+    sent = 0
+    while True:
+        with transaction.atomic():
+            run = ReminderRun.objects.select_for_update().get(kind=kind, organization_id=organization_id, period=period)
+            if run.finished_at is not None:
+                return sent
+            recipients = pending_recipients(kind, organization_id, run.last_user_id, batch_size)
+            if not recipients:
+                run.finished_at = timezone.now()
+                run.save(update_fields=['finished_at', 'updated_at'])
+                return sent
+
+            notifications.notify_many([
+                (recipient['approved_to__email'], template_name, {'num_items': recipient['num_items']}, subject,
+                 'scan:{kind}:{organization}:{period}:{user}'.format(
+                     kind=kind, organization=organization_id, period=period, user=recipient['approved_to_id']
+                 ))
+                for recipient in recipients
+            ], organization=organization)
+            run.last_user_id = recipients[-1]['approved_to_id']
+            run.sent += len(recipients)
+            run.save(update_fields=['last_user_id', 'sent', 'updated_at'])
+            sent += len(recipients)
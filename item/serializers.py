@@ -1,16 +1,48 @@
 from django.db import models, transaction
-from django.template import loader
-from base.tasks import send_email
+from base import notifications
 from rest_framework import serializers
 from rest_framework import exceptions
 from item import exceptions as item_exception
-from user.models import User
+from item import counters, history, inventory, ledger, reminders
 from item.models import ItemGroup, Item, ItemAttribute, RequestedItem, ApprovedItem, ItemHistory
 from datetime import datetime
+from django.utils import timezone
 
 from utils import constants
 
 
+def approved_email_context(approver_user, item, requested_item):
+    return {
+        'first_name': approver_user.first_name,
+        'full_name': "{first_name} {last_name}".format(first_name=approver_user.first_name,
+                                                       last_name=approver_user.last_name),
+        'email': approver_user.email,
+        'role': "Admin" if approver_user.role == constants.ROLE.ADMIN else (
+            "Manager" if approver_user.role == constants.ROLE.MANAGER else "User"),
+        'organization_name': approver_user.organization.name,
+        'item_group_name': item.item_group.item_name,
+        'quantity': requested_item.quantity
+    }
+
+
+def validate_item_for_group(item_group, validated_data):
+    """
+    Rules an item must follow to be added to item_group, raises item exceptions
+    """
+    quantity = validated_data.get('quantity')
+    if not quantity:
+        quantity = 1
+
+    if quantity <= 0:
+        raise item_exception.NegativeOrZeroQuantityException
+
+    if not item_group.is_accessory and quantity > 1:
+        raise item_exception.InvalidQuantityException
+
+    if item_group.is_accessory and validated_data['type'] != constants.ITEM_TYPE.PERMANENT:
+        raise item_exception.InvalidItemAdd
+
+
 class ItemGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = ItemGroup
@@ -45,23 +77,14 @@ class ItemSerializer(serializers.ModelSerializer):
                 return item_exception.OrganizationException
 
             validated_data['item_group'] = item_group
-            quantity = validated_data.get('quantity')
-            if not quantity:
-                quantity = 1
-
-            if quantity <= 0:
-                raise item_exception.NegativeOrZeroQuantityException
-
-            if not item_group.is_accessory and quantity > 1:
-                raise item_exception.InvalidQuantityException
-
-            if item_group.is_accessory and validated_data['type'] != constants.ITEM_TYPE.PERMANENT:
-                raise item_exception.InvalidItemAdd
+            validate_item_for_group(item_group, validated_data)
 
             attributes = validated_data.get('attributes')
             validated_data.pop('attributes')
 
-            item = super().create(validated_data)
+            with transaction.atomic():
+                item = super().create(validated_data)
+                ledger.record(item, item.quantity, constants.STOCK_MOVEMENT_REASON.ADDED)
             if attributes:
                 item_attribute_serializer = ItemAttributeSerializer(data=attributes, many=True)
                 item_attribute_serializer.is_valid(raise_exception=True)
@@ -80,17 +103,18 @@ class ItemSerializer(serializers.ModelSerializer):
         quantity = validated_data.get('quantity')
         attributes = validated_data.get('attributes')
 
-        validated_data.clear()
-
-        if quantity and item_group.is_accessory:
-            validated_data['quantity'] = quantity
-
         if attributes:
             ItemAttribute.objects.filter(item=instance).delete()
             item_attribute_serializer = ItemAttributeSerializer(data=attributes, many=True)
             item_attribute_serializer.is_valid(raise_exception=True)
             item_attribute_serializer.save(item=instance)
-        return super(ItemSerializer, self).update(instance, validated_data)
+
+        # Quantity is the only field written, with an F() update rather than a save of the instance read earlier
+        if quantity and item_group.is_accessory:
+            with transaction.atomic():
+                inventory.adjust(instance, quantity)
+            instance.refresh_from_db(fields=['quantity', 'updated_at'])
+        return instance
 
 
 class RequestedItemSerializer(serializers.ModelSerializer):
@@ -136,31 +160,31 @@ class RequestedItemSerializer(serializers.ModelSerializer):
                 raise item_exception.NoDuration
             if validated_data['type'] != constants.ITEM_TYPE.PERMANENT and requested_duration <= 0:
                 raise item_exception.InvalidDuration
-            return super().create(validated_data)
+            with transaction.atomic():
+                instance = super().create(validated_data)
+                counters.record_transition(item_group.organization_id, None, instance.status)
+            return instance
         except models.ObjectDoesNotExist:
             raise exceptions.NotFound
 
 
 class ApprovedItemSerializer(serializers.ModelSerializer):
     item_group_name = serializers.CharField(source='approved_item.item_group.item_name', read_only=True)
-    item_attributes = serializers.SerializerMethodField()
+    item_attributes = ItemAttributeSerializer(source='approved_item.attributes', many=True, read_only=True)
     type = serializers.IntegerField(source='approved_item.type', read_only=True)
     quantity = serializers.IntegerField(source='request.quantity', read_only=True)
     approved_by_name = serializers.CharField(source='approved_by.full_name', read_only=True)
     approved_to_name = serializers.CharField(source='approved_to.full_name', read_only=True)
 
-    def get_item_attributes(self, approvedItem):
-        attributes_list = approvedItem.approved_item.attributes
-        return ItemAttributeSerializer(attributes_list, many=True).data
-
     class Meta:
         model = ApprovedItem
         fields = (
             'id', 'status', 'created_at', 'updated_at',
             'item_group_name', 'quantity', 'approved_duration',
-            'item_attributes', 'type', 'current_status_date',
+            'item_attributes', 'type', 'current_status_date', 'due_at',
             'approved_by_name', 'approved_to_name'
         )
+        read_only_fields = ('due_at',)
 
     def create(self, validated_data):
         approver_user = self.context['request'].user
@@ -225,46 +249,34 @@ class ApprovedItemSerializer(serializers.ModelSerializer):
             )
             if item.type != constants.ITEM_TYPE.SHAREABLE or item.item_group.is_accessory:
                 raise item_exception.ApproveNonShareableItemException
-
-            with transaction.atomic():
-                approver_user_approved_request.status = constants.ACKNOWLEDGE_STATUS.RETURNED
-                item.is_assigned = False
-                item.quantity += approver_user_approved_request.request.quantity
-                approver_user_approved_request.save()
         except models.ObjectDoesNotExist:
+            approver_user_approved_request = None
             if approver_user.role == constants.ROLE.USER:
                 raise item_exception.NotFound
 
-        if requested_item.quantity > item.quantity:
-            raise item_exception.InvalidQuantityApproveException
-
-        with transaction.atomic():
-            item.quantity = item.quantity - requested_item.quantity
-            if item.quantity == 0:
-                item.is_assigned = True
-            requested_item.status = constants.REQUEST_STATUS.APPROVED
-            requested_item.current_status_date = datetime.now()
-            item.save()
-            requested_item.save()
-
-        validated_data['request'] = requested_item
-        validated_data['approved_to'] = requested_item.requested_by
-        validated_data['approved_item'] = item
-        instance = super().create(validated_data)
-        recipient_email = requested_item.requested_by.email
-        context = {
-            'first_name': approver_user.first_name,
-            'full_name': "{first_name} {last_name}".format(first_name=approver_user.first_name,
-                                                           last_name=approver_user.last_name),
-            'email': approver_user.email,
-            'role': "Admin" if approver_user.role == constants.ROLE.ADMIN else (
-                "Manager" if approver_user.role == constants.ROLE.MANAGER else "User"),
-            'organization_name': approver_user.organization.name,
-            'item_group_name': item.item_group.item_name,
-            'quantity': requested_item.quantity
-        }
-        html_message = loader.get_template('approved.html').render(context)
-        send_email.delay(html_message=html_message, recipient_email=recipient_email, subject=constants.SUBJECT_REQUEST_APPROVED)
+        with history.atomic():
+            # Skipped when a concurrent return already moved it to RETURNED (and credited the stock)
+            if approver_user_approved_request is not None and inventory.give_back(approver_user_approved_request):
+                reminders.sync(approver_user_approved_request)
+
+            # Conditional UPDATEs, a request rejected, cancelled or approved meanwhile or a stock which ran out
+            # raises (and rolls back)
+            if not counters.transition(requested_item, item.item_group.organization_id,
+                                       constants.REQUEST_STATUS.PENDING, constants.REQUEST_STATUS.APPROVED,
+                                       current_status_date=datetime.now()):
+                raise item_exception.DestroyRequestException
+            inventory.take(item, requested_item.quantity)
+
+            validated_data['request'] = requested_item
+            validated_data['approved_to'] = requested_item.requested_by
+            validated_data['approved_item'] = item
+            instance = super().create(validated_data)
+            reminders.sync(instance)
+            counters.record_transition(item.item_group.organization_id, None, instance.status)
+            context = approved_email_context(approver_user, item, requested_item)
+            notifications.notify(requested_item.requested_by.email, 'approved.html', context,
+                                 constants.SUBJECT_REQUEST_APPROVED, dedup_key='approved:{id}'.format(id=instance.id),
+                                 organization=approver_user.organization)
         return instance
 
     def update(self, instance, validated_data):
@@ -276,59 +288,183 @@ class ApprovedItemSerializer(serializers.ModelSerializer):
         approved_duration = validated_data.get('approved_duration')
         if not approved_duration or approved_duration <= 0:
             raise item_exception.InvalidDuration
-        return super(ApprovedItemSerializer, self).update(instance, validated_data)
-
+        duration_changed = approved_duration != instance.approved_duration
+        instance.approved_duration = approved_duration
+        instance.update_due_at()
+        with transaction.atomic():
+            instance = super(ApprovedItemSerializer, self).update(instance, validated_data)
+            if duration_changed:
+                reminders.sync(instance)
+        return instance
 
-class MyRequestStatsSerializer(serializers.Serializer):
-    requests_pending = serializers.IntegerField()
-    requests_approved = serializers.IntegerField()
-    requests_cancelled = serializers.IntegerField()
-    requests_rejected = serializers.IntegerField()
-    requests_total = serializers.IntegerField()
 
+class ApprovalSerializer(serializers.Serializer):
+    request_id = serializers.IntegerField()
+    item_id = serializers.IntegerField()
+    approved_duration = serializers.IntegerField(required=False, allow_null=True)
 
-class MyApproveStatsSerializer(serializers.Serializer):
-    approve_pending = serializers.IntegerField()
-    approve_acknowledged = serializers.IntegerField()
-    approve_returned = serializers.IntegerField()
-    approve_total = serializers.IntegerField()
 
+class BulkApproveSerializer(serializers.Serializer):
+    """
+    Approves many (request, item) pairs at once, all or nothing.
+    Every pair is validated like ApprovedItemSerializer.create with set based queries,
+    stock is taken with one conditional UPDATE per item (see item.inventory).
+    approved_duration defaults to the requested duration.
+    """
+    approvals = ApprovalSerializer(many=True)
 
-class UserSmallSerializer(serializers.ModelSerializer):
-    full_name = serializers.CharField()
+    def validate_approvals(self, approvals):
+        if not approvals:
+            raise serializers.ValidationError('At least one approval is required.')
+        request_ids = [approval['request_id'] for approval in approvals]
+        if len(set(request_ids)) != len(request_ids):
+            raise serializers.ValidationError('A request can only be approved once.')
+        return approvals
 
-    class Meta:
-        model = User
-        fields = ('id', 'full_name', 'profile_picture', 'role',)
+    def create(self, validated_data):
+        approver_user = self.context['request'].user
+        organization = approver_user.organization
+        approvals = validated_data['approvals']
+
+        with history.atomic():
+            requested_items = RequestedItem.objects.select_related('item_group', 'requested_by').filter(
+                id__in=[approval['request_id'] for approval in approvals],
+                item_group__organization=organization
+            ).in_bulk()
+            items = Item.objects.select_related('item_group').filter(
+                id__in=set(approval['item_id'] for approval in approvals),
+                item_group__organization=organization
+            ).in_bulk()
+            held_item_ids = set(ApprovedItem.objects.filter(
+                approved_to=approver_user,
+                approved_item__id__in=items.keys(),
+                status=constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+            ).values_list('approved_item__id', flat=True))
+
+            errors = {}
+            available = {item_id: item.quantity for item_id, item in items.items()}
+            assigned_item_ids = set()
+            for index, approval in enumerate(approvals):
+                requested_item = requested_items.get(approval['request_id'])
+                item = items.get(approval['item_id'])
+                try:
+                    approval['approved_duration'] = self._validate_approval(
+                        approval, requested_item, item, held_item_ids, available, assigned_item_ids
+                    )
+                except exceptions.APIException as e:
+                    errors[index] = e.detail
+            if errors:
+                raise serializers.ValidationError({'approvals': errors})
+
+            now = datetime.now()
+            for item_id, quantity in available.items():
+                if quantity != items[item_id].quantity:
+                    # Stock may have moved since it was read, the conditional UPDATE rolls the batch back if so
+                    inventory.take(items[item_id], items[item_id].quantity - quantity)
+            # Conditional UPDATE, a request rejected, cancelled or approved since it was read rolls the batch back
+            approved = RequestedItem.objects.filter(
+                id__in=requested_items.keys(), status=constants.REQUEST_STATUS.PENDING
+            ).update(status=constants.REQUEST_STATUS.APPROVED, current_status_date=now, updated_at=timezone.now())
+            if approved != len(approvals):
+                raise item_exception.DestroyRequestException
+            ApprovedItem.objects.bulk_create([
+                ApprovedItem(
+                    request_id=approval['request_id'],
+                    approved_by=approver_user,
+                    approved_to_id=requested_items[approval['request_id']].requested_by_id,
+                    approved_item_id=approval['item_id'],
+                    approved_duration=approval['approved_duration'],
+                    status=constants.ACKNOWLEDGE_STATUS.PENDING
+                ) for approval in approvals
+            ])
+            # bulk_create skips post_save (history) and only returns ids on PostgreSQL, fetch them back
+            instances = list(ApprovedItem.objects.select_related(
+                'request', 'approved_by', 'approved_to', 'approved_item__item_group'
+            ).prefetch_related('approved_item__attributes').filter(request__id__in=requested_items.keys()))
+            history.record_many((instance.id, instance.status) for instance in instances)
+            reminders.sync_many(instances)
+            counters.apply_deltas(organization.id, {
+                constants.REQUEST_STATUS.PENDING: -len(approvals),
+                constants.REQUEST_STATUS.APPROVED: len(approvals),
+                constants.ACKNOWLEDGE_STATUS.PENDING: len(approvals),
+            })
+
+            messages = []
+            for instance in instances:
+                requested_item = requested_items[instance.request_id]
+                context = approved_email_context(approver_user, items[instance.approved_item_id], requested_item)
+                messages.append((requested_item.requested_by.email, 'approved.html', context,
+                                 constants.SUBJECT_REQUEST_APPROVED, 'approved:{id}'.format(id=instance.id)))
+            notifications.notify_many(messages, organization=organization)
+        return instances
+
+    @staticmethod
+    def _validate_approval(approval, requested_item, item, held_item_ids, available, assigned_item_ids):
+        """
+        :param assigned_item_ids: non shareable items approved earlier in the batch, added to
+        :return: approved duration to store
+        """
+        if requested_item is None or item is None:
+            raise item_exception.NotFound
+        if requested_item.status != constants.REQUEST_STATUS.PENDING:
+            raise item_exception.DestroyRequestException
+        if item.item_group_id != requested_item.item_group_id:
+            raise item_exception.ItemGroupMismatchError
+        if item.type != requested_item.type:
+            raise item_exception.InvalidItemRequest
+        if item.type != constants.ITEM_TYPE.SHAREABLE and (item.is_assigned or item.id in assigned_item_ids):
+            raise item_exception.ItemAlreadyAssigned
+        if item.id in held_item_ids and not item.item_group.is_accessory:
+            raise item_exception.ApproveNonShareableItemException
+
+        if item.type == constants.ITEM_TYPE.PERMANENT:
+            approved_duration = None
+        else:
+            approved_duration = approval.get('approved_duration')
+            if approved_duration is None:
+                approved_duration = requested_item.requested_duration
+            if approved_duration is None:
+                raise item_exception.NoDuration
+            if approved_duration <= 0:
+                raise item_exception.InvalidDuration
 
+        if requested_item.quantity > available[item.id]:
+            raise item_exception.InvalidQuantityApproveException
+        available[item.id] -= requested_item.quantity
+        if item.type != constants.ITEM_TYPE.SHAREABLE:
+            assigned_item_ids.add(item.id)
+        return approved_duration
+
+
+class HistoryUserSerializer(serializers.Serializer):
+    """
+    UserSmallSerializer shaped view of the approved_by_* / approved_to_* snapshot columns of ItemHistory
+    """
+
+    def __init__(self, prefix, **kwargs):
+        self.prefix = prefix
+        super(HistoryUserSerializer, self).__init__(source='*', read_only=True, **kwargs)
+
+    def get_fields(self):
+        return {
+            'id': serializers.IntegerField(source=self.prefix + '_id'),
+            'full_name': serializers.CharField(source=self.prefix + '_name'),
+            'profile_picture': serializers.ImageField(source=self.prefix + '_picture'),
+            'role': serializers.IntegerField(source=self.prefix + '_role'),
+        }
 
-class ItemSmallSerializer(serializers.ModelSerializer):
-    item_group_name = serializers.CharField(source='item_group.item_name')
 
-    class Meta:
-        model = Item
-        fields = ('id', 'quantity', 'item_group_name', 'type')
+class HistoryItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='item_id')
+    quantity = serializers.IntegerField(source='item_quantity')
+    item_group_name = serializers.CharField()
+    type = serializers.IntegerField(source='item_type')
 
 
 class ItemHistorySerializer(serializers.ModelSerializer):
-    approved_by = serializers.SerializerMethodField()
-    approved_to = serializers.SerializerMethodField()
-    item = serializers.SerializerMethodField()
-
-    approved_quantity = serializers.IntegerField(source='approved.request.quantity', read_only=True)
-    requested_duration = serializers.IntegerField(source='approved.request.requested_duration', read_only=True)
-    approved_duration = serializers.IntegerField(source='approved.approved_duration', read_only=True)
-    requested_at = serializers.DateTimeField(source='approved.request.created_at', read_only=True)
-    approved_at = serializers.DateTimeField(source='approved.created_at', read_only=True)
-
-    def get_approved_by(self, obj):
-        return UserSmallSerializer(obj.approved.approved_by).data
-
-    def get_approved_to(self, obj):
-        return UserSmallSerializer(obj.approved.approved_to).data
-
-    def get_item(self, obj):
-        return ItemSmallSerializer(obj.approved.approved_item).data
+    approved_by = HistoryUserSerializer(prefix='approved_by')
+    approved_to = HistoryUserSerializer(prefix='approved_to')
+    item = HistoryItemSerializer(source='*', read_only=True)
 
     class Meta:
         model = ItemHistory
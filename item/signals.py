@@ -1,12 +1,20 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save
 from django.dispatch import receiver
+from item import history
 from item.models import ApprovedItem
-from item.models import ItemHistory
+
+
+@receiver(post_init, sender=ApprovedItem, dispatch_uid="remember_status")
+def remember_status(sender, instance, **kwargs):
+    # __dict__ so a deferred status isn't fetched
+    instance._history_status = instance.__dict__.get('status')
 
 
 @receiver(post_save, sender=ApprovedItem, dispatch_uid="log_to_history")
-def log_to_history(sender, instance, **kwargs):
-    item_history = ItemHistory.objects.create(
-        approved=instance,
-        status=instance.status
-    )
+def log_to_history(sender, instance, created, **kwargs):
+    """
+    Logs only real status transitions (see item.history)
+    """
+    if created or instance.status != instance._history_status:
+        history.record(instance.id, instance.status)
+    instance._history_status = instance.status
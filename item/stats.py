@@ -0,0 +1,76 @@
+from django.db.models import Case, When, Value, Sum, Count, IntegerField
+
+from item import counters
+from item.models import RequestedItem, ApprovedItem
+from utils import constants
+
+
+class StatsFamily(object):
+    """
+    Counts rows of a queryset per status bucket with a single conditional aggregate query.
+    Output: {'<prefix>_<bucket>': count, ..., '<prefix>_total': count}
+    """
+
+    def __init__(self, prefix, buckets):
+        self.prefix = prefix
+        self.buckets = buckets
+
+    def aggregate(self, qs):
+        annotations = {
+            '{prefix}_{name}'.format(prefix=self.prefix, name=name): Sum(
+                Case(When(status=status, then=Value(1)), default=Value(0), output_field=IntegerField())
+            ) for name, status in self.buckets
+        }
+        annotations['{prefix}_total'.format(prefix=self.prefix)] = Count('id')
+        result = qs.order_by().aggregate(**annotations)
+        return {key: value or 0 for key, value in result.items()}
+
+    def from_counts(self, counts):
+        """
+        Same output as aggregate, built from a {status: count} dict (see item.counters.get_counts)
+        """
+        result = {
+            '{prefix}_{name}'.format(prefix=self.prefix, name=name): counts.get(status, 0)
+            for name, status in self.buckets
+        }
+        result['{prefix}_total'.format(prefix=self.prefix)] = sum(result.values())
+        return result
+
+
+REQUEST_STATS = StatsFamily('requests', (
+    ('pending', constants.REQUEST_STATUS.PENDING),
+    ('approved', constants.REQUEST_STATUS.APPROVED),
+    ('cancelled', constants.REQUEST_STATUS.CANCELLED),
+    ('rejected', constants.REQUEST_STATUS.REJECTED),
+))
+
+APPROVE_STATS = StatsFamily('approve', (
+    ('pending', constants.ACKNOWLEDGE_STATUS.PENDING),
+    ('acknowledged', constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED),
+    ('returned', constants.ACKNOWLEDGE_STATUS.RETURNED),
+))
+
+
+def my_requests(user):
+    return REQUEST_STATS.aggregate(RequestedItem.objects.filter(requested_by=user))
+
+
+def my_approved(user):
+    return APPROVE_STATS.aggregate(ApprovedItem.objects.filter(approved_to=user))
+
+
+def organization_requests(user):
+    return REQUEST_STATS.from_counts(counters.get_counts(user.organization_id))
+
+
+def organization_approved(user):
+    return APPROVE_STATS.from_counts(counters.get_counts(user.organization_id))
+
+
+# name: (stats of user, admin/manager only)
+STATS_SOURCES = {
+    'my_requests': (my_requests, False),
+    'my_approved': (my_approved, False),
+    'organization_requests': (organization_requests, True),
+    'organization_approved': (organization_approved, True),
+}
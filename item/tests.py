@@ -1,4 +1,21 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import loader
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
@@ -9,8 +26,15 @@ from ddf import G, F
 from invite.models import Invite
 from user.models import User
 from authentication.models import AuthToken
-from item.models import ItemGroup, Item, RequestedItem, ApprovedItem
-from utils.constants import ROLE
+from base import notifications, outbox
+from base.models import OutboxEmail
+from base.token_cache import token_cache
+from item import counters, history, inventory, ledger, partitions, reminders
+from item import exceptions as item_exception
+from item.models import ItemGroup, Item, ItemAttribute, RequestedItem, ApprovedItem, ItemHistory, ReminderSchedule, \
+    ReminderRun, StockSnapshotRun
+from utils.constants import ROLE, REQUEST_STATUS, ITEM_TYPE, STOCK_MOVEMENT_REASON, ACKNOWLEDGE_STATUS, REMINDER_KIND, \
+    EMAIL_PRIORITY
 
 
 class ItemTests(APITestCase):
@@ -18,3 +42,692 @@ class ItemTests(APITestCase):
     def test_item_group(self):
         url = reverse('item:item-group-list')
         print(url)
+
+
+class StatsTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        for request_status in (REQUEST_STATUS.PENDING, REQUEST_STATUS.PENDING, REQUEST_STATUS.REJECTED):
+            G(RequestedItem, item_group=item_group, requested_by=self.admin, status=request_status,
+              type=ITEM_TYPE.RETURNABLE)
+
+    def test_my_requests_stats(self):
+        response = self.client.get('/my_requests/stats/', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'requests_pending': 2, 'requests_approved': 0, 'requests_cancelled': 0,
+            'requests_rejected': 1, 'requests_total': 3
+        })
+
+    def test_combined_stats(self):
+        url = reverse('stats-list')
+        response = self.client.get(url, {'include': 'my_requests,organization_approved'}, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'my_requests', 'organization_approved'})
+        self.assertEqual(response.data['my_requests']['requests_total'], 3)
+        self.assertEqual(response.data['organization_approved']['approve_total'], 0)
+
+    def test_combined_stats_unknown_family(self):
+        url = reverse('stats-list')
+        response = self.client.get(url, {'include': 'everything'}, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OrganizationCounterTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG", phone='+919999999999')
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        self.item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+
+    def test_counters_follow_request_status(self):
+        url = '/item_group/{id}/request/'.format(id=self.item_group.id)
+        response = self.client.post(url, {'type': ITEM_TYPE.RETURNABLE, 'requested_duration': 2}, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.delete('/manage_requests/{id}/'.format(id=response.data['id']), **self.auth_headers)
+
+        response = self.client.get('/my_organization_requests/stats/', **self.auth_headers)
+        self.assertEqual(response.data['requests_pending'], 0)
+        self.assertEqual(response.data['requests_rejected'], 1)
+        self.assertEqual(response.data['requests_total'], 1)
+
+    def test_rebuild(self):
+        G(RequestedItem, item_group=self.item_group, requested_by=self.admin, status=REQUEST_STATUS.PENDING,
+          type=ITEM_TYPE.RETURNABLE)
+        counters.rebuild()
+        self.assertEqual(counters.get_counts(self.admin.organization_id), {REQUEST_STATUS.PENDING: 1})
+
+    def test_stale_transition_is_not_counted(self):
+        request = G(RequestedItem, item_group=self.item_group, requested_by=self.admin, status=REQUEST_STATUS.PENDING,
+                    type=ITEM_TYPE.RETURNABLE)
+        counters.rebuild(self.admin.organization_id)
+        stale = RequestedItem.objects.get(id=request.id)
+        self.assertTrue(counters.transition(request, self.admin.organization_id, REQUEST_STATUS.PENDING,
+                                            REQUEST_STATUS.REJECTED))
+        self.assertFalse(counters.transition(stale, self.admin.organization_id, REQUEST_STATUS.PENDING,
+                                             REQUEST_STATUS.CANCELLED))
+        counts = counters.get_counts(self.admin.organization_id)
+        self.assertEqual((counts[REQUEST_STATUS.PENDING], counts[REQUEST_STATUS.REJECTED]), (0, 1))
+        self.assertFalse(counts.get(REQUEST_STATUS.CANCELLED))
+        self.assertEqual(RequestedItem.objects.get(id=request.id).status, REQUEST_STATUS.REJECTED)
+
+    def test_rebuild_resets_stale_counters(self):
+        counters.apply_deltas(self.admin.organization_id, {REQUEST_STATUS.REJECTED: 5})
+        counters.rebuild(self.admin.organization_id)
+        self.assertEqual(counters.get_counts(self.admin.organization_id).get(REQUEST_STATUS.REJECTED), 0)
+
+
+class BulkApproveTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        self.item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        self.requests = [
+            G(RequestedItem, item_group=self.item_group, requested_by=self.admin, status=REQUEST_STATUS.PENDING,
+              type=ITEM_TYPE.RETURNABLE, quantity=1, requested_duration=5) for _ in range(3)
+        ]
+        self.items = [
+            G(Item, item_group=self.item_group, type=ITEM_TYPE.RETURNABLE, quantity=1, is_assigned=False)
+            for _ in range(3)
+        ]
+
+    def test_bulk_approve(self):
+        data = {'approvals': [
+            {'request_id': request.id, 'item_id': item.id} for request, item in zip(self.requests, self.items)
+        ]}
+        response = self.client.post('/manage_requests/bulk_approve/', data, format='json', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ApprovedItem.objects.count(), 3)
+        self.assertEqual(ItemHistory.objects.count(), 3)
+        self.assertFalse(Item.objects.filter(is_assigned=False).exists())
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+    def test_bulk_approve_is_all_or_nothing(self):
+        data = {'approvals': [
+            {'request_id': self.requests[0].id, 'item_id': self.items[0].id},
+            {'request_id': self.requests[1].id, 'item_id': self.items[0].id},
+        ]}
+        response = self.client.post('/manage_requests/bulk_approve/', data, format='json', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('1', {str(index) for index in response.data['approvals']})
+        self.assertEqual(ApprovedItem.objects.count(), 0)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_bulk_approve_assigns_an_item_once(self):
+        Item.objects.filter(id=self.items[0].id).update(quantity=2)
+        data = {'approvals': [
+            {'request_id': self.requests[0].id, 'item_id': self.items[0].id},
+            {'request_id': self.requests[1].id, 'item_id': self.items[0].id, 'approved_duration': 0},
+        ]}
+        response = self.client.post('/manage_requests/bulk_approve/', data, format='json', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual({str(index) for index in response.data['approvals']}, {'1'})
+
+        data['approvals'][1]['item_id'] = self.items[1].id
+        response = self.client.post('/manage_requests/bulk_approve/', data, format='json', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual({str(index) for index in response.data['approvals']}, {'1'})
+
+    def test_request_rejected_after_validation_rolls_back(self):
+        take = inventory.take
+
+        def reject_then_take(item, quantity):
+            RequestedItem.objects.filter(id=self.requests[1].id).update(status=REQUEST_STATUS.REJECTED)
+            take(item, quantity)
+
+        data = {'approvals': [
+            {'request_id': request.id, 'item_id': item.id} for request, item in zip(self.requests, self.items)
+        ]}
+        counters.rebuild(self.admin.organization_id)
+        with mock.patch('item.inventory.take', side_effect=reject_then_take):
+            response = self.client.post('/manage_requests/bulk_approve/', data, format='json', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(ApprovedItem.objects.count(), 0)
+        self.assertEqual(counters.get_counts(self.admin.organization_id), {REQUEST_STATUS.PENDING: 3})
+
+
+class ItemImportTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        self.item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        self.url = '/item_group/{id}/item/bulk_import/'.format(id=self.item_group.id)
+
+    def test_csv_import_reports_bad_rows(self):
+        body = 'quantity,type,serial,colour\n1,14,SN1,black\n2,14,SN2,\n1,15,SN3,\n'
+        response = self.client.post(self.url + '?batch_size=1', data=body, content_type='text/csv',
+                                    **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2])
+        self.assertEqual(Item.objects.filter(item_group=self.item_group).count(), 2)
+        self.assertEqual(ItemAttribute.objects.filter(item__item_group=self.item_group).count(), 3)
+
+    def test_jsonl_import(self):
+        body = '{"type": 14, "attributes": [{"attribute_name": "serial", "attribute_value": "SN1"}]}\nnot json\n'
+        response = self.client.post(self.url, data=body, content_type='application/x-ndjson', **self.auth_headers)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2])
+
+    def test_only_bad_rows_is_ok_with_errors(self):
+        response = self.client.post(self.url, data='not json\n', content_type='application/x-ndjson',
+                                    **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], len(response.data['errors'])), (0, 1))
+
+    def test_invalid_batch_size(self):
+        response = self.client.post(self.url + '?batch_size=abc', data='', content_type='application/x-ndjson',
+                                    **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        for serial in ('SN1', 'SN2'):
+            item = G(Item, item_group=item_group, type=ITEM_TYPE.RETURNABLE, quantity=1)
+            G(ItemAttribute, item=item, attribute_name='serial', attribute_value=serial)
+
+    def test_inventory_jsonl(self):
+        response = self.client.get('/export/inventory/', {'file_type': 'jsonl'}, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(row['attributes'][0]['attribute_value'] for row in rows), ['SN1', 'SN2'])
+
+    def test_inventory_csv(self):
+        response = self.client.get('/export/inventory/', **self.auth_headers)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('item_group_id,'))
+
+    def test_history_exports_emails(self):
+        user = G(User, role=ROLE.USER, organization=self.admin.organization)
+        item = Item.objects.first()
+        request = G(RequestedItem, item_group=item.item_group, requested_by=user, quantity=1,
+                    type=ITEM_TYPE.RETURNABLE, status=REQUEST_STATUS.APPROVED)
+        G(ApprovedItem, approved_item=item, request=request, approved_by=self.admin, approved_to=user)
+        response = self.client.get('/export/history/', {'file_type': 'jsonl'}, **self.auth_headers)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['approved_by'], row['approved_to']) for row in rows], [(self.admin.email, user.email)])
+
+
+class CursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        for _ in range(5):
+            G(RequestedItem, item_group=item_group, requested_by=self.admin, status=REQUEST_STATUS.PENDING,
+              type=ITEM_TYPE.RETURNABLE)
+
+    def test_cursor_pagination_walks_every_row_once(self):
+        response = self.client.get('/my_requests/', {'pagination': 'cursor', 'page_size': 2}, **self.auth_headers)
+        self.assertNotIn('count', response.data)
+        ids = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'], **self.auth_headers)
+            ids += [row['id'] for row in response.data['results']]
+        self.assertEqual(sorted(ids), sorted(RequestedItem.objects.values_list('id', flat=True)))
+
+    def test_cursor_pagination_with_equal_created_at(self):
+        RequestedItem.objects.update(created_at=timezone.now())
+        response = self.client.get('/my_requests/', {'pagination': 'cursor', 'page_size': 2}, **self.auth_headers)
+        first_page = [row['id'] for row in response.data['results']]
+        ids = list(first_page)
+        while response.data['next']:
+            response = self.client.get(response.data['next'], **self.auth_headers)
+            ids += [row['id'] for row in response.data['results']]
+        self.assertEqual(ids, sorted(RequestedItem.objects.values_list('id', flat=True), reverse=True))
+
+        second = self.client.get('/my_requests/', {'pagination': 'cursor', 'page_size': 2}, **self.auth_headers)
+        second = self.client.get(second.data['next'], **self.auth_headers)
+        back = self.client.get(second.data['previous'], **self.auth_headers)
+        self.assertEqual([row['id'] for row in back.data['results']], first_page)
+
+    def test_page_number_pagination_is_default(self):
+        response = self.client.get('/my_requests/', {'page_size': 2}, **self.auth_headers)
+        self.assertEqual(response.data['count'], 5)
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Every list endpoint should run the same number of queries whatever the page size (no N+1)
+    """
+
+    def setUp(self):
+        self.admin = G(User, email="kashish25798@gmail.com", password=make_password("qwerty123456789"),
+                       role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        self.item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=True)
+        self.item = G(Item, item_group=self.item_group, type=ITEM_TYPE.PERMANENT, quantity=100)
+        G(ItemAttribute, item=self.item, attribute_name='colour', attribute_value='black')
+        for _ in range(10):
+            user = G(User, role=ROLE.USER, organization=self.admin.organization)
+            request = G(RequestedItem, item_group=self.item_group, requested_by=user, type=ITEM_TYPE.PERMANENT,
+                        status=REQUEST_STATUS.APPROVED)
+            G(ApprovedItem, request=request, approved_by=self.admin, approved_to=user, approved_item=self.item)
+
+    def count_queries(self, url, page_size):
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'page_size': page_size}, **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url):
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 10), url)
+
+    def test_my_organization_requests(self):
+        self.assertConstantQueries('/my_organization_requests/')
+
+    def test_my_organization_approved_requests(self):
+        self.assertConstantQueries('/my_organization_requests/approved/')
+
+    def test_approved_item_view(self):
+        self.assertConstantQueries('/manage_requests/0/item/0/approve/')
+
+    def test_item_history(self):
+        self.assertConstantQueries('/item_group/{group}/item/{item}/history/'.format(group=self.item_group.id,
+                                                                                     item=self.item.id))
+
+    def test_item_history_reads_one_table(self):
+        token_cache.clear()
+        url = '/item_group/{group}/item/{item}/history/'.format(group=self.item_group.id, item=self.item.id)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'page_size': 2}, **self.auth_headers)
+        self.assertEqual(response.data['results'][0]['approved_by']['id'], self.admin.id)
+        history_queries = [query['sql'] for query in context.captured_queries if 'item_itemhistory' in query['sql']]
+        self.assertTrue(history_queries)
+        self.assertFalse([sql for sql in history_queries if 'JOIN' in sql])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs a database with row level concurrency')
+class InventoryStressTests(TransactionTestCase):
+
+    def test_concurrent_takes_never_oversubscribe(self):
+        admin = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        item_group = G(ItemGroup, organization=admin.organization, added_by=admin, is_accessory=True)
+        item = G(Item, item_group=item_group, type=ITEM_TYPE.PERMANENT, quantity=5, is_assigned=False)
+        results = []
+        start = threading.Barrier(20)
+
+        def approve():
+            start.wait()
+            try:
+                with transaction.atomic():
+                    inventory.take(item, 1)
+                results.append(True)
+            except item_exception.InvalidQuantityApproveException:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=approve) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        item.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(item.quantity, 0)
+        self.assertTrue(item.is_assigned)
+
+
+class StockLedgerTests(APITestCase):
+
+    def setUp(self):
+        admin = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        self.item_group = G(ItemGroup, organization=admin.organization, added_by=admin, is_accessory=True)
+        self.item = G(Item, item_group=self.item_group, type=ITEM_TYPE.PERMANENT, quantity=10)
+        ledger.record(self.item, 10, STOCK_MOVEMENT_REASON.ADDED)
+
+    def test_quantity_at_replays_tail_after_snapshot(self):
+        with transaction.atomic():
+            inventory.take(self.item, 3)
+        before_snapshot = timezone.now()
+        ledger.take_snapshot()
+        with transaction.atomic():
+            inventory.take(self.item, 2)
+            inventory.put_back(self.item, 1)
+
+        self.assertEqual(ledger.quantity_at(before_snapshot, item_group_id=self.item_group.id), 7)
+        self.assertEqual(ledger.quantity_at(timezone.now(), item_group_id=self.item_group.id), 6)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 6)
+
+    def test_interrupted_snapshot_is_not_read(self):
+        taken_at = timezone.now()
+        StockSnapshotRun.objects.create(taken_at=taken_at)
+        self.assertEqual(ledger.quantity_at(timezone.now(), item_id=self.item.id), 10)
+
+        self.assertEqual(ledger.take_snapshot(taken_at=taken_at), 1)
+        self.assertEqual(ledger.take_snapshot(taken_at=taken_at), 0)
+        self.assertEqual(ledger.quantity_at(timezone.now(), item_id=self.item.id), 10)
+
+    def test_adjust_records_difference_to_current_stock(self):
+        stale = Item.objects.get(id=self.item.id)
+        with transaction.atomic():
+            inventory.take(self.item, 3)
+        with transaction.atomic():
+            inventory.adjust(stale, 12)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 12)
+        self.assertEqual(ledger.quantity_at(timezone.now(), item_id=self.item.id), 12)
+
+
+class ItemHistoryWriterTests(APITestCase):
+
+    def setUp(self):
+        user = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        item_group = G(ItemGroup, organization=user.organization, added_by=user)
+        item = G(Item, item_group=item_group, quantity=1)
+        request = G(RequestedItem, item_group=item_group, requested_by=user, quantity=1)
+        self.approved = G(ApprovedItem, approved_item=item, request=request, approved_by=user, approved_to=user,
+                          status=ACKNOWLEDGE_STATUS.PENDING)
+        ItemHistory.all_objects.all().delete(forced=True)
+
+    def test_only_transitions_are_logged(self):
+        self.approved.save()
+        self.approved.status = ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+        self.approved.save()
+        self.approved.save()
+        self.assertEqual(list(ItemHistory.objects.values_list('status', flat=True)), [ACKNOWLEDGE_STATUS.ACKNOWLEDGED])
+
+    def test_rows_of_rolled_back_savepoint_are_discarded(self):
+        try:
+            with transaction.atomic():
+                self.approved.status = ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+                self.approved.save()
+                self.assertEqual(ItemHistory.objects.count(), 1)
+                raise item_exception.AcknowledgeItemException
+        except item_exception.AcknowledgeItemException:
+            pass
+        self.assertFalse(ItemHistory.objects.exists())
+
+    def test_rows_are_buffered_until_the_outermost_block_exits(self):
+        with CaptureQueriesContext(connection) as context:
+            with history.atomic():
+                self.approved.status = ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+                self.approved.save()
+                try:
+                    with history.atomic():
+                        self.approved.status = ACKNOWLEDGE_STATUS.RETURNED
+                        self.approved.save()
+                        raise item_exception.ReturnItemException
+                except item_exception.ReturnItemException:
+                    self.approved.status = ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+                with history.atomic():
+                    history.record(self.approved.id, ACKNOWLEDGE_STATUS.RETURNED)
+                self.assertFalse(ItemHistory.objects.exists())
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT') and 'item_itemhistory' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(list(ItemHistory.objects.order_by('id').values_list('status', flat=True)),
+                         [ACKNOWLEDGE_STATUS.ACKNOWLEDGED, ACKNOWLEDGE_STATUS.RETURNED])
+
+    def test_reloaded_instance_keeps_status(self):
+        approved = ApprovedItem.objects.get(id=self.approved.id)
+        approved.save()
+        self.assertFalse(ItemHistory.objects.exists())
+
+
+class HistoryPartitionTests(APITestCase):
+
+    def setUp(self):
+        user = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        item_group = G(ItemGroup, organization=user.organization, added_by=user)
+        item = G(Item, item_group=item_group, quantity=1)
+        request = G(RequestedItem, item_group=item_group, requested_by=user, quantity=1)
+        G(ApprovedItem, approved_item=item, request=request, approved_by=user, approved_to=user)
+        self.old = G(ItemHistory, status=ACKNOWLEDGE_STATUS.RETURNED)
+        ItemHistory.all_objects.filter(id=self.old.id).update(created_at=timezone.now() - timedelta(days=200))
+
+    def test_months(self):
+        month = partitions.month_start(timezone.now())
+        self.assertEqual(partitions.add_months(month, 12).year, month.year + 1)
+        self.assertEqual(partitions.month_of(partitions.partition_name(month)), month)
+        self.assertIsNone(partitions.month_of(partitions.TABLE + '_default'))
+
+    def test_archive_moves_old_months_to_files(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        call_command('manage_history_partitions', '--archive', '--retain', '3', '--archive-dir', archive_dir,
+                     stdout=io.StringIO())
+        self.assertFalse(ItemHistory.all_objects.filter(id=self.old.id).exists())
+        self.assertEqual(ItemHistory.all_objects.count(), 1)
+        [name] = os.listdir(archive_dir)
+        with gzip.open(os.path.join(archive_dir, name), 'rt') as archive:
+            self.assertEqual([json.loads(line)['id'] for line in archive], [self.old.id])
+
+
+class OverdueTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        token = G(AuthToken, user=self.admin)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        self.user = G(User, role=ROLE.USER, organization=self.admin.organization)
+        token = G(AuthToken, user=self.user)
+        self.user_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        item = G(Item, item_group=item_group, type=ITEM_TYPE.RETURNABLE, quantity=1)
+        request = G(RequestedItem, item_group=item_group, requested_by=self.user, quantity=1,
+                    type=ITEM_TYPE.RETURNABLE, status=REQUEST_STATUS.APPROVED)
+        self.approved = G(ApprovedItem, approved_item=item, request=request, approved_by=self.admin,
+                          approved_to=self.user, approved_duration=2, status=ACKNOWLEDGE_STATUS.PENDING)
+
+    def test_due_at_follows_acknowledge_update_and_return(self):
+        self.client.post('/my_approved/{id}/acknowledge_item/'.format(id=self.approved.id), **self.user_headers)
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.due_at, self.approved.current_status_date + timedelta(days=2))
+
+        self.client.patch('/my_organization_requests/approved/{id}/'.format(id=self.approved.id),
+                          {'approved_duration': 5}, format='json', **self.auth_headers)
+        self.approved.refresh_from_db()
+        self.assertEqual(self.approved.due_at, self.approved.current_status_date + timedelta(days=5))
+
+        self.client.post('/my_approved/{id}/return_item/'.format(id=self.approved.id), **self.user_headers)
+        self.approved.refresh_from_db()
+        self.assertIsNone(self.approved.due_at)
+
+    def test_item_is_acknowledged_once(self):
+        url = '/my_approved/{id}/acknowledge_item/'.format(id=self.approved.id)
+        self.assertEqual(self.client.post(url, **self.user_headers).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.post(url, **self.user_headers).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(ItemHistory.objects.filter(approved=self.approved,
+                                                    status=ACKNOWLEDGE_STATUS.ACKNOWLEDGED).count(), 1)
+
+    def test_item_is_returned_once(self):
+        self.client.post('/my_approved/{id}/acknowledge_item/'.format(id=self.approved.id), **self.user_headers)
+        response = self.client.post('/my_approved/{id}/return_item/'.format(id=self.approved.id), **self.user_headers)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post('/my_approved/{id}/return_item/'.format(id=self.approved.id), **self.user_headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Item.objects.get(id=self.approved.approved_item_id).quantity, 2)
+        self.assertEqual(ItemHistory.objects.filter(approved=self.approved, status=ACKNOWLEDGE_STATUS.RETURNED).count(), 1)
+
+    def test_overdue_items(self):
+        ApprovedItem.objects.filter(id=self.approved.id).update(status=ACKNOWLEDGE_STATUS.ACKNOWLEDGED,
+                                                                due_at=timezone.now() - timedelta(days=1))
+        response = self.client.get('/my_organization_requests/approved/overdue/', **self.auth_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in response.data], [self.approved.id])
+        response = self.client.get('/my_organization_requests/approved/overdue/', {'page_size': 1},
+                                   **self.auth_headers)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.approved.id])
+
+        recipients = reminders.pending_recipients(REMINDER_KIND.RETURN, self.admin.organization_id, after=0, limit=10)
+        self.assertEqual([recipient['approved_to__email'] for recipient in recipients], [self.user.email])
+
+
+class ReminderScheduleTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        self.user = G(User, role=ROLE.USER, organization=self.admin.organization)
+        token = G(AuthToken, user=self.user)
+        self.user_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(token.key)}
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        item = G(Item, item_group=item_group, type=ITEM_TYPE.RETURNABLE, quantity=1)
+        request = G(RequestedItem, item_group=item_group, requested_by=self.user, quantity=1,
+                    type=ITEM_TYPE.RETURNABLE, status=REQUEST_STATUS.APPROVED)
+        self.approved = G(ApprovedItem, approved_item=item, request=request, approved_by=self.admin,
+                          approved_to=self.user, approved_duration=2, status=ACKNOWLEDGE_STATUS.PENDING)
+        reminders.sync(self.approved)
+
+    def test_schedule_follows_approval_state(self):
+        self.assertEqual(list(ReminderSchedule.objects.values_list('kind', flat=True)), [REMINDER_KIND.ACKNOWLEDGE])
+
+        self.client.post('/my_approved/{id}/acknowledge_item/'.format(id=self.approved.id), **self.user_headers)
+        self.approved.refresh_from_db()
+        schedule = ReminderSchedule.objects.get()
+        self.assertEqual((schedule.kind, schedule.due_at), (REMINDER_KIND.RETURN, self.approved.due_at))
+
+        self.client.post('/my_approved/{id}/return_item/'.format(id=self.approved.id), **self.user_headers)
+        self.assertFalse(ReminderSchedule.objects.exists())
+
+    @mock.patch('base.tasks.send_scheduled_reminder')
+    def test_timer_fires_once(self, send_scheduled_reminder):
+        schedule = ReminderSchedule.objects.get()
+        due_at = timezone.now() - timedelta(minutes=1)
+        ReminderSchedule.objects.filter(id=schedule.id).update(due_at=due_at)
+
+        self.assertEqual(reminders.enqueue_pending(), 1)
+        self.assertEqual(reminders.enqueue_pending(), 0)
+        self.assertTrue(reminders.fire(schedule.id, due_at))
+        self.assertFalse(reminders.fire(schedule.id, due_at))
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.assertGreater(ReminderSchedule.objects.get().due_at, timezone.now())
+
+    @override_settings(REMINDER_SCHEDULER='scan')
+    def test_scan_scheduler_drops_timers(self):
+        schedule = ReminderSchedule.objects.get()
+        self.assertFalse(reminders.fire(schedule.id, schedule.due_at))
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(ReminderSchedule.objects.get().due_at, schedule.due_at)
+
+
+class ReminderScanTests(APITestCase):
+
+    def setUp(self):
+        self.admin = G(User, role=ROLE.ADMIN, organization__name="JTG")
+        item_group = G(ItemGroup, organization=self.admin.organization, added_by=self.admin, is_accessory=False)
+        self.users = []
+        for _ in range(3):
+            user = G(User, role=ROLE.USER, organization=self.admin.organization)
+            item = G(Item, item_group=item_group, type=ITEM_TYPE.RETURNABLE, quantity=1)
+            request = G(RequestedItem, item_group=item_group, requested_by=user, quantity=1,
+                        type=ITEM_TYPE.RETURNABLE, status=REQUEST_STATUS.APPROVED)
+            G(ApprovedItem, approved_item=item, request=request, approved_by=self.admin, approved_to=user,
+              approved_duration=1, status=ACKNOWLEDGE_STATUS.ACKNOWLEDGED, due_at=timezone.now() - timedelta(days=1))
+            self.users.append(user)
+        self.period = timezone.localdate()
+
+    def scan(self):
+        return reminders.run_organization_scan(REMINDER_KIND.RETURN, self.admin.organization_id, self.period,
+                                               batch_size=2)
+
+    def test_scan_is_checkpointed_and_idempotent(self):
+        self.assertEqual(self.scan(), 3)
+        run = ReminderRun.objects.get()
+        self.assertEqual((run.sent, run.last_user_id), (3, max(user.id for user in self.users)))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(self.scan(), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+    def test_scan_resumes_from_checkpoint(self):
+        first = min(user.id for user in self.users)
+        G(ReminderRun, kind=REMINDER_KIND.RETURN, organization=self.admin.organization, period=self.period,
+          last_user_id=first, sent=1, finished_at=None)
+        self.assertEqual(self.scan(), 2)
+        self.assertNotIn(User.objects.get(id=first).email, OutboxEmail.objects.values_list('recipient_email', flat=True))
+
+
+class OutboxTests(APITestCase):
+
+    def setUp(self):
+        notifications.render_cache.clear()
+
+    def test_relay_delivers_once_and_dedups(self):
+        self.assertIsNotNone(outbox.enqueue('a@example.com', 'Hi', html_message='<p>hi</p>', dedup_key='k'))
+        self.assertIsNone(outbox.enqueue('a@example.com', 'Hi', html_message='<p>hi</p>', dedup_key='k'))
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(outbox.relay(), 0)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
+
+    def test_notification_is_rendered_by_relay(self):
+        notifications.notify('a@example.com', 'pending_return.html', {'num_items': 2}, 'Hi')
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.template_name, email.html_message), ('pending_return.html', ''))
+        self.assertEqual(outbox.relay(), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.alternatives[0][0],
+                         loader.get_template('pending_return.html').render({'num_items': 2}))
+        self.assertNotIn('<', message.body)
+
+    def test_interactive_relay_skips_bulk_emails(self):
+        notifications.notify_many([
+            ('u{n}@example.com'.format(n=n), 'pending_return.html', {'num_items': 1}, 'Hi', 'bulk:{n}'.format(n=n))
+            for n in range(3)
+        ])
+        notifications.notify('a@example.com', 'pending_return.html', {'num_items': 1}, 'Hi')
+        self.assertEqual(outbox.relay(priority=EMAIL_PRIORITY.INTERACTIVE), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
+        self.assertEqual(outbox.relay(priority=EMAIL_PRIORITY.BULK), 3)
+
+    def test_render_cache_renders_each_distinct_body_once(self):
+        with mock.patch('base.notifications.loader.get_template', wraps=loader.get_template) as get_template:
+            first = notifications.render('pending_return.html', {'num_items': 2, 'a': 1})
+            self.assertEqual(notifications.render('pending_return.html', {'a': 1, 'num_items': 2}), first)
+            notifications.render('pending_return.html', {'num_items': 3, 'a': 1})
+        self.assertEqual(get_template.call_count, 2)
+
+    def test_render_cache_evicts_least_recently_used(self):
+        cache = notifications.RenderCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    @override_settings(EMAIL_RETRY_BACKOFF_SECONDS=0)
+    @mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=[OSError('down'), 1])
+    def test_transient_failure_is_retried_by_transport(self, send_messages):
+        notifications.notify('a@example.com', 'pending_return.html', {'num_items': 1}, 'Hi')
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(send_messages.call_count, 2)
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
+
+    @override_settings(EMAIL_RETRY_BACKOFF_SECONDS=0)
+    @mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down'))
+    def test_failed_email_is_retried_later(self, send_messages):
+        notifications.notify('a@example.com', 'pending_return.html', {'num_items': 1}, 'Hi')
+        self.assertEqual(outbox.relay(), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.attempts, email.last_error, email.sent_at), (1, 'down', None))
+        self.assertGreater(email.available_at, timezone.now())
@@ -0,0 +1,9 @@
+from item import views
+from rest_framework import routers
+
+router = routers.SimpleRouter()
+router.register(r'', views.ExportView, basename='export')
+
+urlpatterns = []
+
+urlpatterns += router.urls
@@ -0,0 +1,9 @@
+from item import views
+from rest_framework import routers
+
+router = routers.SimpleRouter()
+router.register(r'', views.StatsView, basename='stats')
+
+urlpatterns = []
+
+urlpatterns += router.urls
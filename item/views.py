@@ -1,25 +1,28 @@
-from django.db.models import ObjectDoesNotExist, Count
+from django.db.models import ObjectDoesNotExist
 from django.db import transaction
-from rest_framework import viewsets, status, mixins
+from rest_framework import viewsets, status, mixins, exceptions
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from django_filters import rest_framework as filters
 from datetime import datetime
-from base.tasks import send_email
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from base.query_plan import QueryPlanMixin
+from base import notifications
 from item.filters import ItemHistoryFilter
 from item.models import Item, ItemGroup, RequestedItem, ApprovedItem, ItemHistory
 from item.permissions import IsAdminOrManagerActions, IsAdminOrManager
 from item.serializers import (ItemGroupSerializer, ItemSerializer,
                               RequestedItemSerializer, ApprovedItemSerializer,
-                              MyRequestStatsSerializer, MyApproveStatsSerializer,
-                              ItemHistorySerializer)
+                              ItemHistorySerializer, BulkApproveSerializer)
+from item.stats import REQUEST_STATS, APPROVE_STATS, STATS_SOURCES, organization_requests, organization_approved
+from item import counters, history, importers, exporters, inventory, ledger, reminders
 from item import exceptions as item_exception
-from django.template import loader
 from utils import constants
 
 
-class ItemGroupView(viewsets.ModelViewSet):
+class ItemGroupView(QueryPlanMixin, viewsets.ModelViewSet):
     """
     View to CRUD ItemGroup
     Permissions: Only ADMIN and MANAGERS are allowed WRITE OPERATIONS
@@ -54,8 +57,38 @@ class ItemGroupView(viewsets.ModelViewSet):
             raise item_exception.InvalidItemGroupDelete
         return super(ItemGroupView, self).perform_destroy(instance)
 
-
-class ItemView(viewsets.ModelViewSet):
+    @action(methods=['GET'], detail=True)
+    def stock(self, request, id):
+        """
+        Stock of the item group at a point in time (latest StockSnapshot + following StockMovements)
+        Filters: ?at={datetime} (optional, default now)&start={datetime} (optional, adds the stock at start
+                 and the movements in between)
+        :return: quantity (and range details)
+        """
+        item_group = self.get_object()
+        at = self.parse_datetime_param('at') or timezone.now()
+        data = {'item_group_id': item_group.id, 'at': at, 'quantity': ledger.quantity_at(at, item_group_id=item_group.id)}
+        start = self.parse_datetime_param('start')
+        if start:
+            movements = ledger.movements_between(start, at, item_group_id=item_group.id)
+            data['start'] = start
+            data['start_quantity'] = ledger.quantity_at(start, item_group_id=item_group.id)
+            data['movements'] = list(movements.order_by('created_at').values('item_id', 'delta', 'reason', 'created_at'))
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    def parse_datetime_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise exceptions.ValidationError({name: 'Invalid datetime.'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+
+class ItemView(QueryPlanMixin, viewsets.ModelViewSet):
     """
     View to CRUD Items in a ItemGroup
     Permissions: Only ADMIN and MANAGERS are allowed WRITE OPERATIONS
@@ -97,7 +130,9 @@ class ItemView(viewsets.ModelViewSet):
         """
         if instance.is_assigned and instance.type != constants.ITEM_TYPE.PERMANENT:
             raise item_exception.InvalidItemDelete
-        super(ItemView, self).perform_destroy(instance)
+        with transaction.atomic():
+            super(ItemView, self).perform_destroy(instance)
+            ledger.record(instance, -instance.quantity, constants.STOCK_MOVEMENT_REASON.REMOVED)
 
     @action(methods=['GET'], detail=False)
     def user(self, request, item_group_id):
@@ -117,8 +152,42 @@ class ItemView(viewsets.ModelViewSet):
         item_serializer = ItemSerializer(qs, many=True)
         return Response(data=item_serializer.data, status=status.HTTP_200_OK)
 
+    @action(methods=['POST'], detail=False)
+    def bulk_import(self, request, item_group_id):
+        """
+        Streams items from a CSV or JSON Lines body (or multipart "file") into the ItemGroup, see ItemImporter.
+        Filters: ?file_type={csv|jsonl} (optional, guessed from content type / file name)&batch_size={int} (optional)
+        :return: created count and per row errors
+        """
+        try:
+            item_group = ItemGroup.objects.get(id=item_group_id, organization=request.user.organization)
+        except ObjectDoesNotExist:
+            raise item_exception.NotFound
+
+        upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else None
+        stream = upload if upload is not None else request.stream
+        file_type = request.query_params.get('file_type')
+        if not file_type:
+            name = upload.name if upload is not None else ''
+            is_csv = name.endswith('.csv') or request.content_type.startswith('text/csv')
+            file_type = importers.CSV if is_csv else importers.JSONL
+
+        batch_size = request.query_params.get('batch_size')
+        if batch_size:
+            try:
+                batch_size = int(batch_size)
+            except ValueError:
+                raise item_exception.InvalidBatchSize
+            if batch_size <= 0:
+                raise item_exception.InvalidBatchSize
+        item_importer = importers.ItemImporter(item_group, batch_size=batch_size or None)
+        result = item_importer.run(stream if stream is not None else [], file_type)
+        # Bad rows are reported in the body, the request itself was valid even if nothing was created
+        return Response(data=result, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_200_OK)
+
 
 class ItemHistoryView(
+    QueryPlanMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet
 ):
@@ -131,18 +200,15 @@ class ItemHistoryView(
     def get_queryset(self):
         item_group_id = self.kwargs['item_group_id']
         item_id = self.kwargs['item_id']
-        return ItemHistory.all_objects.select_related(
-            'approved__approved_to',
-            'approved__approved_by',
-            'approved__request',
-            'approved__approved_item__item_group__organization'
-        ).filter(
-            approved__approved_item__item_group__organization=self.request.user.organization,
-            approved__approved_item__id=item_id
+        # Snapshot columns only, served from the (organization, item, -created_at) index
+        return ItemHistory.all_objects.filter(
+            organization=self.request.user.organization,
+            item_id=item_id
         )
 
 
 class RequestedItemView(
+    QueryPlanMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.DestroyModelMixin,
@@ -192,15 +258,16 @@ class RequestedItemView(
         :param instance: RequestedItem to be CANCELLED
         :return: HTTP_204_NO_CONTENT if success else exception
         """
-        if instance.status is constants.REQUEST_STATUS.PENDING:
-            instance.status = constants.REQUEST_STATUS.CANCELLED
-            instance.current_status_date = datetime.now()
-            instance.save()
-            return status.HTTP_204_NO_CONTENT
-        raise item_exception.DestroyRequestException
+        with transaction.atomic():
+            # Conditional UPDATE, a request approved, rejected or cancelled meanwhile matches no row
+            if not counters.transition(instance, instance.item_group.organization_id, constants.REQUEST_STATUS.PENDING,
+                                       constants.REQUEST_STATUS.CANCELLED, current_status_date=datetime.now()):
+                raise item_exception.DestroyRequestException
+        return status.HTTP_204_NO_CONTENT
 
 
 class ManageRequestView(
+    QueryPlanMixin,
     mixins.RetrieveModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -261,15 +328,28 @@ class ManageRequestView(
         :param instance: RequestedItem to be REJECTED
         :return: HTTP_204_NO_CONTENT if success else exception
         """
-        if instance.status is constants.REQUEST_STATUS.PENDING:
-            instance.status = constants.REQUEST_STATUS.REJECTED
-            instance.current_status_date = datetime.now()
-            instance.save()
-            return status.HTTP_204_NO_CONTENT
-        raise item_exception.DestroyRequestException
+        with transaction.atomic():
+            # Conditional UPDATE, a request approved, rejected or cancelled meanwhile matches no row
+            if not counters.transition(instance, instance.item_group.organization_id, constants.REQUEST_STATUS.PENDING,
+                                       constants.REQUEST_STATUS.REJECTED, current_status_date=datetime.now()):
+                raise item_exception.DestroyRequestException
+        return status.HTTP_204_NO_CONTENT
+
+    @action(methods=['POST'], detail=False, permission_classes=(IsAdminOrManager,))
+    def bulk_approve(self, request):
+        """
+        Approves many requests in one call (all or nothing).
+        Body: {"approvals": [{"request_id": id, "item_id": id, "approved_duration": days (optional)}, ...]}
+        :return: created ApprovedItems or per index errors
+        """
+        bulk_approve_serializer = BulkApproveSerializer(data=request.data, context={'request': request})
+        bulk_approve_serializer.is_valid(raise_exception=True)
+        instances = bulk_approve_serializer.save()
+        return Response(status=status.HTTP_201_CREATED, data=ApprovedItemSerializer(instances, many=True).data)
 
 
 class MyRequests(
+    QueryPlanMixin,
     mixins.RetrieveModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -306,44 +386,20 @@ class MyRequests(
         :param instance - RequestedItem to be REJECTED
         :return - HTTP_204_NO_CONTENT if success else exception
         """
-        if instance.status is constants.REQUEST_STATUS.PENDING:
-            instance.status = constants.REQUEST_STATUS.CANCELLED
-            instance.current_status_date = datetime.now()
-            instance.save()
-            return status.HTTP_204_NO_CONTENT
-        raise item_exception.DestroyRequestException
+        with transaction.atomic():
+            # Conditional UPDATE, a request approved, rejected or cancelled meanwhile matches no row
+            if not counters.transition(instance, instance.item_group.organization_id, constants.REQUEST_STATUS.PENDING,
+                                       constants.REQUEST_STATUS.CANCELLED, current_status_date=datetime.now()):
+                raise item_exception.DestroyRequestException
+        return status.HTTP_204_NO_CONTENT
 
     @action(methods=['GET'], detail=False)
     def stats(self, request):
-        qs = self.get_queryset()
-        requests_pending = 0
-        requests_approved = 0
-        requests_cancelled = 0
-        requests_rejected = 0
-
-        result = qs.values('status').order_by().annotate(count=Count('status'))
-        for elem in result:
-            if elem['status'] == constants.REQUEST_STATUS.PENDING:
-                requests_pending = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.APPROVED:
-                requests_approved = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.CANCELLED:
-                requests_cancelled = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.REJECTED:
-                requests_rejected = elem['count']
-
-        request_stats_serializer = MyRequestStatsSerializer(data={
-            'requests_pending': requests_pending,
-            'requests_approved': requests_approved,
-            'requests_cancelled': requests_cancelled,
-            'requests_rejected': requests_rejected,
-            'requests_total': requests_pending + requests_approved + requests_cancelled + requests_rejected
-        })
-        request_stats_serializer.is_valid(raise_exception=True)
-        return Response(status=status.HTTP_200_OK, data=request_stats_serializer.data)
+        return Response(status=status.HTTP_200_OK, data=REQUEST_STATS.aggregate(self.get_queryset()))
 
 
 class ApprovedItemView(
+    QueryPlanMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
@@ -386,6 +442,7 @@ class ApprovedItemView(
 
 
 class MyApproved(
+    QueryPlanMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet
@@ -429,12 +486,21 @@ class MyApproved(
         """
         try:
             approved_request = self.get_queryset().get(id=id)
-            if approved_request.status == constants.ACKNOWLEDGE_STATUS.PENDING:
-                approved_request.status = constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED
-                approved_request.current_status_date = datetime.now()
-                approved_request.save()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            raise item_exception.AcknowledgeItemException
+            current_status_date = datetime.now()
+            approved_request.current_status_date = current_status_date
+            approved_request.status = constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED
+            approved_request.update_due_at()
+            with history.atomic():
+                # Conditional UPDATE, a repeated or concurrent acknowledge matches no row
+                if not counters.transition(approved_request, approved_request.approved_item.item_group.organization_id,
+                                           constants.ACKNOWLEDGE_STATUS.PENDING,
+                                           constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED,
+                                           current_status_date=current_status_date, due_at=approved_request.due_at):
+                    raise item_exception.AcknowledgeItemException
+                history.record(approved_request.id, approved_request.status)
+                approved_request._history_status = approved_request.status
+                reminders.sync(approved_request)
+            return Response(status=status.HTTP_204_NO_CONTENT)
         except ObjectDoesNotExist:
             raise item_exception.NotFound
 
@@ -451,47 +517,22 @@ class MyApproved(
             if approved_request.approved_item.type == constants.ITEM_TYPE.PERMANENT or approved_request.approved_item.item_group.is_accessory:
                 raise item_exception.ReturnPermanentItemException
 
-            if approved_request.status == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED:
-                with transaction.atomic():
-                    approved_request.status = constants.ACKNOWLEDGE_STATUS.RETURNED
-                    approved_request.current_status_date = datetime.now()
-                    approved_request.approved_item.is_assigned = False
-                    approved_request.approved_item.quantity += approved_request.request.quantity
-
-                    approved_request.approved_item.save()
-                    approved_request.save()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            raise item_exception.ReturnItemException
+            with history.atomic():
+                # Conditional UPDATE, a concurrent or repeated return matches no row and credits nothing
+                if not inventory.give_back(approved_request):
+                    raise item_exception.ReturnItemException
+                reminders.sync(approved_request)
+            return Response(status=status.HTTP_204_NO_CONTENT)
         except ObjectDoesNotExist:
             raise item_exception.NotFound
 
     @action(methods=['GET'], detail=False)
     def stats(self, request):
-        qs = self.get_queryset()
-        approve_pending = 0
-        approve_acknowledged = 0
-        approve_returned = 0
-
-        result = qs.values('status').order_by().annotate(count=Count('status'))
-        for elem in result:
-            if elem['status'] == constants.ACKNOWLEDGE_STATUS.PENDING:
-                approve_pending = elem['count']
-            elif elem['status'] == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED:
-                approve_acknowledged = elem['count']
-            elif elem['status'] == constants.ACKNOWLEDGE_STATUS.RETURNED:
-                approve_returned = elem['count']
-
-        approve_stats_serializer = MyApproveStatsSerializer(data={
-            'approve_pending': approve_pending,
-            'approve_acknowledged': approve_acknowledged,
-            'approve_returned': approve_returned,
-            'approve_total': approve_pending + approve_acknowledged + approve_returned
-        })
-        approve_stats_serializer.is_valid(raise_exception=True)
-        return Response(status=status.HTTP_200_OK, data=approve_stats_serializer.data)
+        return Response(status=status.HTTP_200_OK, data=APPROVE_STATS.aggregate(self.get_queryset()))
 
 
 class MyOrganizationRequests(
+    QueryPlanMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet
 ):
@@ -510,35 +551,11 @@ class MyOrganizationRequests(
 
     @action(methods=['GET'], detail=False)
     def stats(self, request):
-        qs = self.get_queryset()
-        requests_pending = 0
-        requests_approved = 0
-        requests_cancelled = 0
-        requests_rejected = 0
-
-        result = qs.values('status').order_by().annotate(count=Count('status'))
-        for elem in result:
-            if elem['status'] == constants.REQUEST_STATUS.PENDING:
-                requests_pending = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.APPROVED:
-                requests_approved = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.CANCELLED:
-                requests_cancelled = elem['count']
-            elif elem['status'] == constants.REQUEST_STATUS.REJECTED:
-                requests_rejected = elem['count']
-
-        request_stats_serializer = MyRequestStatsSerializer(data={
-            'requests_pending': requests_pending,
-            'requests_approved': requests_approved,
-            'requests_cancelled': requests_cancelled,
-            'requests_rejected': requests_rejected,
-            'requests_total': requests_pending + requests_approved + requests_cancelled + requests_rejected
-        })
-        request_stats_serializer.is_valid(raise_exception=True)
-        return Response(status=status.HTTP_200_OK, data=request_stats_serializer.data)
+        return Response(status=status.HTTP_200_OK, data=organization_requests(request.user))
 
 
 class MyOrganizationApprovedRequests(
+    QueryPlanMixin,
     mixins.ListModelMixin,
     mixins.UpdateModelMixin,
     viewsets.GenericViewSet
@@ -550,6 +567,7 @@ class MyOrganizationApprovedRequests(
                      'approved_by__last_name', 'approved_to__last_name',)
     filterset_fields = ('request__type', 'status',)
     lookup_field = 'id'
+    query_plan_actions = ('list', 'retrieve', 'overdue')
 
     def get_queryset(self):
         user = self.request.user
@@ -559,28 +577,25 @@ class MyOrganizationApprovedRequests(
 
     @action(methods=['GET'], detail=False)
     def stats(self, request):
-        qs = self.get_queryset()
-        approve_pending = 0
-        approve_acknowledged = 0
-        approve_returned = 0
-
-        result = qs.values('status').order_by().annotate(count=Count('status'))
-        for elem in result:
-            if elem['status'] == constants.ACKNOWLEDGE_STATUS.PENDING:
-                approve_pending = elem['count']
-            elif elem['status'] == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED:
-                approve_acknowledged = elem['count']
-            elif elem['status'] == constants.ACKNOWLEDGE_STATUS.RETURNED:
-                approve_returned = elem['count']
-
-        approve_stats_serializer = MyApproveStatsSerializer(data={
-            'approve_pending': approve_pending,
-            'approve_acknowledged': approve_acknowledged,
-            'approve_returned': approve_returned,
-            'approve_total': approve_pending + approve_acknowledged + approve_returned
-        })
-        approve_stats_serializer.is_valid(raise_exception=True)
-        return Response(status=status.HTTP_200_OK, data=approve_stats_serializer.data)
+        return Response(status=status.HTTP_200_OK, data=organization_approved(request.user))
+
+    @action(methods=['GET'], detail=False)
+    def overdue(self, request):
+        """
+        Acknowledged items of the organization past their due date, most overdue first
+        :param request: default
+        :return: approved items, paginated when ?page_size is given
+        """
+        queryset = self.filter_queryset(self.get_queryset().filter(
+            status=constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED,
+            due_at__lt=timezone.now()
+        )).order_by('due_at', 'id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
 
     @action(methods=['GET'], detail=True)
     def send_reminder(self, request, id):
@@ -597,17 +612,70 @@ class MyOrganizationApprovedRequests(
                 context = {
                     'num_items': 1
                 }
-                html_message = loader.get_template('pending_acknowledge.html').render(context)
-                send_email.delay(html_message=html_message, recipient_email=recipient_email,
-                                 subject=constants.SUBJECT_REMINDER_TO_ACKNOWLEDGE)
+                notifications.notify(recipient_email, 'pending_acknowledge.html', context,
+                                     constants.SUBJECT_REMINDER_TO_ACKNOWLEDGE)
             elif approved_item.status == constants.ACKNOWLEDGE_STATUS.ACKNOWLEDGED:
                 recipient_email = approved_item.approved_to.email
                 context = {
                     'num_items': 1
                 }
-                html_message = loader.get_template('pending_return.html').render(context)
-                send_email.delay(html_message=html_message, recipient_email=recipient_email,
-                                 subject=constants.SUBJECT_REMINDER_TO_RETURN)
+                notifications.notify(recipient_email, 'pending_return.html', context,
+                                     constants.SUBJECT_REMINDER_TO_RETURN)
             return Response(status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
+
+
+class StatsView(viewsets.ViewSet):
+    """
+    Several stats families in one round trip.
+    Filters: ?include={comma separated families} (optional, defaults to every family allowed for currentUser)
+    families:   my_requests, my_approved,
+                organization_requests, organization_approved (ADMIN and MANAGER only)
+    """
+
+    def list(self, request):
+        user = request.user
+        is_approver = user.role in (constants.ROLE.ADMIN, constants.ROLE.MANAGER,)
+        include = request.query_params.get('include')
+        if include:
+            names = [name.strip() for name in include.split(',') if name.strip()]
+        else:
+            names = [name for name, (_, approver_only) in STATS_SOURCES.items() if is_approver or not approver_only]
+
+        data = {}
+        for name in names:
+            if name not in STATS_SOURCES:
+                raise item_exception.InvalidStatsFamily
+            get_stats, approver_only = STATS_SOURCES[name]
+            if approver_only and not is_approver:
+                raise exceptions.PermissionDenied
+            data[name] = get_stats(user)
+        return Response(status=status.HTTP_200_OK, data=data)
+
+
+class ExportView(viewsets.ViewSet):
+    """
+    Streams full organization dumps for auditors.
+    Permissions: ADMIN and MANAGER
+    Filters: ?file_type={csv|jsonl} (default csv)
+             history also accepts ?start_date={datetime}&end_date={datetime}
+    """
+    permission_classes = (IsAdminOrManager,)
+
+    def get_file_type(self):
+        file_type = self.request.query_params.get('file_type', exporters.CSV)
+        if file_type not in exporters.FILE_TYPES:
+            raise exceptions.ValidationError('file_type should be one of csv, jsonl')
+        return file_type
+
+    @action(methods=['GET'], detail=False)
+    def inventory(self, request):
+        rows = exporters.inventory_rows(request.user.organization)
+        return exporters.streaming_response(rows, exporters.INVENTORY_FIELDS, self.get_file_type(), 'inventory')
+
+    @action(methods=['GET'], detail=False)
+    def history(self, request):
+        qs = ItemHistoryFilter(request.query_params, queryset=exporters.history_queryset(request.user.organization)).qs
+        rows = exporters.history_rows(qs)
+        return exporters.streaming_response(rows, exporters.HISTORY_FIELDS, self.get_file_type(), 'history')
@@ -4,6 +4,8 @@ from base.models import BaseModel
 
 class Organization(BaseModel):
     name = models.CharField(max_length=100)
+    # Notifications to a member are buffered this long and sent as one digest email, 0 sends each right away
+    digest_window_minutes = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from base.token_cache import token_cache
+from user.models import User
+
+
+@receiver(post_save, sender=User, dispatch_uid="invalidate_user_tokens")
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """
+    Cached tokens carry a copy of the user, drop them whenever the user changes (is_active, trashed, role...)
+    """
+    token_cache.invalidate_user(instance.id)
+
+
+@receiver(pre_delete, sender=User, dispatch_uid="invalidate_deleted_user_tokens")
+def invalidate_deleted_user_tokens(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.id)
@@ -72,6 +72,42 @@ REQUESTED_TO_CHOICES = (
     (REQUESTED_TO.USER, 'User'),
 )
 
+STOCK_MOVEMENT_REASON = namedtuple('STOCK_MOVEMENT_REASON', ['ADDED', 'APPROVED', 'RETURNED', 'ADJUSTED', 'REMOVED'])(
+    ADDED=19,
+    APPROVED=20,
+    RETURNED=21,
+    ADJUSTED=22,
+    REMOVED=23
+)
+
+STOCK_MOVEMENT_REASON_CHOICES = (
+    (STOCK_MOVEMENT_REASON.ADDED, 'Added'),
+    (STOCK_MOVEMENT_REASON.APPROVED, 'Approved'),
+    (STOCK_MOVEMENT_REASON.RETURNED, 'Returned'),
+    (STOCK_MOVEMENT_REASON.ADJUSTED, 'Adjusted'),
+    (STOCK_MOVEMENT_REASON.REMOVED, 'Removed'),
+)
+
+REMINDER_KIND = namedtuple('REMINDER_KIND', ['ACKNOWLEDGE', 'RETURN'])(
+    ACKNOWLEDGE=24,
+    RETURN=25
+)
+
+REMINDER_KIND_CHOICES = (
+    (REMINDER_KIND.ACKNOWLEDGE, 'Acknowledge'),
+    (REMINDER_KIND.RETURN, 'Return'),
+)
+
+EMAIL_PRIORITY = namedtuple('EMAIL_PRIORITY', ['INTERACTIVE', 'BULK'])(
+    INTERACTIVE=26,
+    BULK=27
+)
+
+EMAIL_PRIORITY_CHOICES = (
+    (EMAIL_PRIORITY.INTERACTIVE, 'Interactive'),
+    (EMAIL_PRIORITY.BULK, 'Bulk'),
+)
+
 USER_DOES_NOT_EXISTS = 'User does not exist'
 EMAIL_AND_PASSWORD_REQUIRED = 'Email and password required'
 
@@ -80,3 +116,4 @@ SUBJECT_INVITATION = 'Invitation'
 SUBJECT_REQUEST_APPROVED = 'Request approved'
 SUBJECT_REMINDER_TO_ACKNOWLEDGE = 'Reminder to acknowledge items'
 SUBJECT_REMINDER_TO_RETURN = 'Reminder to return items'
+SUBJECT_DIGEST = '{num_events} new notifications'
@@ -1,17 +1,45 @@
-from django.core.mail import get_connection, EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives
 import uuid
 
 
 def generate_key():
-    return uuid.uuid4().hex
+    """
+    Random key of auth tokens (UUIDField) and invites (stored as its hex)
+    :return: uuid.UUID
+    """
+    return uuid.uuid4()
+
+
+def parse_key(key):
+    """
+    Parses a key generated by generate_key (hex or dashed form)
+    :return: uuid.UUID or None if key is malformed
+    """
+    try:
+        return uuid.UUID(str(key))
+    except ValueError:
+        return None
+
+
+def html_email(subject, text, html, from_email, recipient, connection=None):
+    message = EmailMultiAlternatives(subject, text, from_email, recipient, connection=connection)
+    message.attach_alternative(html, 'text/html')
+    return message
 
 
 def send_mass_html_mail(datatuple, fail_silently=False):
-    connection = get_connection(fail_silently=fail_silently)
-    messages = []
-    for subject, text, html, from_email, recipient in datatuple:
-        message = EmailMultiAlternatives(subject, text, from_email, recipient)
-        message.attach_alternative(html, 'text/html')
-        messages.append(message)
-    return connection.send_messages(messages)
+    """
+    Sends (subject, text, html, from_email, recipient_list) emails through the pooled transport (base.transport)
+    :return: number of emails sent
+    """
+    from base import transport
+    messages = [
+        html_email(subject, text, html, from_email, recipient)
+        for subject, text, html, from_email, recipient in datatuple
+    ]
+    errors = transport.send(messages)
+    for error in errors:
+        if error is not None and not fail_silently:
+            raise error
+    return sum(1 for error in errors if error is None)
 